@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks for performance-sensitive parts of h.
+
+These are not run as part of the test suite. Run an individual benchmark as a
+module from the root of the repository, e.g.::
+
+    python -m bench.streamer_filter
+"""
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for exporting all of a group's annotations.
+
+Creates an open group with ``--annotations`` annotations (by default a
+million) in the database and Elasticsearch index of the development
+environment (``conf/development-app.ini``), and then exports them with
+:py:class:`h.services.annotation_export.AnnotationExportService`, as
+``hypothesis export group=<pubid>`` and ``/api/export`` do, discarding the
+output.
+
+Reports the number of annotations exported per second, the time taken to
+export the first page, and the peak memory used. The group and its
+annotations are deleted again afterwards.
+
+Usage::
+
+    python -m bench.annotation_export [--annotations N] [--page-size N]
+"""
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import resource
+import time
+
+from webob.multidict import MultiDict
+
+from h import models
+from h.cli import bootstrap
+from h.search.index import BatchIndexer
+from h.search.query import LIMIT_MAX
+from h.services.annotation_export import annotation_export_service_factory
+
+# The number of annotations inserted into the database at a time.
+INSERT_BATCH_SIZE = 10000
+
+TARGET_URI = 'http://example.com/export-benchmark'
+
+
+def create_group(request):
+    user = models.User(username='exportbench',
+                       authority=request.default_authority,
+                       email='exportbench@example.com')
+    request.db.add(user)
+    request.db.flush()
+
+    group_svc = request.find_service(name='group')
+    group = group_svc.create_open_group(name='Export benchmark',
+                                        userid=user.userid,
+                                        origins=['http://example.com'])
+    request.tm.commit()
+    return user.userid, group.pubid
+
+
+def create_annotations(request, userid, pubid, count):
+    document = models.Document()
+    request.db.add(document)
+    request.db.flush()
+    document_id = document.id
+    request.tm.commit()
+
+    table = models.Annotation.__table__
+    for start in range(0, count, INSERT_BATCH_SIZE):
+        request.db.execute(table.insert(), [
+            {'userid': userid,
+             'groupid': pubid,
+             'target_uri': TARGET_URI,
+             'target_uri_normalized': TARGET_URI,
+             'text': 'Annotation {}'.format(n),
+             'shared': True,
+             'document_id': document_id}
+            for n in range(start, min(start + INSERT_BATCH_SIZE, count))])
+        request.tm.commit()
+
+    ids = [id_ for (id_,) in
+           request.db.query(models.Annotation.id).filter_by(groupid=pubid)]
+
+    indexer = BatchIndexer(request.db, request.es, request)
+    errored = indexer.index(ids)
+    if errored:
+        print('Failed to index {} annotations'.format(len(errored)))
+    request.es.conn.indices.refresh(index=request.es.index)
+
+    return document_id
+
+
+def delete_group(request, userid, pubid, document_id):
+    request.es.conn.delete_by_query(index=request.es.index,
+                                    body={'query': {'term': {'group': pubid}}})
+    request.db.query(models.Annotation).filter_by(groupid=pubid).delete(
+        synchronize_session=False)
+    request.db.query(models.Document).filter_by(id=document_id).delete(
+        synchronize_session=False)
+    request.db.query(models.Group).filter_by(pubid=pubid).delete(
+        synchronize_session=False)
+    request.db.query(models.User).filter_by(username='exportbench').delete(
+        synchronize_session=False)
+    request.tm.commit()
+
+
+def rss():
+    """Return the peak resident set size of this process, in MiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_export(request, pubid, page_size):
+    svc = annotation_export_service_factory(None, request)
+    svc.page_size = page_size
+
+    rss_before = rss()
+    count = 0
+    first_page = None
+    start = time.time()
+    for _ in svc.export(MultiDict({'group': pubid})):
+        count += 1
+        if count == page_size:
+            first_page = time.time() - start
+    elapsed = time.time() - start
+
+    print('Exported {} annotations in {:.1f}s: {:.0f} annotations/s'.format(
+        count, elapsed, count / elapsed if elapsed else 0))
+    if first_page is not None:
+        print('First page of {} annotations after {:.2f}s'.format(page_size, first_page))
+    print('Peak memory: {:.0f} MiB ({:+.0f} MiB during the export)'.format(
+        rss(), rss() - rss_before))
+
+
+def run(args):
+    request = bootstrap(args.app_url, dev=True)
+
+    print('Creating {} annotations...'.format(args.annotations))
+    userid, pubid = create_group(request)
+    document_id = None
+    try:
+        document_id = create_annotations(request, userid, pubid, args.annotations)
+        bench_export(request, pubid, args.page_size)
+    finally:
+        request.tm.abort()
+        delete_group(request, userid, pubid, document_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--app-url', default='http://localhost:5000',
+                        help='The base URL of the application')
+    parser.add_argument('--annotations', type=int, default=1000000,
+                        help='The number of annotations in the exported group')
+    parser.add_argument('--page-size', type=int, default=LIMIT_MAX,
+                        help='The number of annotations searched for at a time')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
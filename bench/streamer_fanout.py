@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Load test for the streamer's fan-out of annotation events to websockets.
+
+Connects thousands of simulated websockets, each with a realistic filter and
+set of principals, and then feeds a stream of synthetic annotation events
+through the streamer, first one at a time through
+:py:func:`h.streamer.messages.handle_annotation_event` and then through the
+streamer's work queue with :py:func:`h.streamer.streamer.process_work_queue`.
+
+Reports the memory used per connection, the fan-out latency of individual
+events (the time taken to handle an event and write it to every socket which
+should receive it) and the number of events handled per second.
+
+The annotations referred to by the events are created in the database at
+``--database-url`` (by default, the one in the ``DATABASE_URL`` environment
+variable) and deleted again afterwards. The database schema is created if
+necessary.
+
+Usage::
+
+    python -m bench.streamer_fanout [--sockets N] [--events N]
+        [--documents N] [--annotations N] [--batch-size N] [--snapshots]
+"""
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import os
+import random
+import resource
+import time
+import uuid
+
+import gevent
+from gevent.queue import Queue
+from pyramid import security
+from pyramid.config import Configurator
+import sqlalchemy
+
+from h import db
+from h import models
+from h import presenters
+from h import realtime
+from h.services.groupfinder import GroupfinderService
+from h.services.links import LinksService
+from h.streamer import messages
+from h.streamer import streamer
+from h.streamer import websocket
+from h.traversal import AnnotationContext
+
+APP_URL = 'http://localhost:5000'
+AUTHORITY = 'example.com'
+
+ACTIONS = {'create': True, 'update': True, 'delete': True}
+
+# The proportions of connected clients which are the sidebar (subscribed to
+# the URIs of one page), the stream page (subscribed to everything) and the
+# stream page filtered to a single user.
+CLIENT_MIX = [('sidebar', 0.9), ('stream', 0.05), ('user stream', 0.05)]
+
+# The proportion of clients which are logged in.
+LOGGED_IN = 0.3
+
+
+class FakeSock(object):
+    """A stand-in for a connected socket which discards everything sent."""
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def sendall(self, data):
+        self.bytes_sent += len(data)
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+def document_uris(n):
+    """Return the URIs of the `n`th document, as the sidebar would expand them."""
+    uri = 'https://example.com/articles/{}'.format(n)
+    return [uri,
+            uri + '?print=1',
+            uri.replace('https://', 'https://www.'),
+            'urn:x-pdf:{:032x}'.format(n)]
+
+
+def make_registry():
+    """Return a registry with the routes and links the streamer needs."""
+    config = Configurator(settings={'h.app_url': APP_URL,
+                                    'h.authority': AUTHORITY})
+    config.include('pyramid_services')
+    config.include('h.services')
+    config.include('h.links')
+    config.add_route('annotation', '/a/{id}', static=True)
+    config.add_route('api.annotation', '/api/annotations/{id}', static=True)
+    config.commit()
+    return config.registry
+
+
+def create_annotations(session, documents, count):
+    """Create `count` annotations spread over `documents` documents."""
+    userids = ['acct:bench{}@{}'.format(n, AUTHORITY) for n in range(50)]
+    annotations = []
+    for n in range(count):
+        doc = n % documents
+        uri = document_uris(doc)[0]
+        annotation = models.Annotation(
+            userid=random.choice(userids),
+            groupid='__world__',
+            shared=True,
+            target_uri=uri,
+            text='Benchmark annotation {}'.format(n),
+            tags=['bench', 'tag{}'.format(n % 10)],
+            target_selectors=[{'type': 'TextQuoteSelector',
+                               'exact': 'some quoted text',
+                               'prefix': 'before ',
+                               'suffix': ' after'}],
+            document=models.Document(),
+        )
+        session.add(annotation)
+        annotations.append(annotation)
+    session.commit()
+    return annotations
+
+
+def delete_annotations(session, ids, document_ids):
+    session.query(models.Annotation).filter(
+        models.Annotation.id.in_(ids)).delete(synchronize_session=False)
+    session.query(models.Document).filter(
+        models.Document.id.in_(document_ids)).delete(synchronize_session=False)
+    session.commit()
+
+
+def snapshot(annotation, session, registry):
+    """Return an annotation snapshot, as published by the web application."""
+    resource = AnnotationContext(annotation,
+                                 GroupfinderService(session, AUTHORITY),
+                                 LinksService(APP_URL, registry))
+    return {
+        'version': realtime.ANNOTATION_SNAPSHOT_VERSION,
+        'annotation': presenters.AnnotationJSONPresenter(resource).asdict(),
+        'userid': annotation.userid,
+        'groupid': annotation.groupid,
+        'shared': annotation.shared,
+        'target_uri': annotation.target_uri,
+        'nipsa': False,
+    }
+
+
+def make_events(annotations, count, session, registry, with_snapshots):
+    snapshots = {}
+    events = []
+    for n in range(count):
+        annotation = random.choice(annotations)
+        event = {'annotation_id': annotation.id,
+                 'action': random.choice(['create', 'update']),
+                 'src_client_id': 'bench-publisher'}
+        if with_snapshots:
+            if annotation.id not in snapshots:
+                snapshots[annotation.id] = snapshot(annotation, session, registry)
+            event['snapshot'] = snapshots[annotation.id]
+        events.append(event)
+    session.close()
+    return events
+
+
+def client_filter(kind, documents):
+    if kind == 'sidebar':
+        uris = document_uris(random.randrange(documents))
+        clauses = [{'field': '/uri', 'operator': 'one_of', 'value': uris}]
+        return {'match_policy': 'include_any', 'clauses': clauses,
+                'actions': ACTIONS}
+    if kind == 'user stream':
+        userid = 'acct:bench{}@{}'.format(random.randrange(50), AUTHORITY)
+        clauses = [{'field': '/user', 'operator': 'equals', 'value': userid}]
+        return {'match_policy': 'include_all', 'clauses': clauses,
+                'actions': ACTIONS}
+    return {'match_policy': 'include_all', 'clauses': [], 'actions': ACTIONS}
+
+
+def client_principals(n):
+    if random.random() >= LOGGED_IN:
+        return None, [security.Everyone, 'group:__world__']
+    userid = 'acct:reader{}@{}'.format(n, AUTHORITY)
+    return userid, [security.Everyone,
+                    security.Authenticated,
+                    userid,
+                    'group:__world__',
+                    'group:private{}'.format(n % 100)]
+
+
+def connect_sockets(count, documents, registry, work_queue):
+    """Connect `count` simulated websockets, each with a filter."""
+    kinds = [kind for kind, proportion in CLIENT_MIX
+             for _ in range(int(proportion * 100))]
+    sockets = []
+    for n in range(count):
+        userid, principals = client_principals(n)
+        environ = {
+            'h.ws.authenticated_userid': userid,
+            'h.ws.effective_principals': principals,
+            'h.ws.registry': registry,
+            'h.ws.streamer_work_queue': work_queue,
+        }
+        socket = websocket.WebSocket(FakeSock(), environ=environ)
+        socket.client_id = uuid.uuid4().hex
+        filter_ = client_filter(random.choice(kinds), documents)
+        websocket.handle_filter_message(
+            websocket.Message(socket=socket, payload={'filter': filter_}))
+        sockets.append(socket)
+    return sockets
+
+
+def rss():
+    """Return the resident set size of this process, in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # N.B. ru_maxrss is in kilobytes on Linux, but bytes on macOS.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench_handle_annotation_event(events, sockets, settings, engine):
+    """Time the fan-out of each event in turn."""
+    latencies = []
+    start = time.time()
+    for event in events:
+        session = db.Session(bind=engine)
+        t0 = time.time()
+        messages.handle_annotation_event(event,
+                                         websocket.WebSocket.index,
+                                         settings,
+                                         session)
+        # Let the sockets' writers send the notifications.
+        gevent.sleep(0)
+        latencies.append(time.time() - t0)
+        session.close()
+    elapsed = time.time() - start
+
+    print('handle_annotation_event:')
+    print('  fan-out latency p50:  {:8.2f} ms'.format(percentile(latencies, 50) * 1000))
+    print('  fan-out latency p99:  {:8.2f} ms'.format(percentile(latencies, 99) * 1000))
+    print('  events/sec:           {:8.0f}'.format(len(events) / elapsed))
+
+
+def bench_process_work_queue(events, settings, engine):
+    """Time handling all the events through the streamer's work queue."""
+    queue = Queue()
+    for event in events:
+        queue.put(messages.Message(topic=streamer.ANNOTATION_TOPIC, payload=event))
+    queue.put(StopIteration)
+
+    start = time.time()
+    streamer.process_work_queue(settings,
+                                queue,
+                                session_factory=lambda _: db.Session(bind=engine))
+    gevent.sleep(0)
+    elapsed = time.time() - start
+
+    print('process_work_queue (batch size {}):'.format(settings['h.streamer.batch_size']))
+    print('  events/sec:           {:8.0f}'.format(len(events) / elapsed))
+
+
+def run(args):
+    random.seed(args.seed)
+    registry = make_registry()
+    engine = sqlalchemy.create_engine(args.database_url)
+    db.init(engine, should_create=True, authority=AUTHORITY)
+    session = db.Session(bind=engine)
+
+    settings = {'h.app_url': APP_URL,
+                'h.authority': AUTHORITY,
+                'h.streamer.batch_size': args.batch_size,
+                'statsd.host': 'localhost'}
+
+    annotations = create_annotations(session, args.documents, args.annotations)
+    ids = [a.id for a in annotations]
+    document_ids = [a.document_id for a in annotations]
+    try:
+        events = make_events(annotations, args.events, session, registry,
+                             args.snapshots)
+
+        before = rss()
+        sockets = connect_sockets(args.sockets, args.documents, registry, Queue())
+        per_connection = (rss() - before) / len(sockets)
+
+        print('sockets:                {:8d}'.format(len(sockets)))
+        print('memory/connection:      {:8.2f} KiB'.format(per_connection / 1024))
+        print('events:                 {:8d} ({})'.format(
+            len(events), 'with snapshots' if args.snapshots else 'from database'))
+
+        bench_handle_annotation_event(events, sockets, settings, engine)
+        bench_process_work_queue(events, settings, engine)
+
+        sent = sum(s.sock.bytes_sent for s in sockets)
+        print('bytes written:          {:8d}'.format(sent))
+    finally:
+        delete_annotations(session, ids, document_ids)
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL',
+                                               'postgresql://postgres@localhost/postgres'),
+                        help='the database in which to create annotations')
+    parser.add_argument('--sockets', type=int, default=5000,
+                        help='number of connected websockets')
+    parser.add_argument('--events', type=int, default=2000,
+                        help='number of annotation events')
+    parser.add_argument('--documents', type=int, default=500,
+                        help='number of distinct documents annotated and watched')
+    parser.add_argument('--annotations', type=int, default=200,
+                        help='number of distinct annotations referred to by events')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='h.streamer.batch_size for process_work_queue')
+    parser.add_argument('--snapshots', action='store_true',
+                        help='embed annotation snapshots in the events')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed for the generated clients and events')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
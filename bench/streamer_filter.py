@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark for :py:class:`h.streamer.filter.FilterHandler`.
+
+Reports the number of ``FilterHandler.match`` calls per second for a handful
+of realistic filters, as sent by the sidebar and the stream page, against a
+realistic serialized annotation.
+
+Usage::
+
+    python -m bench.streamer_filter [--iterations N]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import timeit
+
+from h.streamer.filter import FilterHandler
+
+ACTIONS = {'create': True, 'update': True, 'delete': True}
+
+# The sidebar subscribes to the (expanded) URIs of the page it is shown on.
+SIDEBAR_URIS = [
+    'https://example.com/articles/2018/climate-report',
+    'https://example.com/articles/2018/climate-report?print=1',
+    'https://www.example.com/articles/2018/climate-report',
+    'doi:10.1000/xyz123',
+    'urn:x-pdf:6a4e2c5d3bbf4c1c8a0a0e5e2c7f9a11',
+]
+
+FILTERS = {
+    'sidebar (match)': {
+        'match_policy': 'include_any',
+        'clauses': [{'field': '/uri', 'operator': 'one_of',
+                     'value': SIDEBAR_URIS}],
+        'actions': ACTIONS,
+    },
+    'sidebar (no match)': {
+        'match_policy': 'include_any',
+        'clauses': [{'field': '/uri', 'operator': 'one_of',
+                     'value': ['https://example.org/some/other/page',
+                               'https://example.org/some/other/page#top']}],
+        'actions': ACTIONS,
+    },
+    'stream (user and tags)': {
+        'match_policy': 'include_all',
+        'clauses': [{'field': '/user', 'operator': 'equals',
+                     'value': 'acct:Alice@example.com'},
+                    {'field': '/tags', 'operator': 'matches',
+                     'value': 'Climate'}],
+        'actions': ACTIONS,
+    },
+    'stream (text, non-ASCII)': {
+        'match_policy': 'include_any',
+        'clauses': [{'field': ['/text', '/tags'], 'operator': 'matches',
+                     'value': 'Café'}],
+        'actions': ACTIONS,
+    },
+}
+
+ANNOTATION = {
+    'id': 'AVxqVz8f2IoqDLfOHmTf',
+    'created': '2018-09-20T11:03:16.811231+00:00',
+    'updated': '2018-09-20T11:03:16.811231+00:00',
+    'user': 'acct:alice@example.com',
+    'uri': 'https://www.example.com/articles/2018/climate-report',
+    'text': 'This is the key finding of the report. See also the café study.',
+    'tags': ['climate', 'science'],
+    'group': '__world__',
+    'permissions': {'read': ['group:__world__'],
+                    'admin': ['acct:alice@example.com'],
+                    'update': ['acct:alice@example.com'],
+                    'delete': ['acct:alice@example.com']},
+    'target': [{'source': 'https://www.example.com/articles/2018/climate-report',
+                'selector': [{'type': 'TextQuoteSelector',
+                              'exact': 'global temperatures',
+                              'prefix': 'a rise in ',
+                              'suffix': ' over the'}]}],
+    'document': {'title': ['Climate report']},
+    'links': {'html': 'https://hypothes.is/a/AVxqVz8f2IoqDLfOHmTf',
+              'incontext': 'https://hyp.is/AVxqVz8f2IoqDLfOHmTf/example.com',
+              'json': 'https://hypothes.is/api/annotations/AVxqVz8f2IoqDLfOHmTf'},
+}
+
+
+def run(iterations):
+    print('{:<28} {:>8} {:>16}'.format('filter', 'result', 'matches/sec'))
+    for name, filter_json in sorted(FILTERS.items()):
+        handler = FilterHandler(filter_json)
+        result = handler.match(ANNOTATION, 'create')
+        elapsed = min(timeit.repeat(lambda: handler.match(ANNOTATION, 'create'),
+                                    number=iterations,
+                                    repeat=3))
+        rate = iterations / elapsed
+        print('{:<28} {:>8} {:>16,.0f}'.format(name, str(result), rate))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000,
+                        help='number of matches per timing run')
+    args = parser.parse_args()
+    run(args.iterations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Memory and CPU benchmark for websocket heartbeats.
+
+Connects many simulated websockets and runs their heartbeats, either as
+ws4py's per-connection heartbeat threads (greenlets, with gevent's monkey
+patching, as in the websocket server) or with a single
+:py:class:`h.streamer.heartbeat.HeartbeatWheel`. Reports the memory used by
+the heartbeats per connection and the CPU time they use.
+
+The heartbeat interval is shortened so that a run only takes a few seconds;
+CPU use scales with the number of heartbeats sent per second.
+
+Usage::
+
+    python -m bench.streamer_heartbeat [--mode per_socket|wheel]
+        [--sockets N] [--interval SECONDS] [--duration SECONDS]
+"""
+from __future__ import division, print_function, unicode_literals
+
+# The websocket server runs with gevent's monkey patching, which turns ws4py's
+# heartbeat threads into greenlets.
+from gevent import monkey
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import resource  # noqa: E402
+import time  # noqa: E402
+
+import gevent  # noqa: E402
+from gevent.queue import Queue  # noqa: E402
+from pyramid import security  # noqa: E402
+from ws4py.websocket import Heartbeat  # noqa: E402
+
+from bench.streamer_fanout import FakeSock, rss  # noqa: E402
+from h.streamer import heartbeat  # noqa: E402
+from h.streamer import websocket  # noqa: E402
+
+
+def connect_sockets(count):
+    environ = {
+        'h.ws.authenticated_userid': None,
+        'h.ws.effective_principals': [security.Everyone, 'group:__world__'],
+        'h.ws.registry': None,
+        'h.ws.streamer_work_queue': Queue(),
+    }
+    return [websocket.WebSocket(FakeSock(), environ=environ)
+            for _ in range(count)]
+
+
+def start_per_socket_heartbeats(sockets, interval):
+    heartbeats = []
+    for socket in sockets:
+        hb = Heartbeat(socket, frequency=interval)
+        hb.daemon = True
+        hb.start()
+        heartbeats.append(hb)
+    return heartbeats
+
+
+def start_wheel(sockets, interval):
+    wheel = heartbeat.HeartbeatWheel(interval, timeout=float('inf'))
+    websocket.WebSocket.heartbeat = wheel
+    for socket in sockets:
+        wheel.add(socket)
+    return [wheel, gevent.spawn(wheel.run)]
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(args):
+    sockets = connect_sockets(args.sockets)
+    # Let any writer greenlets finish.
+    gevent.sleep(0)
+
+    before = rss()
+    if args.mode == 'wheel':
+        heartbeats = start_wheel(sockets, args.interval)
+    else:
+        heartbeats = start_per_socket_heartbeats(sockets, args.interval)
+    gevent.sleep(0)
+    per_connection = (rss() - before) / len(sockets)
+
+    cpu_before = cpu_time()
+    wall_before = time.time()
+    gevent.sleep(args.duration)
+    cpu = cpu_time() - cpu_before
+    wall = time.time() - wall_before
+
+    sent = sum(s.sock.bytes_sent for s in sockets)
+
+    print('mode:                       {:>10}'.format(args.mode))
+    print('sockets:                    {:10d}'.format(len(sockets)))
+    print('interval:                   {:10.1f} s'.format(args.interval))
+    print('heartbeat memory/connection:{:10.2f} KiB'.format(per_connection / 1024))
+    print('CPU:                        {:10.1f} % of one core'.format(100 * cpu / wall))
+    print('CPU per heartbeat:          {:10.1f} us'.format(
+        1e6 * cpu / max(1, len(sockets) * wall / args.interval)))
+    print('bytes sent:                 {:10d}'.format(sent))
+    del heartbeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', choices=['per_socket', 'wheel'],
+                        default='wheel')
+    parser.add_argument('--sockets', type=int, default=20000,
+                        help='number of connected websockets')
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help='seconds between heartbeats to each socket')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to measure CPU use over')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
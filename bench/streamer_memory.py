@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Memory benchmark for the streamer's per-connection state.
+
+Connects many simulated websockets, as the websocket server would, and sends
+each a realistic filter, then reports the memory used per connection.
+
+Each connection is given its own copy of a typical WSGI environ, and its own
+copies of its principals and filter (as if decoded from a request and a
+message), so that nothing is shared between connections unless the streamer
+shares it.
+
+Usage::
+
+    python -m bench.streamer_memory [--sockets N] [--documents N]
+"""
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import gc
+import json
+import random
+
+from gevent.queue import Queue
+
+from bench.streamer_fanout import (AUTHORITY, CLIENT_MIX, LOGGED_IN, FakeSock,
+                                   client_filter, rss)
+from h.streamer import websocket
+
+WSGI_ENVIRON = {
+    'GATEWAY_INTERFACE': 'CGI/1.1',
+    'HTTP_ACCEPT_ENCODING': 'gzip, deflate, br',
+    'HTTP_ACCEPT_LANGUAGE': 'en-GB,en;q=0.9',
+    'HTTP_CACHE_CONTROL': 'no-cache',
+    'HTTP_CONNECTION': 'Upgrade',
+    'HTTP_COOKIE': 'session=' + 'x' * 200,
+    'HTTP_HOST': 'localhost:5001',
+    'HTTP_ORIGIN': 'https://example.com',
+    'HTTP_PRAGMA': 'no-cache',
+    'HTTP_SEC_WEBSOCKET_EXTENSIONS': 'permessage-deflate; client_max_window_bits',
+    'HTTP_SEC_WEBSOCKET_KEY': 'dGhlIHNhbXBsZSBub25jZQ==',
+    'HTTP_SEC_WEBSOCKET_VERSION': '13',
+    'HTTP_UPGRADE': 'websocket',
+    'HTTP_USER_AGENT': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+                       '(KHTML, like Gecko) Chrome/68.0.3440.106 Safari/537.36',
+    'PATH_INFO': '/ws',
+    'QUERY_STRING': '',
+    'REMOTE_ADDR': '127.0.0.1',
+    'REMOTE_PORT': '53412',
+    'REQUEST_METHOD': 'GET',
+    'SCRIPT_NAME': '',
+    'SERVER_NAME': 'localhost',
+    'SERVER_PORT': '5001',
+    'SERVER_PROTOCOL': 'HTTP/1.1',
+    'SERVER_SOFTWARE': 'gevent/1.3 Python/2.7',
+    'wsgi.multiprocess': False,
+    'wsgi.multithread': False,
+    'wsgi.run_once': False,
+    'wsgi.url_scheme': 'http',
+    'wsgi.version': (1, 0),
+}
+
+
+def copy(value):
+    """Return a deep copy of `value`, as if it had been decoded from JSON."""
+    return json.loads(json.dumps(value))
+
+
+def client_principals(n):
+    if random.random() >= LOGGED_IN:
+        return None, copy(['system.Everyone', 'group:__world__'])
+    userid = 'acct:reader{}@{}'.format(n % 1000, AUTHORITY)
+    return copy(userid), copy(['system.Everyone',
+                               'system.Authenticated',
+                               userid,
+                               'group:__world__',
+                               'group:private{}'.format(n % 100)])
+
+
+def connect_sockets(count, documents, registry, work_queue):
+    """Connect `count` websockets, each with its own environ and filter."""
+    kinds = [kind for kind, proportion in CLIENT_MIX
+             for _ in range(int(proportion * 100))]
+    sockets = []
+    for n in range(count):
+        userid, principals = client_principals(n)
+        environ = dict(WSGI_ENVIRON, **copy(WSGI_ENVIRON))
+        environ.update({
+            'h.ws.authenticated_userid': userid,
+            'h.ws.effective_principals': principals,
+            'h.ws.registry': registry,
+            'h.ws.streamer_work_queue': work_queue,
+        })
+        socket = websocket.WebSocket(FakeSock(), environ=environ)
+        socket.client_id = copy('{:032x}'.format(n))
+        filter_ = copy(client_filter(random.choice(kinds), documents))
+        websocket.handle_filter_message(
+            websocket.Message(socket=socket, payload={'filter': filter_}))
+        sockets.append(socket)
+    return sockets
+
+
+def run(args):
+    random.seed(args.seed)
+    work_queue = Queue()
+
+    gc.collect()
+    before = rss()
+    sockets = connect_sockets(args.sockets, args.documents, None, work_queue)
+    gc.collect()
+    per_connection = (rss() - before) / len(sockets)
+
+    print('sockets:                {:8d}'.format(len(sockets)))
+    print('documents:              {:8d}'.format(args.documents))
+    print('distinct filters:       {:8d}'.format(
+        len(set(id(socket.filter) for socket in sockets))))
+    print('distinct principals:    {:8d}'.format(len(websocket.WebSocket.principals)))
+    print('memory/connection:      {:8.2f} KiB'.format(per_connection / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sockets', type=int, default=20000,
+                        help='number of connected websockets')
+    parser.add_argument('--documents', type=int, default=500,
+                        help='number of distinct documents watched')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed for the generated clients')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
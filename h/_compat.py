@@ -9,6 +9,7 @@ __all__ = (
 
     'text_type',
     'string_types',
+    'integer_types',
 
     'configparser',
 
@@ -26,11 +27,13 @@ PY2 = sys.version_info[0] == 2
 if not PY2:
     text_type = str
     string_types = (str,)
+    integer_types = (int,)
     xrange = range
     unichr = chr
 else:
     text_type = unicode  # noqa
     string_types = (str, unicode)  # noqa
+    integer_types = (int, long)  # noqa
     xrange = xrange
     unichr = unichr
 
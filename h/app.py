@@ -49,6 +49,10 @@ def includeme(config):
                           'h.events.AnnotationEvent')
     config.add_subscriber('h.subscribers.send_reply_notifications',
                           'h.events.AnnotationEvent')
+    config.add_subscriber('h.subscribers.update_annotation_document_count',
+                          'h.events.AnnotationEvent')
+    config.add_subscriber('h.subscribers.update_merged_document_count',
+                          'h.events.DocumentMergedEvent')
 
     config.add_tween('h.tweens.conditional_http_tween_factory', under=EXCVIEW)
     config.add_tween('h.tweens.redirect_tween_factory')
@@ -111,6 +115,7 @@ def includeme(config):
     config.include('h.assets')
     config.include('h.auth')
     config.include('h.authz')
+    config.include('h.blocklist')
     config.include('h.db')
     config.include('h.eventqueue')
     config.include('h.form')
@@ -124,6 +129,7 @@ def includeme(config):
     config.include('h.services')
     config.include('h.session')
     config.include('h.stats')
+    config.include('h.uri_expansion')
     config.include('h.viewderivers')
     config.include('h.viewpredicates')
     config.include('h.views')
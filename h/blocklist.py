@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+A process-wide compiled matcher for the badge blocklist.
+
+Checking a URI against the blocklist in the database (see
+:py:meth:`h.models.Blocklist.is_blocked`) evaluates every blocked ``LIKE``
+pattern against the URI, for every badge request. When enabled, this matcher
+loads all of the patterns, compiles them into a single regular expression, and
+matches URIs against that in memory instead.
+
+The patterns are reloaded once they're older than the TTL, and after they're
+edited through the admin pages (see :py:mod:`h.views.admin.badge`), but only
+in the process which edited them: other processes may go on using the old
+patterns until they expire.
+"""
+from __future__ import unicode_literals
+
+import re
+import threading
+import time
+
+from h import stats
+
+# A regular expression which never matches, for an empty blocklist.
+_MATCH_NOTHING = re.compile(r'(?!)')
+
+
+def like_to_regex(pattern):
+    """
+    Return a regular expression equivalent to an SQL ``LIKE`` pattern.
+
+    ``%`` matches any sequence of characters, ``_`` matches any single
+    character and a backslash matches the next character literally, as with
+    PostgreSQL's default escape character. The expression isn't anchored.
+    """
+    parts = []
+    chars = iter(pattern)
+    for char in chars:
+        if char == '\\':
+            parts.append(re.escape(next(chars, '\\')))
+        elif char == '%':
+            parts.append('.*')
+        elif char == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(char))
+    return ''.join(parts)
+
+
+def compile_patterns(patterns):
+    """Compile ``LIKE`` patterns into one regular expression matching whole URIs."""
+    patterns = list(patterns)
+    if not patterns:
+        return _MATCH_NOTHING
+
+    alternatives = '|'.join('(?:{})'.format(like_to_regex(p)) for p in patterns)
+    return re.compile(r'(?:{})\Z'.format(alternatives), re.DOTALL | re.UNICODE)
+
+
+class BlocklistMatcher(object):
+    """
+    A compiled copy of the blocklist, reloaded when it gets too old.
+
+    :param ttl: how long, in seconds, to use the patterns before reloading
+        them. If 0 (the default) the matcher is disabled.
+    :param stats: a statsd client to which to report reloads
+    :param clock: a function returning the current time, in seconds
+    """
+
+    def __init__(self, ttl=0, stats=None, clock=time.time):
+        self.ttl = ttl
+        self.stats = stats
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._regex = None
+        self._expires = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def is_blocked(self, uri, load_patterns):
+        """
+        Return True if `uri` matches one of the blocked patterns.
+
+        :param load_patterns: a function returning all of the blocked
+            patterns, called when they need (re)loading
+        """
+        return self._compiled(load_patterns).match(uri) is not None
+
+    def blocked_uris(self, uris, load_patterns):
+        """Return the set of `uris` which match one of the blocked patterns."""
+        regex = self._compiled(load_patterns)
+        return set(uri for uri in uris if regex.match(uri) is not None)
+
+    def invalidate(self):
+        """Reload the patterns the next time a URI is checked."""
+        with self._lock:
+            self._regex = None
+
+    def _compiled(self, load_patterns):
+        # Load the patterns while holding the lock, so that concurrent checks
+        # wait for one reload rather than all querying the database.
+        with self._lock:
+            if self._regex is None or self._expires <= self._clock():
+                self._regex = compile_patterns(load_patterns())
+                self._expires = self._clock() + self.ttl
+                if self.stats is not None:
+                    self.stats.incr('blocklist.matcher.reload')
+            return self._regex
+
+
+# The blocklist matcher for this process.
+matcher = BlocklistMatcher()
+
+
+def includeme(config):
+    settings = config.registry.settings
+    matcher.ttl = float(settings.get('h.blocklist.cache_ttl', 0))
+    matcher.stats = stats.get_client(settings)
+    matcher.invalidate()
@@ -53,6 +53,10 @@ celery.conf.update(
             'task': 'h.tasks.cleanup.purge_removed_features',
             'schedule': timedelta(hours=6)
         },
+        'reconcile-document-annotation-counts': {
+            'task': 'h.tasks.annotation_counts.reconcile_document_annotation_counts',
+            'schedule': timedelta(days=1)
+        },
     },
     accept_content=['json'],
     # Enable at-least-once delivery mode. This probably isn't actually what we
@@ -63,6 +67,7 @@ celery.conf.update(
     task_ignore_result=True,
     imports=(
         'h.tasks.admin',
+        'h.tasks.annotation_counts',
         'h.tasks.cleanup',
         'h.tasks.indexer',
         'h.tasks.mailer',
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+import time
+
+import click
+from webob.multidict import MultiDict
+
+from h.schemas import ValidationError
+from h.schemas.annotation import SearchParamsSchema
+from h.schemas.util import validate_query_params
+
+
+@click.command('export')
+@click.argument('params', nargs=-1, metavar='[KEY=VALUE]...')
+@click.option('--output', '-o', type=click.File('wb'), default='-',
+              help="The file to export to (default: standard output)")
+@click.pass_context
+def export(ctx, params, output):
+    """
+    Export annotations as newline-delimited JSON.
+
+    Exports all the annotations matching the given search API parameters, for
+    example `group=abc123 uri=https://example.com/`, which are visible to
+    users who are not logged in.
+    """
+    request = ctx.obj['bootstrap']()
+
+    query = MultiDict()
+    for param in params:
+        key, sep, value = param.partition('=')
+        if not sep:
+            raise click.BadParameter('expected KEY=VALUE, got {}'.format(param))
+        query.add(key, value)
+
+    try:
+        query = validate_query_params(SearchParamsSchema(), query)
+    except ValidationError as err:
+        raise click.BadParameter(str(err))
+
+    svc = request.find_service(name='annotation_export')
+
+    count = 0
+    start = time.time()
+    for line in svc.export(query):
+        output.write(line.encode('utf-8'))
+        count += 1
+    elapsed = time.time() - start
+
+    click.echo('Exported {} annotations in {:.1f}s ({:.0f} annotations/s)'.format(
+        count, elapsed, count / elapsed if elapsed else 0), err=True)
@@ -3,7 +3,7 @@
 import click
 
 from h import models
-from h.models.document import merge_documents
+from h.models.document import merge_documents, pop_merged_document_ids
 from h.search.index import BatchIndexer
 from h.util import uri
 
@@ -64,6 +64,14 @@ def move_uri(ctx, old, new):
     if documents.count() > 1:
         merge_documents(request.db, documents)
 
+    # Reindex the annotations of merged documents with their new document.
+    document_ids = pop_merged_document_ids(request.db)
+    if document_ids:
+        indexer = BatchIndexer(request.db, request.es, request)
+        ids = [a.id for a in request.db.query(models.Annotation.id).filter(
+            models.Annotation.document_id.in_(document_ids))]
+        indexer.index(ids)
+
     request.tm.commit()
 
 
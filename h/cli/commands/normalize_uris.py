@@ -6,7 +6,7 @@ from collections import namedtuple
 import click
 
 from h import models
-from h.models.document import merge_documents
+from h.models.document import merge_documents, pop_merged_document_ids
 from h.search import index
 from h.util import uri
 
@@ -36,8 +36,14 @@ def normalize_document_uris(request):
     for window in windows:
         request.tm.begin()
         _normalize_document_uris_window(request.db, window)
+        document_ids = pop_merged_document_ids(request.db)
         request.tm.commit()
 
+        if document_ids:
+            request.tm.begin()
+            _reindex_annotations(request, _fetch_document_annotation_ids(request.db, document_ids))
+            request.tm.commit()
+
 
 def normalize_document_meta(request):
     windows = _fetch_windows(request.db, models.DocumentMeta.updated)
@@ -124,6 +130,13 @@ def _normalize_annotations_window(session, window):
     return ids
 
 
+def _fetch_document_annotation_ids(session, document_ids):
+    query = session.query(models.Annotation.id) \
+        .filter(models.Annotation.document_id.in_(document_ids))
+
+    return set(a.id for a in query)
+
+
 def _reindex_annotations(request, ids):
     indexer = index.BatchIndexer(request.db, request.es, request)
 
@@ -95,6 +95,48 @@ def configure(environ=None, settings=None):
     settings_manager.set('h.sentry_dsn_frontend', 'SENTRY_DSN_FRONTEND')
     settings_manager.set('h.websocket_url', 'WEBSOCKET_URL')
 
+    # Batching of the websocket server's work queue
+    settings_manager.set('h.streamer.batch_size', 'STREAMER_BATCH_SIZE', type_=int)
+    settings_manager.set('h.streamer.batch_latency_ms', 'STREAMER_BATCH_LATENCY_MS', type_=int)
+
+    # Buffering of messages to slow websocket clients
+    settings_manager.set('h.streamer.send_queue_size', 'STREAMER_SEND_QUEUE_SIZE', type_=int)
+    settings_manager.set('h.streamer.send_queue_overflow', 'STREAMER_SEND_QUEUE_OVERFLOW')
+
+    # Websocket heartbeats: "per_socket" (the default) or "wheel"
+    settings_manager.set('h.streamer.heartbeat_mode', 'STREAMER_HEARTBEAT_MODE')
+    settings_manager.set('h.streamer.heartbeat_interval', 'STREAMER_HEARTBEAT_INTERVAL', type_=float)
+
+    # Compression of websocket messages with permessage-deflate
+    settings_manager.set('h.streamer.permessage_deflate', 'STREAMER_PERMESSAGE_DEFLATE', type_=asbool)
+    settings_manager.set('h.streamer.deflate_level', 'STREAMER_DEFLATE_LEVEL', type_=int)
+    settings_manager.set('h.streamer.deflate_context_takeover', 'STREAMER_DEFLATE_CONTEXT_TAKEOVER', type_=asbool)
+
+    # Replay of recent annotation events to reconnecting websocket clients
+    settings_manager.set('h.streamer.replay_buffer_size', 'STREAMER_REPLAY_BUFFER_SIZE', type_=int)
+
+    # Compiled matching of the badge blocklist: see h.blocklist
+    settings_manager.set('h.blocklist.cache_ttl', 'BLOCKLIST_CACHE_TTL', type_=float)
+
+    # Caching of URI expansions: see h.uri_expansion
+    settings_manager.set('h.uri_expansion.cache_ttl', 'URI_EXPANSION_CACHE_TTL', type_=float)
+    settings_manager.set('h.uri_expansion.cache_size', 'URI_EXPANSION_CACHE_SIZE', type_=int)
+
+    # The maximum number of replies returned by a search for all replies
+    settings_manager.set('h.search.replies_max', 'SEARCH_REPLIES_MAX', type_=int)
+
+    # Caching of search results: see h.search.result_cache
+    settings_manager.set('h.search.result_cache_ttl', 'SEARCH_RESULT_CACHE_TTL', type_=float)
+    settings_manager.set('h.search.result_cache_size', 'SEARCH_RESULT_CACHE_SIZE', type_=int)
+
+    # Embed annotation snapshots in realtime messages, so that the websocket
+    # server doesn't need to read annotations from the database
+    settings_manager.set('h.realtime.annotation_snapshots', 'REALTIME_ANNOTATION_SNAPSHOTS', type_=asbool)
+
+    # Asynchronous, batched publishing of realtime messages
+    settings_manager.set('h.realtime.flush_interval_ms', 'REALTIME_FLUSH_INTERVAL_MS', type_=int)
+    settings_manager.set('h.realtime.buffer_size', 'REALTIME_BUFFER_SIZE', type_=int)
+
     # Debug/development settings
     settings_manager.set('debug_query', 'DEBUG_QUERY')
 
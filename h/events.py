@@ -11,6 +11,19 @@ class AnnotationEvent(object):
         self.action = action
 
 
+class DocumentMergedEvent(object):
+    """
+    An event representing the merge of other documents into a document.
+
+    The annotations of the merged documents now belong to the document
+    identified by ``document_id``.
+    """
+
+    def __init__(self, request, document_id):
+        self.request = request
+        self.document_id = document_id
+
+
 class AnnotationTransformEvent(object):
 
     """
@@ -11,3 +11,5 @@ __all__ = (
 def includeme(config):
     config.add_subscriber('h.indexer.subscribers.subscribe_annotation_event',
                           'h.events.AnnotationEvent')
+    config.add_subscriber('h.indexer.subscribers.subscribe_document_merged_event',
+                          'h.events.DocumentMergedEvent')
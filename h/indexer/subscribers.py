@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
-from h.tasks.indexer import add_annotation, delete_annotation
+from h.tasks.indexer import (add_annotation, delete_annotation,
+                             reindex_document_annotations)
 
 
 def subscribe_annotation_event(event):
@@ -9,3 +10,7 @@ def subscribe_annotation_event(event):
         add_annotation.delay(event.annotation_id)
     elif event.action == 'delete':
         delete_annotation.delay(event.annotation_id)
+
+
+def subscribe_document_merged_event(event):
+    reindex_document_annotations.delay(event.document_id)
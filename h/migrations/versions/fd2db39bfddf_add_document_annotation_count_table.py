@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""Add document_annotation_count table"""
+from __future__ import unicode_literals
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "fd2db39bfddf"
+down_revision = "feb0985ed117"
+
+
+def upgrade():
+    op.create_table('document_annotation_count',
+                    sa.Column('document_id', sa.Integer, nullable=False),
+                    sa.Column('top_level', sa.Integer, server_default='0', nullable=False),
+                    sa.Column('total', sa.Integer, server_default='0', nullable=False),
+                    sa.Column('created', sa.DateTime, server_default=sa.func.now(), nullable=False),
+                    sa.Column('updated', sa.DateTime, server_default=sa.func.now(), nullable=False),
+                    sa.PrimaryKeyConstraint('document_id', name=op.f('pk__document_annotation_count')),
+                    sa.ForeignKeyConstraint(['document_id'], ['document.id'],
+                                            name=op.f('fk__document_annotation_count__document_id__document'),
+                                            ondelete='cascade'))
+
+
+def downgrade():
+    op.drop_table('document_annotation_count')
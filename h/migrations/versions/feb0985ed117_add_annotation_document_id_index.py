@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""Add annotation.document_id index"""
+from __future__ import unicode_literals
+
+from alembic import op
+
+
+revision = "feb0985ed117"
+down_revision = "5d256923d642"
+
+
+def upgrade():
+    # Creating an index concurrently does not work inside a transaction.
+    op.execute('COMMIT')
+    op.create_index(op.f('ix__annotation_document_id'), 'annotation', ['document_id'],
+                    postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix__annotation_document_id'), 'annotation')
@@ -27,6 +27,7 @@ from h.models.auth_ticket import AuthTicket
 from h.models.authz_code import AuthzCode
 from h.models.blocklist import Blocklist
 from h.models.document import Document, DocumentMeta, DocumentURI
+from h.models.document_annotation_count import DocumentAnnotationCount
 from h.models.feature import Feature
 from h.models.feature_cohort import FeatureCohort
 from h.models.flag import Flag
@@ -48,6 +49,7 @@ __all__ = (
     'AuthzCode',
     'Blocklist',
     'Document',
+    'DocumentAnnotationCount',
     'DocumentMeta',
     'DocumentURI',
     'Feature',
@@ -112,7 +112,8 @@ class Annotation(Base):
 
     document_id = sa.Column(sa.Integer,
                             sa.ForeignKey('document.id'),
-                            nullable=False)
+                            nullable=False,
+                            index=True)
 
     document = sa.orm.relationship('Document', backref='annotations')
 
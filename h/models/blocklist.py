@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql import expression
 
+from h import blocklist
 from h.db import Base
 
 
@@ -25,6 +27,35 @@ class Blocklist(Base):
 
     @classmethod
     def is_blocked(cls, session, uri):
-        """Return True if the given URI is blocked."""
+        """
+        Return True if the given URI is blocked.
+
+        Uses the process's compiled blocklist (see :py:mod:`h.blocklist`) if
+        it's enabled, and otherwise queries the database.
+        """
+        if blocklist.matcher.enabled:
+            return blocklist.matcher.is_blocked(uri, lambda: cls._patterns(session))
+
         uri_matches = expression.literal(uri).like(cls.uri)
         return session.query(cls).filter(uri_matches).count() > 0
+
+    @classmethod
+    def blocked_uris(cls, session, uris):
+        """Return the set of the given URIs which are blocked, with one query."""
+        uris = list(uris)
+        if not uris:
+            return set()
+
+        if blocklist.matcher.enabled:
+            return blocklist.matcher.blocked_uris(uris, lambda: cls._patterns(session))
+
+        candidate = expression.literal_column('candidate', sa.UnicodeText)
+        query = (session.query(candidate)
+                 .select_from(sa.func.unnest(postgresql.array(uris)).alias('candidate'))
+                 .join(cls, candidate.like(cls.uri))
+                 .distinct())
+        return set(uri for (uri,) in query)
+
+    @classmethod
+    def _patterns(cls, session):
+        return [uri for (uri,) in session.query(cls.uri)]
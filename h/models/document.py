@@ -11,12 +11,17 @@ from sqlalchemy.dialects import postgresql as pg
 from sqlalchemy.ext.hybrid import hybrid_property
 
 from h._compat import urlparse
+from h import uri_expansion
 from h.db import Base, mixins
 from h.models.annotation import Annotation
 from h.util.uri import normalize as uri_normalize
 
 log = logging.getLogger(__name__)
 
+# The key in ``session.info`` of the ids of documents into which others have
+# been merged. See :py:func:`pop_merged_document_ids`.
+_MERGED_DOCUMENT_IDS = 'h.models.document.merged_document_ids'
+
 
 class ConcurrentUpdateError(transaction.interfaces.TransientError):
     """Raised when concurrent updates to document data conflict."""
@@ -431,9 +436,27 @@ def merge_documents(session, documents, updated=None):
     except sa.exc.IntegrityError:
         raise ConcurrentUpdateError('concurrent document merges')
 
+    # All the URIs of the merged documents now belong to the master document.
+    uri_expansion.cache.invalidate([u.uri for u in master.document_uris])
+
+    # The annotations of the merged documents are indexed with the ids of
+    # their old documents until they are reindexed.
+    session.info.setdefault(_MERGED_DOCUMENT_IDS, set()).add(master.id)
+
     return master
 
 
+def pop_merged_document_ids(session):
+    """
+    Return the ids of the documents into which others have been merged.
+
+    Returns the ids of the master documents of all the merges done with
+    `session` (see :py:func:`merge_documents`) since this was last called,
+    so that their annotations can be reindexed.
+    """
+    return session.info.pop(_MERGED_DOCUMENT_IDS, set())
+
+
 def update_document_metadata(session,
                              target_uri,
                              document_meta_dicts,
@@ -488,6 +511,8 @@ def update_document_metadata(session,
 
     document.updated = updated
 
+    claims = _uri_claims(document)
+
     for document_uri_dict in document_uri_dicts:
         create_or_update_document_uri(
             session=session,
@@ -496,6 +521,9 @@ def update_document_metadata(session,
             updated=updated,
             **document_uri_dict)
 
+    if _uri_claims(document) != claims:
+        uri_expansion.cache.invalidate([u.uri for u in document.document_uris])
+
     document.update_web_uri()
 
     for document_meta_dict in document_meta_dicts:
@@ -507,3 +535,9 @@ def update_document_metadata(session,
             **document_meta_dict)
 
     return document
+
+
+def _uri_claims(document):
+    # N.B. The types of a document's URIs matter as well as the URIs
+    # themselves: see :py:func:`h.storage.expand_uri`.
+    return set((u.uri, u.type) for u in document.document_uris)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+
+from h.db import Base
+from h.db.mixins import Timestamps
+
+
+class DocumentAnnotationCount(Base, Timestamps):
+    """
+    The number of public annotations of a document.
+
+    These are the annotations that anyone can see: shared, not deleted, in
+    world-readable groups and not by NIPSA'd users. The counts are kept up to
+    date by :py:class:`h.services.document_annotation_count.DocumentAnnotationCountService`.
+    """
+
+    __tablename__ = 'document_annotation_count'
+
+    document_id = sa.Column(sa.Integer,
+                            sa.ForeignKey('document.id', ondelete='cascade'),
+                            primary_key=True)
+
+    #: The number of public top-level annotations (not replies).
+    top_level = sa.Column(sa.Integer, nullable=False, default=0, server_default='0')
+
+    #: The number of public annotations, including replies.
+    total = sa.Column(sa.Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return '<DocumentAnnotationCount document_id=%s total=%s>' % (self.document_id, self.total)
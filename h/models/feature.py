@@ -19,6 +19,12 @@ FEATURES = {
     'api_render_user_info': "Return users' extended info in API responses?",
     'client_display_names': "Render display names instead of user names in the client",
     'wildcard_search_on_activity_pages': "Enable wildcard search via url facet on activity pages.",
+    'search_by_document_id': ("Filter searches for a URI by the id of its document rather than its "
+                              "equivalent URIs? (Enable only once the search index has been rebuilt.)"),
+    'search_by_read_principals': ("Filter searches by the indexed principals which may read each "
+                                  "annotation? (Enable only once the search index has been rebuilt.)"),
+    'badge_counts': ("Read badge counts from the stored per-document annotation counts? (Enable "
+                     "only once the counts have been reconciled.)"),
 }
 
 # Once a feature has been fully deployed, we remove the flag from the codebase.
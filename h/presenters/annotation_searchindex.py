@@ -2,10 +2,17 @@
 
 from __future__ import unicode_literals
 
+from pyramid.authorization import ACLAuthorizationPolicy
+
+from h.interfaces import IGroupService
 from h.presenters.annotation_base import AnnotationBasePresenter
 from h.presenters.document_searchindex import DocumentSearchIndexPresenter
 from h.util.user import split_user
 
+# The ACL policy, rather than the request's policy, decides who may read an
+# annotation's group: the index mustn't depend on who made the request.
+_authz_policy = ACLAuthorizationPolicy()
+
 
 class AnnotationSearchIndexPresenter(AnnotationBasePresenter):
 
@@ -33,6 +40,8 @@ class AnnotationSearchIndexPresenter(AnnotationBasePresenter):
             'shared': self.annotation.shared,
             'target': self.target,
             'document': docpresenter.asdict(),
+            'document_id': self.annotation.document_id,
+            'read_principals': self.read_principals,
             'thread_ids': self.annotation.thread_ids
         }
 
@@ -54,6 +63,23 @@ class AnnotationSearchIndexPresenter(AnnotationBasePresenter):
 
         return result
 
+    @property
+    def read_principals(self):
+        """
+        Return the principals which may read the annotation.
+
+        These are the principals the annotation's ACL allows to read it (see
+        :py:class:`h.traversal.AnnotationContext`): the readers of its group
+        if it is shared, or else its author.
+        """
+        if not self.annotation.shared:
+            return [self.annotation.userid]
+
+        group = self.request.find_service(IGroupService).find(self.annotation.groupid)
+        if group is None:
+            return []
+        return sorted(_authz_policy.principals_allowed_by_permission(group, 'read'))
+
     @property
     def links(self):
         # The search index presenter has no need to generate links, and so the
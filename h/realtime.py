@@ -1,15 +1,30 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+import atexit
 import base64
+import logging
 import random
 import struct
+import threading
 from datetime import datetime
 
 import kombu
 from kombu.mixins import ConsumerMixin
 from kombu.pools import producers as producer_pool
 
+log = logging.getLogger(__name__)
+
+
+# The version of the annotation snapshot format which may be embedded in
+# annotation messages (see :py:func:`h.subscribers.publish_annotation_event`).
+# Consumers ignore snapshots in any other format.
+ANNOTATION_SNAPSHOT_VERSION = 1
+
+# The default maximum number of messages buffered by a publisher which
+# publishes asynchronously.
+DEFAULT_PUBLISH_BUFFER_SIZE = 1000
+
 
 class Consumer(ConsumerMixin):
     """
@@ -99,14 +114,36 @@ class Publisher(object):
     """
     A realtime publisher for publishing messages to all subscribers.
 
-    An instance of this publisher is available on Pyramid requests
-    with `request.realtime`.
-
-    :param request: a `pyramid.request.Request`
+    One publisher is shared by all the requests handled by a process, and is
+    available on Pyramid requests with `request.realtime`. It keeps a single
+    connection to the broker (with a small pool of connections and producers
+    for concurrent publishing), so the realtime exchange is only declared
+    when a connection is first used rather than for every message.
+
+    If `flush_interval` is given, messages are published asynchronously:
+    they're buffered, and the buffered messages are published in a batch by a
+    background thread every `flush_interval` seconds. If the buffer fills up
+    before then, the message that filled it is published synchronously along
+    with the rest of the buffer. Once the publisher is closed, messages are
+    published synchronously again.
+
+    :param settings: the application's settings
+    :param flush_interval: how often, in seconds, to publish buffered
+        messages, or None to publish each message immediately
+    :param buffer_size: the maximum number of messages to buffer
     """
-    def __init__(self, request):
-        self.connection = get_connection(request.registry.settings)
+
+    def __init__(self, settings, flush_interval=None,
+                 buffer_size=DEFAULT_PUBLISH_BUFFER_SIZE):
+        self.connection = get_connection(settings)
         self.exchange = get_exchange()
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._closed = threading.Event()
 
     def publish_annotation(self, payload):
         """Publish an annotation message with the routing key 'annotation'."""
@@ -116,15 +153,72 @@ class Publisher(object):
         """Publish a user message with the routing key 'user'."""
         self._publish('user', payload)
 
+    def publish_search_invalidation(self, payload):
+        """
+        Publish a message with the routing key 'search_invalidation'.
+
+        These tell each process to invalidate its cached search results for
+        the normalized URIs listed in the message (see
+        :py:mod:`h.search.result_cache`).
+        """
+        self._publish('search_invalidation', payload)
+
+    def flush(self):
+        """Publish any buffered messages."""
+        with self._lock:
+            messages, self._buffer = self._buffer, []
+        if messages:
+            self._send(messages)
+
+    def close(self):
+        """Stop the background thread and publish any buffered messages."""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
     def _publish(self, routing_key, payload):
         headers = {'timestamp': datetime.utcnow().isoformat() + 'Z'}
+        message = (routing_key, payload, headers)
+
+        if self.flush_interval is None or self._closed.is_set():
+            self._send([message])
+            return
+
+        with self._lock:
+            self._buffer.append(message)
+            if len(self._buffer) < self.buffer_size:
+                self._ensure_flusher()
+                return
+            messages, self._buffer = self._buffer, []
+        self._send(messages)
 
+    def _send(self, messages):
         with producer_pool[self.connection].acquire(block=True) as producer:
-            producer.publish(payload,
-                             exchange=self.exchange,
-                             declare=[self.exchange],
-                             routing_key=routing_key,
-                             headers=headers)
+            for routing_key, payload, headers in messages:
+                producer.publish(payload,
+                                 exchange=self.exchange,
+                                 declare=[self.exchange],
+                                 routing_key=routing_key,
+                                 headers=headers)
+
+    def _ensure_flusher(self):
+        # N.B. The flusher thread is started lazily, and restarted if it isn't
+        # running, because threads don't survive the worker process being
+        # forked from the process which created the publisher.
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        self._flusher = threading.Thread(target=self._flush_periodically,
+                                         name='realtime-publisher')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Failed to publish buffered realtime messages')
 
 
 def get_exchange():
@@ -143,5 +237,26 @@ def get_connection(settings):
     return kombu.Connection(conn)
 
 
+def get_publisher(settings):
+    """Returns a :py:class:`Publisher` configured by the application's settings."""
+    flush_interval = settings.get('h.realtime.flush_interval_ms')
+    if flush_interval:
+        flush_interval = float(flush_interval) / 1000
+    else:
+        flush_interval = None
+    buffer_size = int(settings.get('h.realtime.buffer_size',
+                                   DEFAULT_PUBLISH_BUFFER_SIZE))
+    publisher = Publisher(settings,
+                          flush_interval=flush_interval,
+                          buffer_size=buffer_size)
+    if flush_interval is not None:
+        # Don't lose buffered messages when the process exits cleanly.
+        atexit.register(publisher.close)
+    return publisher
+
+
 def includeme(config):
-    config.add_request_method(Publisher, name='realtime', reify=True)
+    config.registry.realtime = get_publisher(config.registry.settings)
+    config.add_request_method(lambda r: r.registry.realtime,
+                              name='realtime',
+                              reify=True)
@@ -114,10 +114,12 @@ def includeme(config):
                      '/api/groups/{pubid}/members/{userid}',
                      factory='h.traversal.GroupRoot',
                      traverse='/{pubid}')
+    config.add_route('api.export', '/api/export')
     config.add_route('api.search', '/api/search')
     config.add_route('api.users', '/api/users')
     config.add_route('api.user', '/api/users/{username}')
     config.add_route('badge', '/api/badge')
+    config.add_route('badge.batch', '/api/badge/batch')
     config.add_route('token', '/api/token')
     config.add_route('oauth_authorize', '/oauth/authorize')
     config.add_route('oauth_revoke', '/oauth/revoke')
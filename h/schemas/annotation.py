@@ -8,7 +8,8 @@ from dateutil.parser import parse
 from pyramid import i18n
 
 from h.schemas.base import JSONSchema, ValidationError
-from h.search.query import LIMIT_DEFAULT, LIMIT_MAX, OFFSET_MAX, wildcard_uri_is_valid
+from h.search.query import (LIMIT_DEFAULT, LIMIT_MAX, OFFSET_MAX, parse_cursor,
+                            parse_replies_cursor, wildcard_uri_is_valid)
 from h.util import document_claims
 
 _ = i18n.TranslationStringFactory(__package__)
@@ -326,12 +327,42 @@ def _target_selectors(targets):
         return []
 
 
+def _validate_replies_cursor(node, value):
+    try:
+        parse_replies_cursor(value)
+    except ValueError:
+        raise colander.Invalid(node, _("Invalid cursor"))
+
+
+def _validate_search_cursor(node, value):
+    try:
+        parse_cursor(value)
+    except ValueError:
+        raise colander.Invalid(node, _("Invalid cursor"))
+
+
 class SearchParamsSchema(colander.Schema):
     _separate_replies = colander.SchemaNode(
         colander.Boolean(),
         missing=False,
         description="Return a separate set of annotations and their replies.",
     )
+    _all_replies = colander.SchemaNode(
+        colander.Boolean(),
+        missing=False,
+        description="""With _separate_replies, return all of the replies to the
+                    annotations, rather than only the 200 most recently
+                    updated. If there are too many replies to return at once,
+                    the response includes a replies_cursor.""",
+    )
+    _replies_cursor = colander.SchemaNode(
+        colander.String(),
+        validator=_validate_replies_cursor,
+        missing=colander.drop,
+        description="""With _all_replies, return the replies following those
+                    returned by the search which returned this
+                    replies_cursor.""",
+    )
     sort = colander.SchemaNode(
         colander.String(),
         validator=colander.OneOf(["created", "updated", "group", "id", "user"]),
@@ -347,6 +378,15 @@ class SearchParamsSchema(colander.Schema):
                     epoch. This is used for iteration through large collections
                     of results.""",
     )
+    cursor = colander.SchemaNode(
+        colander.String(),
+        validator=_validate_search_cursor,
+        missing=colander.drop,
+        description="""Returns the results following those returned by the
+                    search which returned this next_cursor, sorted in the same
+                    way. Unlike offset, this can page through any number of
+                    results.""",
+    )
     limit = colander.SchemaNode(
         colander.Integer(),
         validator=colander.Range(min=0, max=LIMIT_MAX),
@@ -477,6 +517,10 @@ class SearchParamsSchema(colander.Schema):
             # offset must be set to 0 if search_after is specified.
             cstruct["offset"] = 0
 
+        # The cursor takes the place of offset too.
+        if cstruct.get('cursor'):
+            cstruct["offset"] = 0
+
     def _date_is_parsable(self, value):
         """Return True if date is parsable and False otherwise."""
 
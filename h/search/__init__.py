@@ -3,7 +3,8 @@
 from __future__ import unicode_literals
 from h.search.client import get_client
 from h.search.config import init
-from h.search.core import Search
+from h.search.core import REPLIES_MAX_DEFAULT, Search
+from h.search import result_cache
 from h.search.query import (TopLevelAnnotationsFilter,
                             AuthorityFilter,
                             TagsAggregation,
@@ -12,6 +13,7 @@ from h.search.query import (TopLevelAnnotationsFilter,
                             UriFilter)
 
 __all__ = (
+    'REPLIES_MAX_DEFAULT',
     'Search',
     'TopLevelAnnotationsFilter',
     'AuthorityFilter',
@@ -45,3 +47,10 @@ def includeme(config):
         lambda r: r.registry['es.client'],
         name='es',
         reify=True)
+
+    # Configure the cache of search results (see h.search.result_cache).
+    result_cache.cache.ttl = float(settings.get('h.search.result_cache_ttl', 0))
+    result_cache.cache.size = int(settings.get('h.search.result_cache_size',
+                                               result_cache.DEFAULT_SIZE))
+    result_cache.cache.clear()
+    result_cache.listener.settings = settings
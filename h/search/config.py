@@ -34,10 +34,12 @@ ANNOTATION_MAPPING = {
         'document': {
             'enabled': False,  # not indexed
         },
+        'document_id': {'type': 'keyword'},
         'group': {'type': 'keyword'},
         'id': {'type': 'keyword'},
         'nipsa': {'type': 'boolean'},
         'quote': {'type': 'text', 'analyzer': 'uni_normalizer'},
+        'read_principals': {'type': 'keyword'},
         'references': {'type': 'keyword'},
         'shared': {'type': 'boolean'},
         'hidden': {'type': 'boolean'},
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import json
 import logging
 from collections import namedtuple
 from contextlib import contextmanager
@@ -8,6 +9,8 @@ import elasticsearch_dsl
 from webob.multidict import MultiDict
 
 from h.search import query
+from h.search import result_cache
+from h.util import cursor, uri
 
 log = logging.getLogger(__name__)
 
@@ -15,7 +18,13 @@ SearchResult = namedtuple('SearchResult', [
     'total',
     'annotation_ids',
     'reply_ids',
-    'aggregations'])
+    'aggregations',
+    'replies_cursor',
+    'next_cursor'])
+SearchResult.__new__.__defaults__ = (None, None)
+
+# The default maximum number of replies returned by a search for all replies.
+REPLIES_MAX_DEFAULT = 5000
 
 
 class Search(object):
@@ -33,25 +42,44 @@ class Search(object):
     :param stats: An optional statsd client to which some metrics will be
         published.
     :type stats: statsd.client.StatsClient
+
+    :param all_replies: Whether to return all of the replies to the
+        annotations returned, rather than only the most recently updated 200,
+        when separate_replies is True. Replies are fetched a page at a time, up
+        to replies_max of them. If there are more, the result's
+        replies_cursor can be passed back as replies_cursor to get the next
+        ones.
+    :type all_replies: bool
+
+    :param replies_max: The maximum number of replies to return with
+        all_replies.
+    :type replies_max: int
+
+    :param replies_cursor: A replies_cursor returned by a previous search
+        with all_replies, to return the replies following those it returned.
+    :type replies_cursor: unicode
     """
-    def __init__(self, request, separate_replies=False, stats=None, _replies_limit=200):
+    def __init__(self, request, separate_replies=False, stats=None, _replies_limit=200,
+                 all_replies=False, replies_max=REPLIES_MAX_DEFAULT, replies_cursor=None):
         self.es = request.es
         self.separate_replies = separate_replies
         self.stats = stats
         self._replies_limit = _replies_limit
+        self.all_replies = all_replies
+        self.replies_max = replies_max
+        self.replies_cursor = replies_cursor
         # Order matters! The KeyValueMatcher must be run last,
         # after all other modifiers have popped off the params.
         self._modifiers = [query.Sorter(),
                            query.Limiter(),
                            query.DeletedFilter(),
-                           query.AuthFilter(request),
-                           query.GroupFilter(),
-                           query.GroupAuthFilter(request),
-                           query.UserFilter(),
-                           query.NipsaFilter(request),
-                           query.AnyMatcher(),
-                           query.TagsMatcher(),
-                           query.KeyValueMatcher()]
+                           query.GroupFilter()]
+        self._modifiers += _auth_filters(request)
+        self._modifiers += [query.UserFilter(),
+                            query.NipsaFilter(request),
+                            query.AnyMatcher(),
+                            query.TagsMatcher(),
+                            query.KeyValueMatcher()]
         self._aggregations = []
 
     def run(self, params):
@@ -64,10 +92,60 @@ class Search(object):
         :returns: The search results
         :rtype: SearchResult
         """
-        total, annotation_ids, aggregations = self._search_annotations(params)
-        reply_ids = self._search_replies(annotation_ids)
+        uris = _cacheable_uris(params) if result_cache.cache.enabled else None
+        search = self._annotations_search(params)
+
+        if not uris:
+            return self._run(search)
+
+        # The query includes everything which decides which annotations the
+        # user may see, so searches with equal queries have equal results.
+        key = json.dumps([search.to_dict(), self.separate_replies, self._replies_limit,
+                          self.all_replies, self.replies_max, self.replies_cursor],
+                         sort_keys=True)
+        result = result_cache.cache.get(key)
+        with self._instrument(cache_hit=result is not None):
+            if result is None:
+                result = self._run(search)
+                # Cached results are only invalidated while the process is
+                # listening for changes to the annotations.
+                result_cache.listener.ensure_running()
+                result_cache.cache.set(key, result, uris)
+
+        return result._replace(annotation_ids=list(result.annotation_ids),
+                               reply_ids=list(result.reply_ids))
+
+    def run_totals(self, params_list):
+        """
+        Return the number of annotations matching each of several searches.
+
+        The searches are made with a single Elasticsearch multi-search
+        request, and aren't cached.
 
-        return SearchResult(total, annotation_ids, reply_ids, aggregations)
+        :param params_list: the search parameters of each search
+        :type params_list: list of webob.multidict.MultiDict
+
+        :returns: the total of each search, in the order of `params_list`
+        :rtype: list of int
+        """
+        multi_search = elasticsearch_dsl.MultiSearch(using=self.es.conn, index=self.es.index)
+        for params in params_list:
+            multi_search = multi_search.add(self._annotations_search(params))
+
+        with self._instrument():
+            responses = multi_search.execute()
+
+        return [response['hits']['total'] for response in responses]
+
+    def _run(self, search):
+        total, annotation_ids, aggregations, next_cursor = self._search_annotations(search)
+        if self.separate_replies and self.all_replies:
+            reply_ids, replies_cursor = self._search_all_replies(annotation_ids)
+        else:
+            reply_ids, replies_cursor = self._search_replies(annotation_ids), None
+
+        return SearchResult(total, annotation_ids, reply_ids, aggregations,
+                            replies_cursor, next_cursor)
 
     def clear(self):
         """Clear search modifiers, aggregators, and matchers."""
@@ -85,9 +163,9 @@ class Search(object):
         """Append an aggregation to the search query."""
         self._aggregations.append(aggregation)
 
-    def _search(self, modifiers, aggregations, params):
+    def _build(self, modifiers, aggregations, params):
         """
-        Applies the modifiers, aggregations, and executes the search.
+        Applies the modifiers and aggregations to a new search.
         """
         # Don't return any fields, just the metadata so set _source=False.
         search = elasticsearch_dsl.Search(
@@ -98,26 +176,32 @@ class Search(object):
         for qual in modifiers:
             search = qual(search, params)
 
+        return search
+
+    def _execute(self, search):
         response = None
         with self._instrument():
             response = search.execute()
 
         return response
 
-    def _search_annotations(self, params):
+    def _annotations_search(self, params):
         # If separate_replies is True, don't return any replies to annotations.
         modifiers = self._modifiers
         if self.separate_replies:
             modifiers = [query.TopLevelAnnotationsFilter()] + modifiers
 
-        response = self._search(modifiers,
-                                self._aggregations,
-                                params)
+        return self._build(modifiers, self._aggregations, params)
+
+    def _search_annotations(self, search):
+        response = self._execute(search)
 
         total = response['hits']['total']
-        annotation_ids = [hit['_id'] for hit in response['hits']['hits']]
+        hits = response['hits']['hits']
+        annotation_ids = [hit['_id'] for hit in hits]
         aggregations = self._parse_aggregation_results(response.aggregations)
-        return (total, annotation_ids, aggregations)
+        next_cursor = query.next_cursor(search, hits)
+        return (total, annotation_ids, aggregations, next_cursor)
 
     def _search_replies(self, annotation_ids):
         if not self.separate_replies:
@@ -126,11 +210,11 @@ class Search(object):
         # The only difference between a search for annotations and a search for
         # replies to annotations is the RepliesMatcher and the params passed to
         # the modifiers.
-        response = self._search(
+        response = self._execute(self._build(
             [query.RepliesMatcher(annotation_ids)] + self._modifiers,
             [],  # Aggregations aren't used in replies.
             MultiDict({'limit': self._replies_limit}),
-        )
+        ))
 
         if len(response['hits']['hits']) < response['hits']['total']:
             log.warning("The number of reply annotations exceeded the page size "
@@ -140,6 +224,39 @@ class Search(object):
 
         return [hit['_id'] for hit in response['hits']['hits']]
 
+    def _search_all_replies(self, annotation_ids):
+        """
+        Return the ids of all the replies to `annotation_ids`, up to a limit.
+
+        Returns a list of up to `self.replies_max` reply ids, and a cursor from
+        which to continue if there may be more (or ``None``).
+        """
+        reply_ids = []
+        search_after = None
+        if self.replies_cursor is not None:
+            search_after = query.parse_replies_cursor(self.replies_cursor)
+
+        # Page through the replies with search_after, which costs the same for
+        # each page however deep. The annotation id breaks ties between
+        # replies updated at the same time, so that none are skipped.
+        while len(reply_ids) < self.replies_max:
+            size = min(self._replies_limit, self.replies_max - len(reply_ids))
+            search = self._build(
+                [query.RepliesMatcher(annotation_ids)] + self._modifiers,
+                [],  # Aggregations aren't used in replies.
+                MultiDict({'limit': size}),
+            ).sort({'updated': {'order': 'desc'}}, {'id': {'order': 'asc'}})
+            if search_after is not None:
+                search = search.extra(search_after=search_after)
+
+            hits = self._execute(search)['hits']['hits']
+            reply_ids.extend(hit['_id'] for hit in hits)
+            if len(hits) < size:
+                return reply_ids, None
+            search_after = list(hits[-1]['sort'])
+
+        return reply_ids, cursor.encode(search_after)
+
     def _parse_aggregation_results(self, aggregations):
         if not aggregations:
             return {}
@@ -150,22 +267,55 @@ class Search(object):
         return results
 
     @contextmanager
-    def _instrument(self):
+    def _instrument(self, cache_hit=None):
+        """
+        Time and count Elasticsearch queries, or searches using the cache.
+
+        If `cache_hit` is given, the search is counted and timed as a hit
+        (``search.cache.hit``) or a miss (``search.cache.miss``) of the cache
+        of results, so that the hit ratio and the time saved by hits can be
+        compared.
+        """
         if not self.stats:
             yield
             return
 
+        if cache_hit is None:
+            metric = 'search.query'
+        else:
+            metric = 'search.cache.hit' if cache_hit else 'search.cache.miss'
+
         s = self.stats.pipeline()
-        timer = s.timer('search.query').start()
+        timer = s.timer(metric).start()
         try:
             yield
-            s.incr('search.query.success')
+            s.incr(metric + '.success')
         except ConnectionTimeout:
-            s.incr('search.query.timeout')
+            s.incr(metric + '.timeout')
             raise
         except:  # noqa: E722
-            s.incr('search.query.error')
+            s.incr(metric + '.error')
             raise
         finally:
             timer.stop()
             s.send()
+
+
+def _auth_filters(request):
+    """Return the filters which hide annotations the request may not read."""
+    if request.feature('search_by_read_principals'):
+        return [query.ReadPrincipalsFilter(request)]
+    return [query.AuthFilter(request), query.GroupAuthFilter(request)]
+
+
+def _cacheable_uris(params):
+    """
+    Return the normalized URIs searched for, if the results can be cached.
+
+    Only the results of searches for the annotations of particular URIs are
+    cached, as only they can be invalidated when annotations change.
+    """
+    uris = params.getall('uri') + params.getall('url')
+    if 'wildcard_uri' in params or any('*' in u or '?' in u for u in uris):
+        return None
+    return [uri.normalize(u) for u in uris]
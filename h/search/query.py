@@ -4,10 +4,11 @@ from __future__ import unicode_literals
 from dateutil.parser import parse
 from dateutil import tz
 from datetime import datetime as dt
-from h._compat import urlparse
+from h._compat import integer_types, text_type, urlparse
+from pyramid import security
 
 from h import storage
-from h.util import uri
+from h.util import cursor, uri
 from elasticsearch_dsl import Q
 from elasticsearch_dsl.query import SimpleQueryString
 
@@ -103,19 +104,60 @@ class Limiter(object):
         return val
 
 
+# The fields (after mapping) which cursors may sort by.
+CURSOR_FIELDS = ("created", "updated", "group", "id", "user_raw")
+
+
+def parse_cursor(value):
+    """
+    Return the sort field, order and search_after values of a cursor.
+
+    :param value: a cursor returned by :py:func:`next_cursor`
+    :raises ValueError: if `value` isn't a cursor returned by
+        :py:func:`next_cursor`
+    """
+    values = cursor.decode(value)
+    if (len(values) not in (3, 4) or values[0] not in CURSOR_FIELDS or
+            values[1] not in ("asc", "desc")):
+        raise ValueError("invalid search cursor: {!r}".format(value))
+    return values[0], values[1], values[2:]
+
+
+def parse_replies_cursor(value):
+    """
+    Return the search_after values of a replies cursor.
+
+    :param value: a replies_cursor returned by a search for all replies (see
+        :py:class:`h.search.core.Search`): the ``updated`` time, in
+        milliseconds, and the id of the last reply returned
+    :raises ValueError: if `value` isn't a replies cursor
+    """
+    values = cursor.decode(value)
+    if (len(values) != 2 or isinstance(values[0], bool) or
+            not isinstance(values[0], integer_types) or
+            not isinstance(values[1], text_type)):
+        raise ValueError("invalid replies cursor: {!r}".format(value))
+    return values
+
+
 class Sorter(object):
     """
-    Sorts and returns annotations after search_after.
+    Sorts and returns annotations after search_after or cursor.
 
     Sorts annotations by sort (the key to sort by)
     and the order (the order in which to sort by).
 
     Returns annotations after search_after. search_after
     must be the value of the annotation's sort field.
+
+    Alternatively, returns the annotations after cursor, a cursor returned by
+    :py:func:`next_cursor` for a previous page of results. The cursor
+    determines the sort and order, and replaces offset.
     """
 
     def __call__(self, search, params):
         sort_by = params.pop("sort", "updated")
+        order = params.pop("order", "desc")
         # Sorting must be done on non-analyzed fields.
         if sort_by == "user":
             sort_by = "user_raw"
@@ -127,22 +169,37 @@ class Sorter(object):
             if sort_by in ["updated", "created"]:
                 search_after = self._parse_date(search_after)
 
-        if search_after:
+        cursor_values = params.pop("cursor", None)
+        if cursor_values is not None:
+            cursor_values = parse_cursor(cursor_values)
+            sort_by, order, search_after = cursor_values
+            # The cursor continues from the last annotation of the previous
+            # page, whatever its offset.
+            params.pop("offset", None)
+            search = search.extra(search_after=search_after)
+        elif search_after:
             search = search.extra(search_after=[search_after])
 
-        return search.sort(
-            {sort_by:
-                {"order": params.pop("order", "desc"),
-
-                 # `unmapped_type` causes unknown fields specified as arguments to
-                 # `sort` behave as if all documents contained empty values of the
-                 # given type. Without this, specifying eg. `sort=foobar` throws
-                 # an exception.
-                 #
-                 # We use the field type `boolean` to assist with migration because
-                 # that exists in both ES 1 and ES 6.
-                 "unmapped_type": "boolean"}}
-        )
+        sort = [{sort_by:
+                 {"order": order,
+
+                  # `unmapped_type` causes unknown fields specified as arguments to
+                  # `sort` behave as if all documents contained empty values of the
+                  # given type. Without this, specifying eg. `sort=foobar` throws
+                  # an exception.
+                  #
+                  # We use the field type `boolean` to assist with migration because
+                  # that exists in both ES 1 and ES 6.
+                  "unmapped_type": "boolean"}}]
+
+        # Break ties between annotations with the same value of the sort field
+        # by their ids, so that a cursor can continue exactly after the last
+        # annotation of a page. (search_after only has the sort field's value.)
+        tiebreak = len(cursor_values[2]) > 1 if cursor_values else not search_after
+        if tiebreak and sort_by != "id":
+            sort.append({"id": {"order": order}})
+
+        return search.sort(*sort)
 
     def _parse_date(self, str_value):
         """
@@ -171,6 +228,24 @@ class Sorter(object):
                 pass
 
 
+def next_cursor(search, hits):
+    """
+    Return a cursor for the page of results following `hits`, or ``None``.
+
+    :param search: the search, sorted by :py:class:`Sorter`, which returned
+        `hits`
+    :param hits: the hits returned by the search
+    """
+    query = search.to_dict()
+    if not hits or len(hits) < query.get("size", 10):
+        return None
+
+    ((sort_by, options),) = query["sort"][0].items()
+    if sort_by not in CURSOR_FIELDS:
+        return None
+    return cursor.encode([sort_by, options["order"]] + list(hits[-1]["sort"]))
+
+
 class TopLevelAnnotationsFilter(object):
 
     """Matches top-level annotations only, filters out replies."""
@@ -219,6 +294,32 @@ class AuthFilter(object):
                                        Q("term", user_raw=userid)]))
 
 
+class ReadPrincipalsFilter(object):
+    """
+    A filter that selects only annotations the request may read.
+
+    Matches the annotations whose indexed read principals (see
+    :py:class:`h.presenters.AnnotationSearchIndexPresenter`) include one of the
+    request's principals. This does the work of both AuthFilter and
+    GroupAuthFilter, without querying the database, with a filter which is the
+    same for all requests with the same principals, so Elasticsearch can cache
+    it.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    def __call__(self, search, _):
+        userid = self.request.authenticated_userid
+        principals = set([security.Everyone])
+        if userid is not None:
+            principals.add(userid)
+        principals.update(p for p in self.request.effective_principals
+                          if p.startswith('group:'))
+
+        return search.filter("terms", read_principals=sorted(principals))
+
+
 class GroupFilter(object):
 
     """
@@ -240,10 +341,14 @@ class GroupAuthFilter(object):
     def __init__(self, request):
         self.user = request.user
         self.group_service = request.find_service(name="group")
+        self._groups = None
 
     def __call__(self, search, _):
-        groups = self.group_service.groupids_readable_by(self.user)
-        return search.filter("terms", group=groups)
+        # The readable groups are looked up once, and reused for each search
+        # the filter is applied to (the search for replies, for example).
+        if self._groups is None:
+            self._groups = self.group_service.groupids_readable_by(self.user)
+        return search.filter("terms", group=self._groups)
 
 
 class UriFilter(object):
@@ -265,6 +370,12 @@ class UriFilter(object):
             return search
         query_uris = popall(params, 'uri') + popall(params, 'url')
 
+        if self.request.feature('search_by_document_id'):
+            queries = _document_queries(self.request, query_uris)
+            if len(queries) == 1:
+                return search.filter(queries[0])
+            return search.filter(Q('bool', should=queries))
+
         uris = set()
         for query_uri in query_uris:
             expanded = storage.expand_uri(self.request.db, query_uri)
@@ -322,13 +433,16 @@ class UriCombinedWildcardFilter(object):
         wildcard_uris = self._normalize_uris(
             [u for u in wildcard_uris if wildcard_uri_is_valid(u)],
             normalize_method=self._wildcard_uri_normalized)
-        uris = self._normalize_uris(uris)
 
         queries = []
         if wildcard_uris:
             queries = [Q('wildcard', **{"target.scope": u}) for u in wildcard_uris]
-        if uris:
-            queries.append(Q("terms", **{'target.scope': uris}))
+        if self.request.feature('search_by_document_id'):
+            queries.extend(_document_queries(self.request, uris))
+        else:
+            uris = self._normalize_uris(uris)
+            if uris:
+                queries.append(Q("terms", **{'target.scope': uris}))
         return search.query('bool', should=queries)
 
     def _normalize_uris(self, query_uris, normalize_method=uri.normalize):
@@ -364,6 +478,34 @@ class UriCombinedWildcardFilter(object):
         return wildcard_uri
 
 
+def _document_queries(request, query_uris):
+    """
+    Return queries matching the annotations of the documents of `query_uris`.
+
+    Each URI is resolved to the id of its document, and annotations are
+    matched by their document id rather than by all of the URIs of their
+    document. Annotations on URIs for which we have no document are matched
+    by their normalized URI.
+    """
+    document_ids = set()
+    uris = set()
+    for query_uri in query_uris:
+        document_id = storage.document_id_for_uri(request.db, query_uri)
+        if document_id is None:
+            uris.add(uri.normalize(query_uri))
+        else:
+            document_ids.add(document_id)
+
+    queries = []
+    if len(document_ids) == 1:
+        queries.append(Q('term', document_id=document_ids.pop()))
+    elif document_ids:
+        queries.append(Q('terms', document_id=sorted(document_ids)))
+    if uris:
+        queries.append(Q('terms', **{'target.scope': sorted(uris)}))
+    return queries
+
+
 class UserFilter(object):
 
     """
@@ -398,6 +540,7 @@ class NipsaFilter(object):
     def __init__(self, request):
         self.group_service = request.find_service(name='group')
         self.user = request.user
+        self._created_groups = None
 
     def __call__(self, search, _):
         """Filter out all NIPSA'd annotations except the current user's."""
@@ -411,7 +554,10 @@ class NipsaFilter(object):
             should_clauses.append(Q("term", user=self.user.userid.lower()))
 
             # Also include nipsa'd annotations for groups that the user created.
-            created_groups = self.group_service.groupids_created_by(self.user)
+            # These are looked up once, like GroupAuthFilter's groups.
+            if self._created_groups is None:
+                self._created_groups = self.group_service.groupids_created_by(self.user)
+            created_groups = self._created_groups
             if created_groups:
                 should_clauses.append(Q("terms", group=created_groups))
 
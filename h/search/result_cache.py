@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+A process-wide cache of search results.
+
+The sidebar of each client on a popular page makes the same search over and
+over again. When enabled, this cache keeps the results of searches for
+annotations of particular URIs (see :py:meth:`h.search.core.Search.run`) for a
+limited time.
+
+Results are keyed by the Elasticsearch query of the search, which includes the
+filters that decide what the searching user may see (their userid, the groups
+they can read, and whether they are NIPSA'd).
+
+Annotations are indexed by Celery workers, not by the web processes which
+cache results. Once a worker has written a created, updated or deleted
+annotation to Elasticsearch (see :py:mod:`h.tasks.indexer`), it publishes the
+annotation's URIs over the realtime exchange, and each web process invalidates
+its results for them (see :py:class:`Listener`). Results are still bounded by
+their TTL, in case a message is lost.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import threading
+import time
+
+from h import realtime
+
+# The default maximum number of search results to cache.
+DEFAULT_SIZE = 1000
+
+# The routing key of the realtime messages listing the normalized URIs whose
+# results are out of date.
+ROUTING_KEY = 'search_invalidation'
+
+
+class ResultCache(object):
+    """
+    A cache of search results, bounded in size and in age.
+
+    :param ttl: how long, in seconds, to keep each result. If 0 (the default)
+        nothing is cached.
+    :param size: the maximum number of results to keep. The least recently
+        used result is dropped to make room for a new one.
+    :param clock: a function returning the current time, in seconds
+    """
+
+    def __init__(self, ttl=0, size=DEFAULT_SIZE, clock=time.time):
+        self.ttl = ttl
+        self.size = size
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        # Maps each key to the time its result expires, the result and the
+        # normalized URIs it is for, least recently used first.
+        self._results = OrderedDict()
+        # Maps each normalized URI to the keys of the results for it.
+        self._by_uri = {}
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        """Return the cached result for `key`, or `None`."""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            try:
+                entry = self._results.pop(key)
+            except KeyError:
+                return None
+
+            if entry[0] <= self._clock():
+                self._forget(key, entry)
+                return None
+
+            # Mark the result as the most recently used.
+            self._results[key] = entry
+            return entry[1]
+
+    def set(self, key, result, uris):
+        """
+        Cache `result` for `key`.
+
+        :param uris: the normalized URIs of the annotations searched for. The
+            result is invalidated when an annotation of one of them changes.
+        """
+        if not self.enabled:
+            return
+
+        uris = frozenset(uris)
+        with self._lock:
+            old = self._results.pop(key, None)
+            if old is not None:
+                self._forget(key, old)
+
+            self._results[key] = (self._clock() + self.ttl, result, uris)
+            for uri in uris:
+                self._by_uri.setdefault(uri, set()).add(key)
+
+            while len(self._results) > self.size:
+                oldest = next(iter(self._results))
+                self._forget(oldest, self._results.pop(oldest))
+
+    def invalidate(self, uris):
+        """Forget the results for any of the normalized URIs `uris`."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            for uri in set(uris):
+                for key in self._by_uri.pop(uri, ()):
+                    entry = self._results.pop(key, None)
+                    if entry is not None:
+                        self._forget(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._by_uri.clear()
+
+    def _forget(self, key, entry):
+        for uri in entry[2]:
+            keys = self._by_uri.get(uri)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_uri[uri]
+
+
+class Listener(object):
+    """
+    Invalidates results in a cache when told to by the indexer.
+
+    Listens for the realtime messages published by
+    :py:meth:`h.realtime.Publisher.publish_search_invalidation` in a background
+    thread, and invalidates the results for the URIs in each one.
+
+    :param cache: the cache to invalidate results in
+    :param settings: the application's settings, which configure the
+        connection to the broker
+    """
+
+    def __init__(self, cache, settings=None):
+        self.cache = cache
+        self.settings = settings if settings is not None else {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_running(self):
+        """Start listening in a background thread, if not listening already."""
+        # N.B. The thread is started lazily, and restarted if it isn't running,
+        # because threads don't survive the worker process being forked from
+        # the process which created the listener.
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._listen,
+                                            name='search-result-cache')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def consumer(self):
+        """Return a realtime consumer which invalidates results in the cache."""
+        return realtime.Consumer(connection=realtime.get_connection(self.settings),
+                                 routing_key=ROUTING_KEY,
+                                 handler=self.handle)
+
+    def handle(self, body):
+        self.cache.invalidate(body.get('uris', []))
+
+    def _listen(self):
+        self.consumer().run()
+
+
+# The cache of search results for this process.
+cache = ResultCache()
+
+# Invalidates results in `cache` for this process.
+listener = Listener(cache)
@@ -6,6 +6,7 @@ from __future__ import unicode_literals
 
 
 def includeme(config):
+    config.register_service_factory('.annotation_export.annotation_export_service_factory', name='annotation_export')
     config.register_service_factory('.annotation_json_presentation.annotation_json_presentation_service_factory',
                                     name='annotation_json_presentation')
     config.register_service_factory('.annotation_moderation.annotation_moderation_service_factory', name='annotation_moderation')
@@ -16,6 +17,8 @@ def includeme(config):
     config.register_service_factory('.delete_group.delete_group_service_factory', name='delete_group')
     config.register_service_factory('.delete_user.delete_user_service_factory', name='delete_user')
     config.register_service_factory('.developer_token.developer_token_service_factory', name='developer_token')
+    config.register_service_factory('.document_annotation_count.document_annotation_count_service_factory',
+                                    name='document_annotation_count')
     config.register_service_factory('.feature.feature_service_factory', name='feature')
     config.register_service_factory('.flag.flag_service_factory', name='flag')
     config.register_service_factory('.flag_count.flag_count_service_factory', name='flag_count')
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import functools
+import json
+
+from h import search as search_lib
+from h.search import UriCombinedWildcardFilter
+from h.search.query import LIMIT_MAX
+from h.services.annotation_json_presentation import annotation_json_presentation_service_factory
+
+# Search parameters which control paging, sorting and replies, which the
+# export decides for itself.
+IGNORED_PARAMS = ('_separate_replies', '_all_replies', '_replies_cursor',
+                  'sort', 'order', 'limit', 'offset', 'search_after', 'cursor')
+
+
+class AnnotationExportService(object):
+    """
+    Exports all of the annotations matching a search.
+
+    Annotations are searched for and presented a page at a time, following
+    each page's cursor (see :py:func:`h.search.query.next_cursor`), so that
+    exporting any number of annotations takes the same memory.
+    """
+
+    def __init__(self, request, presentation_svc_factory, page_size=LIMIT_MAX):
+        self.request = request
+        self.presentation_svc_factory = presentation_svc_factory
+        self.page_size = page_size
+
+    def export(self, params):
+        """
+        Yield the annotations matching `params`, as one line of JSON each.
+
+        Annotations are exported oldest first, so annotations created or
+        updated during the export don't change the pages that follow.
+
+        :param params: the search parameters, as validated by
+            :py:class:`h.schemas.annotation.SearchParamsSchema`
+        :type params: webob.multidict.MultiDict
+        """
+        params = params.copy()
+        for key in IGNORED_PARAMS:
+            if key in params:
+                del params[key]
+        params['sort'] = 'created'
+        params['order'] = 'asc'
+        params['limit'] = self.page_size
+
+        cursor = None
+        while True:
+            page_params = params.copy()
+            if cursor is not None:
+                page_params['cursor'] = cursor
+            result = self._search(page_params)
+
+            # Present each page with a new presentation service, whose
+            # formatters' caches only hold the page's annotations.
+            presentation_svc = self.presentation_svc_factory()
+            for annotation in presentation_svc.present_all(result.annotation_ids):
+                yield json.dumps(annotation) + '\n'
+
+            if result.next_cursor is None:
+                return
+            cursor = result.next_cursor
+
+    def _search(self, params):
+        search = search_lib.Search(self.request,
+                                   stats=getattr(self.request, 'stats', None))
+        search.append_modifier(UriCombinedWildcardFilter(self.request, separate_keys=True))
+        return search.run(params)
+
+
+def annotation_export_service_factory(context, request):
+    presentation_svc_factory = functools.partial(
+        annotation_json_presentation_service_factory, context, request)
+    return AnnotationExportService(request=request,
+                                   presentation_svc_factory=presentation_svc_factory)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+
+from h.models import Annotation, Document, DocumentAnnotationCount, DocumentURI, Group
+from h.models.group import ReadableBy
+from h.util.uri import normalize as uri_normalize
+
+# The number of documents recounted at a time by `update_all`.
+WINDOW_SIZE = 1000
+
+
+class DocumentAnnotationCountService(object):
+    """
+    A service for counting the public annotations of documents.
+
+    The counts are stored (see :py:class:`h.models.DocumentAnnotationCount`),
+    so that they can be read with a single cheap query. They are recounted
+    when the annotations of a document change, and all of them are recounted
+    periodically to correct any which were missed.
+    """
+
+    def __init__(self, session, nipsa_svc):
+        self.session = session
+        self.nipsa_svc = nipsa_svc
+
+    def count(self, uri):
+        """
+        Return the stored number of public annotations of a URI.
+
+        Returns the total of the counts of the documents which have `uri` as
+        one of their URIs: 0 if `uri` has never been annotated, or ``None`` if
+        one of the documents hasn't been counted yet.
+        """
+        return self.counts([uri])[uri]
+
+    def counts(self, uris):
+        """
+        Return the stored numbers of public annotations of several URIs.
+
+        Like :py:meth:`count`, but counts all of `uris` with a single query.
+        Returns a dict mapping each of `uris` to its count.
+        """
+        normalized = dict((uri, uri_normalize(uri)) for uri in uris)
+        if not normalized:
+            return {}
+
+        rows = (self.session.query(DocumentURI.uri_normalized,
+                                   DocumentURI.document_id,
+                                   DocumentAnnotationCount.total)
+                .outerjoin(DocumentAnnotationCount,
+                           DocumentAnnotationCount.document_id == DocumentURI.document_id)
+                .filter(DocumentURI.uri_normalized.in_(set(normalized.values())))
+                .distinct())
+
+        totals = {}
+        for uri_normalized, _, total in rows:
+            current = totals.get(uri_normalized, 0)
+            if current is None or total is None:
+                totals[uri_normalized] = None
+            else:
+                totals[uri_normalized] = current + total
+
+        return dict((uri, totals.get(uri_normalized, 0))
+                    for uri, uri_normalized in normalized.items())
+
+    def update(self, document_ids):
+        """Recount the public annotations of the given documents."""
+        self._update(document_ids, self.nipsa_svc.fetch_all_flagged_userids())
+
+    def update_all(self, window_size=WINDOW_SIZE):
+        """
+        Recount the public annotations of every document, a window at a time.
+
+        This is a generator which recounts the next `window_size` documents
+        each time it's advanced, so that the caller can commit each window's
+        counts separately rather than holding every count's row lock until
+        all the documents have been recounted.
+        """
+        nipsa_userids = self.nipsa_svc.fetch_all_flagged_userids()
+
+        last_id = 0
+        while True:
+            document_ids = [id_ for (id_,) in
+                            self.session.query(Document.id)
+                                        .filter(Document.id > last_id)
+                                        .order_by(Document.id)
+                                        .limit(window_size)]
+            if not document_ids:
+                return
+
+            self._update(document_ids, nipsa_userids)
+            last_id = document_ids[-1]
+            yield document_ids
+
+    def _update(self, document_ids, nipsa_userids):
+        document_ids = [id_ for (id_,) in
+                        self.session.query(Document.id).filter(Document.id.in_(set(document_ids)))]
+        if not document_ids:
+            return
+
+        counts = dict((id_, (0, 0)) for id_ in document_ids)
+        for document_id, top_level, total in self._count(document_ids, nipsa_userids):
+            counts[document_id] = (top_level, total)
+
+        stmt = insert(DocumentAnnotationCount.__table__).values([
+            {'document_id': document_id, 'top_level': top_level, 'total': total}
+            for document_id, (top_level, total) in counts.items()])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['document_id'],
+            set_={'top_level': stmt.excluded.top_level,
+                  'total': stmt.excluded.total,
+                  'updated': sa.func.now()})
+        self.session.execute(stmt)
+
+    def _count(self, document_ids, nipsa_userids):
+        is_reply = sa.func.coalesce(sa.func.array_length(Annotation.references, 1), 0) > 0
+
+        query = (self.session.query(Annotation.document_id,
+                                    sa.func.sum(sa.case([(is_reply, 0)], else_=1)),
+                                    sa.func.count(Annotation.id))
+                 .join(Group, Group.pubid == Annotation.groupid)
+                 .filter(Annotation.document_id.in_(document_ids),
+                         Annotation.shared.is_(True),
+                         Annotation.deleted.is_(False),
+                         Group.readable_by == ReadableBy.world)
+                 .group_by(Annotation.document_id))
+
+        if nipsa_userids:
+            query = query.filter(Annotation.userid.notin_(nipsa_userids))
+
+        return query.all()
+
+
+def document_annotation_count_service_factory(context, request):
+    return DocumentAnnotationCountService(session=request.db,
+                                          nipsa_svc=request.find_service(name='nipsa'))
@@ -22,10 +22,10 @@ from datetime import datetime
 
 from pyramid import i18n
 
-from h import models, schemas
+from h import events, models, schemas, uri_expansion
 from h.db import types
 from h.util.group_scope import match as group_scope_match
-from h.models.document import update_document_metadata
+from h.models.document import pop_merged_document_ids, update_document_metadata
 
 _ = i18n.TranslationStringFactory(__package__)
 
@@ -147,6 +147,7 @@ def create_annotation(request, data, group_service):
         created=created,
         updated=updated)
     annotation.document = document
+    _notify_merged_documents(request)
 
     request.db.add(annotation)
     request.db.flush()
@@ -206,6 +207,7 @@ def update_annotation(request, id_, data, group_service):
                                             document_uri_dicts,
                                             updated=updated)
         annotation.document = document
+        _notify_merged_documents(request)
 
     return annotation
 
@@ -242,6 +244,42 @@ def expand_uri(session, uri):
     :returns: a list of equivalent URIs
     :rtype: list
     """
+    expanded = uri_expansion.cache.get(uri)
+    if expanded is None:
+        expanded = _expand_uri(session, uri)
+        uri_expansion.cache.set(uri, expanded)
+    return expanded
+
+
+def document_id_for_uri(session, uri):
+    """
+    Return the id of the document which `uri` refers to.
+
+    Returns ``None`` if we have no document record for `uri`, or if `uri` is
+    the "canonical" link of its document (see :py:func:`expand_uri`), in which
+    case annotations should be matched by their URI instead.
+
+    :param session: the database session
+    :type session: sqlalchemy.orm.session.Session
+
+    :param uri: a URI associated with the document
+    :type uri: str
+
+    :rtype: int or None
+    """
+    doc = models.Document.find_by_uris(session, [uri]).one_or_none()
+
+    if doc is None:
+        return None
+
+    for docuri in doc.document_uris:
+        if docuri.uri == uri and docuri.type == 'rel-canonical':
+            return None
+
+    return doc.id
+
+
+def _expand_uri(session, uri):
     doc = models.Document.find_by_uris(session, [uri]).one_or_none()
 
     if doc is None:
@@ -258,6 +296,14 @@ def expand_uri(session, uri):
     return [docuri.uri for docuri in docuris]
 
 
+def _notify_merged_documents(request):
+    # Updating document metadata may have merged documents, whose annotations
+    # must then be reindexed with the ids of the documents they now belong to.
+    for document_id in pop_merged_document_ids(request.db):
+        event = events.DocumentMergedEvent(request, document_id)
+        request.notify_after_commit(event)
+
+
 def _validate_group_scope(group, target_uri):
     if not group.scopes:
         return
@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""
+Support for the permessage-deflate websocket extension (:rfc:`7692`).
+
+The extension is negotiated in the websocket handshake (see
+:py:meth:`PerMessageDeflate.negotiate`). If a client and the server agree to
+use it, messages sent in either direction may be compressed.
+
+By default the server doesn't use "context takeover": every message is
+compressed on its own, rather than with the compression context of the
+previous messages to the same client. This costs a little compression, but
+means that a notification compressed once can be sent to every client that
+negotiated the same parameters, and that no connection needs a zlib context
+of its own.
+
+ws4py doesn't support extensions which use the RSV1 bit of a frame, so
+:py:class:`DeflateStream` replaces ws4py's stream parser for connections
+which have negotiated the extension. Its ``receiver`` is lifted straight from
+ws4py 0.4.2, and is used here under the terms of the MIT license distributed
+with the ws4py project. Such code remains copyright (c) 2011-2015, Sylvain
+Hellegouarch. The only change is that it parses frames with
+:py:class:`_DeflateFrame`, which decompresses compressed frames.
+"""
+from __future__ import unicode_literals
+
+import struct
+from struct import unpack
+import zlib
+
+from ws4py.compat import ord, py3k
+from ws4py.exc import FrameTooLargeException, ProtocolException
+from ws4py.framing import (Frame, OPCODE_BINARY, OPCODE_CLOSE,
+                           OPCODE_CONTINUATION, OPCODE_PING, OPCODE_PONG,
+                           OPCODE_TEXT)
+from ws4py.messaging import (BinaryMessage, CloseControlMessage,
+                             PingControlMessage, PongControlMessage,
+                             TextMessage)
+from ws4py.streaming import Stream, VALID_CLOSING_CODES
+from ws4py.utf8validator import Utf8Validator
+
+from h._compat import text_type
+
+EXTENSION_NAME = 'permessage-deflate'
+
+# The default zlib compression level for messages sent to clients.
+DEFAULT_LEVEL = 6
+
+# The largest message, once decompressed, which a client may send.
+MAX_INFLATED_SIZE = 1024 * 1024
+
+# Every compressed message ends with these bytes, which are left out of the
+# message as sent (see section 7.2.1 of RFC 7692).
+_TAIL = b'\x00\x00\xff\xff'
+
+
+class PerMessageDeflate(object):
+    """
+    The server's configuration of the permessage-deflate extension.
+
+    :param level: the zlib compression level (0-9) for messages to clients
+    :param context_takeover: whether the server and clients should keep their
+        compression contexts from one message to the next. This compresses
+        better, but each connection then needs its own zlib contexts, and no
+        compressed message can be shared between connections.
+    """
+
+    def __init__(self, level=DEFAULT_LEVEL, context_takeover=False):
+        if not 0 <= level <= 9:
+            raise ValueError('invalid compression level: {!r}'.format(level))
+        self.level = level
+        self.context_takeover = context_takeover
+
+        # Negotiated parameters with no per-connection state, keyed by
+        # window size.
+        self._shared = {}
+
+    def negotiate(self, header):
+        """
+        Accept the first acceptable permessage-deflate offer in `header`.
+
+        :param header: the value of the client's ``Sec-WebSocket-Extensions``
+            header, if any
+        :returns: the :py:class:`Deflate` parameters to use for the
+            connection, or `None` if the client made no acceptable offer
+        """
+        for name, params in parse_extensions(header):
+            if name != EXTENSION_NAME:
+                continue
+            deflate = self._accept(params)
+            if deflate is not None:
+                return deflate
+        return None
+
+    def _accept(self, params):
+        names = [name for name, _ in params]
+        if len(set(names)) != len(names):
+            return None
+
+        window_bits = None
+        server_context_takeover = self.context_takeover
+        client_context_takeover = self.context_takeover
+
+        for name, value in params:
+            if name == 'server_no_context_takeover' and value is None:
+                server_context_takeover = False
+            elif name == 'client_no_context_takeover' and value is None:
+                client_context_takeover = False
+            elif name == 'server_max_window_bits':
+                window_bits = _window_bits(value)
+                # N.B. zlib can't compress with a window of 256 bytes.
+                if window_bits is None or window_bits == 8:
+                    return None
+            elif name == 'client_max_window_bits':
+                # We can decompress messages compressed with any window size,
+                # so there's no need to limit the client's.
+                if value is not None and _window_bits(value) is None:
+                    return None
+            else:
+                return None
+
+        if not server_context_takeover and not client_context_takeover:
+            key = window_bits
+            if key not in self._shared:
+                self._shared[key] = Deflate(self.level, window_bits, False, False)
+            return self._shared[key]
+
+        return Deflate(self.level,
+                       window_bits,
+                       server_context_takeover,
+                       client_context_takeover)
+
+
+class Deflate(object):
+    """
+    The permessage-deflate parameters negotiated with a client.
+
+    Instances with context takeover in neither direction have no
+    per-connection state, and are shared between connections.
+    """
+
+    __slots__ = ('level',
+                 'window_bits',
+                 'server_context_takeover',
+                 'client_context_takeover',
+                 '_compressor',
+                 '_decompressor')
+
+    def __init__(self, level, window_bits,
+                 server_context_takeover, client_context_takeover):
+        self.level = level
+        self.window_bits = window_bits
+        self.server_context_takeover = server_context_takeover
+        self.client_context_takeover = client_context_takeover
+        self._compressor = None
+        self._decompressor = None
+
+    @property
+    def shared(self):
+        """Whether messages compressed with these parameters can be shared."""
+        return not self.server_context_takeover
+
+    @property
+    def response(self):
+        """The ``Sec-WebSocket-Extensions`` response header accepting these."""
+        params = [EXTENSION_NAME]
+        if not self.server_context_takeover:
+            params.append('server_no_context_takeover')
+        if not self.client_context_takeover:
+            params.append('client_no_context_takeover')
+        if self.window_bits is not None:
+            params.append('server_max_window_bits={:d}'.format(self.window_bits))
+        return '; '.join(params)
+
+    def frame(self, data):
+        """Return `data` compressed as a complete websocket text frame."""
+        if isinstance(data, text_type):
+            data = data.encode('utf-8')
+
+        compressor = self._compressor
+        if compressor is None:
+            compressor = zlib.compressobj(self.level,
+                                          zlib.DEFLATED,
+                                          -(self.window_bits or zlib.MAX_WBITS))
+            if self.server_context_takeover:
+                self._compressor = compressor
+
+        body = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if body.endswith(_TAIL):
+            body = body[:-len(_TAIL)]
+
+        # Frames sent by a server are never masked.
+        return Frame(opcode=OPCODE_TEXT, body=body, fin=1, rsv1=1).build()
+
+    def decompressor(self):
+        """Return the zlib context with which to decompress a message."""
+        decompressor = self._decompressor
+        if decompressor is None:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            if self.client_context_takeover:
+                self._decompressor = decompressor
+        return decompressor
+
+
+class DeflateStream(Stream):
+    """A ws4py stream which decompresses messages compressed by the client."""
+
+    def __init__(self, deflate, always_mask=False, expect_masking=True):
+        super(DeflateStream, self).__init__(always_mask=always_mask,
+                                            expect_masking=expect_masking)
+        self._inflater = _Inflater(deflate)
+
+    def receiver(self):
+        """
+        Parser that keeps trying to interpret bytes it is fed with as
+        incoming frames part of a message.
+
+        See :py:meth:`ws4py.streaming.Stream.receiver`.
+        """
+        utf8validator = Utf8Validator()
+        running = True
+        frame = None
+        while running:
+            frame = _DeflateFrame(self._inflater)
+            while 1:
+                try:
+                    some_bytes = (yield next(frame.parser))
+                    frame.parser.send(some_bytes)
+                except GeneratorExit:
+                    running = False
+                    break
+                except StopIteration:
+                    frame._cleanup()
+                    some_bytes = frame.body
+
+                    # Let's avoid unmasking when there is no payload
+                    if some_bytes:
+                        if frame.masking_key and self.expect_masking:
+                            some_bytes = frame.unmask(some_bytes)
+                        elif not frame.masking_key and self.expect_masking:
+                            msg = CloseControlMessage(code=1002, reason='Missing masking when expected')
+                            self.errors.append(msg)
+                            break
+                        elif frame.masking_key and not self.expect_masking:
+                            msg = CloseControlMessage(code=1002, reason='Masked when not expected')
+                            self.errors.append(msg)
+                            break
+                        else:
+                            # If we reach this stage, it's because
+                            # the frame wasn't masked and we didn't expect
+                            # it anyway. Therefore, on py2k, the bytes
+                            # are actually a str object and can't be used
+                            # in the utf8 validator as we need integers
+                            # when we get each byte one by one.
+                            # Our only solution here is to convert our
+                            # string to a bytearray.
+                            some_bytes = bytearray(some_bytes)
+
+                    if frame.opcode == OPCODE_TEXT:
+                        if self.message and not self.message.completed:
+                            # We got a text frame before we completed the previous one
+                            msg = CloseControlMessage(code=1002, reason='Received a new message before completing previous')
+                            self.errors.append(msg)
+                            break
+
+                        m = TextMessage(some_bytes)
+                        m.completed = (frame.fin == 1)
+                        self.message = m
+
+                        if some_bytes:
+                            is_valid, end_on_code_point, _, _ = utf8validator.validate(some_bytes)
+
+                            if not is_valid or (m.completed and not end_on_code_point):
+                                self.errors.append(CloseControlMessage(code=1007, reason='Invalid UTF-8 bytes'))
+                                break
+
+                    elif frame.opcode == OPCODE_BINARY:
+                        if self.message and not self.message.completed:
+                            # We got a text frame before we completed the previous one
+                            msg = CloseControlMessage(code=1002, reason='Received a new message before completing previous')
+                            self.errors.append(msg)
+                            break
+
+                        m = BinaryMessage(some_bytes)
+                        m.completed = (frame.fin == 1)
+                        self.message = m
+
+                    elif frame.opcode == OPCODE_CONTINUATION:
+                        m = self.message
+                        if m is None:
+                            self.errors.append(CloseControlMessage(code=1002, reason='Message not started yet'))
+                            break
+
+                        m.extend(some_bytes)
+                        m.completed = (frame.fin == 1)
+                        if m.opcode == OPCODE_TEXT:
+                            if some_bytes:
+                                is_valid, end_on_code_point, _, _ = utf8validator.validate(some_bytes)
+
+                                if not is_valid or (m.completed and not end_on_code_point):
+                                    self.errors.append(CloseControlMessage(code=1007, reason='Invalid UTF-8 bytes'))
+                                    break
+
+                    elif frame.opcode == OPCODE_CLOSE:
+                        code = 1005
+                        reason = ""
+                        if frame.payload_length == 0:
+                            self.closing = CloseControlMessage(code=1005)
+                        elif frame.payload_length == 1:
+                            self.closing = CloseControlMessage(code=1005, reason='Payload has invalid length')
+                        else:
+                            try:
+                                # at this stage, some_bytes have been unmasked
+                                # so actually are held in a bytearray
+                                code = int(unpack("!H", bytes(some_bytes[0:2]))[0])
+                            except struct.error:
+                                reason = 'Failed at decoding closing code'
+                            else:
+                                # Those codes are reserved or plainly forbidden
+                                if code not in VALID_CLOSING_CODES and not (2999 < code < 5000):
+                                    reason = 'Invalid Closing Frame Code: %d' % code
+                                    code = 1005
+                                elif frame.payload_length > 1:
+                                    reason = some_bytes[2:] if frame.masking_key else frame.body[2:]
+
+                                    if not py3k: reason = bytearray(reason)  # noqa: E701
+                                    is_valid, end_on_code_point, _, _ = utf8validator.validate(reason)
+                                    if not is_valid or not end_on_code_point:
+                                        self.errors.append(CloseControlMessage(code=1007, reason='Invalid UTF-8 bytes'))
+                                        break
+                                    reason = bytes(reason)
+                            self.closing = CloseControlMessage(code=code, reason=reason)
+
+                    elif frame.opcode == OPCODE_PING:
+                        self.pings.append(PingControlMessage(some_bytes))
+
+                    elif frame.opcode == OPCODE_PONG:
+                        self.pongs.append(PongControlMessage(some_bytes))
+
+                    else:
+                        self.errors.append(CloseControlMessage(code=1003))
+
+                    break
+
+                except ProtocolException:
+                    self.errors.append(CloseControlMessage(code=1002))
+                    break
+                except FrameTooLargeException:
+                    self.errors.append(CloseControlMessage(code=1002, reason="Frame was too large"))
+                    break
+
+            frame._cleanup()
+            frame.body = None
+            frame = None
+
+            if self.message is not None and self.message.completed:
+                utf8validator.reset()
+
+        utf8validator.reset()
+        utf8validator = None
+
+        self._cleanup()
+
+
+class _Inflater(object):
+    """The decompression state of the message being received on a stream."""
+
+    def __init__(self, deflate):
+        self.deflate = deflate
+        self.compressed = False
+        self._decompressor = None
+        self._size = 0
+
+    def start(self, compressed):
+        """Start a new message, which may or may not be compressed."""
+        self.compressed = compressed
+        self._decompressor = self.deflate.decompressor() if compressed else None
+        self._size = 0
+
+    def inflate(self, data, final):
+        """
+        Decompress the next fragment of the current message.
+
+        :raises ProtocolException: if the data can't be decompressed
+        :raises FrameTooLargeException: if the message is too large once
+            decompressed
+        """
+        if final:
+            data = data + _TAIL
+        try:
+            inflated = self._decompressor.decompress(data,
+                                                     MAX_INFLATED_SIZE - self._size + 1)
+        except zlib.error:
+            raise ProtocolException()
+        self._size += len(inflated)
+        if self._size > MAX_INFLATED_SIZE:
+            raise FrameTooLargeException()
+        return inflated
+
+
+class _DeflateFrame(Frame):
+    """
+    A frame which may have been compressed by the client.
+
+    The first frame of a compressed message has its RSV1 bit set. When the
+    frame has been parsed, the body of each frame of a compressed message is
+    replaced with its decompressed contents (masked with the frame's masking
+    key, if any, as the stream expects).
+    """
+
+    def __init__(self, inflater):
+        super(_DeflateFrame, self).__init__()
+        self._inflater = inflater
+
+    def _parsing(self):
+        parser = super(_DeflateFrame, self)._parsing()
+        compressed = False
+        first = True
+        try:
+            needed = next(parser)
+            while True:
+                some_bytes = yield needed
+                if first and some_bytes:
+                    # N.B. ws4py rejects frames with the RSV1 bit set, so we
+                    # note and clear it before ws4py parses the frame.
+                    first = False
+                    first_byte = (some_bytes[0] if isinstance(some_bytes, bytearray)
+                                  else ord(some_bytes[0]))
+                    compressed = bool(first_byte & 0x40)
+                    some_bytes = (struct.pack('!B', first_byte & ~0x40) +
+                                  bytes(some_bytes[1:]))
+                try:
+                    needed = parser.send(some_bytes)
+                except StopIteration:
+                    break
+        finally:
+            parser.close()
+
+        self.rsv1 = int(compressed)
+        self._inflate(compressed)
+
+    def _inflate(self, compressed):
+        if self.opcode in (OPCODE_TEXT, OPCODE_BINARY):
+            self._inflater.start(compressed)
+        elif compressed:
+            # Only the first frame of a data message may have RSV1 set.
+            raise ProtocolException()
+
+        if self.opcode > OPCODE_BINARY or not self._inflater.compressed:
+            return
+
+        body = self.body
+        if self.masking_key:
+            body = self.unmask(body)
+        body = self._inflater.inflate(bytes(body), final=bool(self.fin))
+        if self.masking_key:
+            body = self.mask(body)
+        self.body = bytes(body)
+        self.payload_length = len(self.body)
+
+
+def parse_extensions(header):
+    """
+    Parse a ``Sec-WebSocket-Extensions`` header.
+
+    Returns a list of ``(name, params)`` tuples, one for each extension in
+    the header, where ``params`` is a list of ``(name, value)`` tuples. The
+    value of a parameter with no value is `None`.
+    """
+    extensions = []
+    for extension in (header or '').split(','):
+        parts = [part.strip() for part in extension.split(';')]
+        if not parts[0]:
+            continue
+        params = []
+        for param in parts[1:]:
+            name, sep, value = param.partition('=')
+            value = value.strip().strip('"') if sep else None
+            params.append((name.strip(), value))
+        extensions.append((parts[0], params))
+    return extensions
+
+
+def _window_bits(value):
+    try:
+        bits = int(value)
+    except (TypeError, ValueError):
+        return None
+    if not 8 <= bits <= 15 or '{:d}'.format(bits) != value:
+        return None
+    return bits
@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
-import copy
+import json
 import operator
+import re
 import unicodedata
+import weakref
 
-from jsonpointer import resolve_pointer
+from jsonpointer import JsonPointer, JsonPointerException
 from h._compat import text_type
 
+# Matches any character outside the ASCII range
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
 SCHEMA = {
     "type": "object",
     "properties": {
@@ -42,8 +47,30 @@ SCHEMA = {
 
 
 class FilterHandler(object):
+    """
+    A compiled streamer filter.
+
+    The filter is compiled once, when the client sends it: clause values are
+    folded (see :py:func:`uni_fold`), JSON pointers are parsed and operators
+    are looked up ahead of time, so that :py:meth:`match` only has to resolve
+    and fold the relevant fields of each target.
+
+    Only the compiled form of the filter is kept, as there may be one of
+    these for every connected websocket. See also :py:func:`compile_filter`.
+
+    :raises ValueError: if the filter can't be compiled
+    """
+
+    __slots__ = ('_actions', '_predicate', '_uris', '__weakref__')
+
     def __init__(self, filter_json):
-        self.filter = filter_json
+        try:
+            self._actions = frozenset(filter_json['actions'])
+            self._predicate = _compile_policy(filter_json['match_policy'],
+                                              filter_json['clauses'])
+            self._uris = _filter_uris(filter_json)
+        except (JsonPointerException, KeyError, TypeError) as exc:
+            raise ValueError('invalid filter: {!r}'.format(exc))
 
     # operators
     operators = {
@@ -63,102 +90,227 @@ class FilterHandler(object):
         'lenle': 'lenle',
     }
 
-    def evaluate_clause(self, clause, target):
-        if isinstance(clause['field'], list):
-            for field in clause['field']:
-                copied = copy.deepcopy(clause)
-                copied['field'] = field
-                result = self.evaluate_clause(copied, target)
-                if result:
-                    return True
+    def match(self, target, action=None):
+        if action and action != 'past' and action not in self._actions:
             return False
-        else:
-            field_value = resolve_pointer(target, clause['field'], None)
-            if field_value is None:
-                return False
+        return self._predicate(target)
 
-            cval = clause['value']
-            fval = field_value
-
-            if isinstance(cval, list):
-                tval = []
-                for cv in cval:
-                    tval.append(uni_fold(cv))
-                cval = tval
-            else:
-                cval = uni_fold(cval)
-
-            if isinstance(fval, list):
-                tval = []
-                for fv in fval:
-                    tval.append(uni_fold(fv))
-                fval = tval
-            else:
-                fval = uni_fold(fval)
-
-            reversed_order = False
-            # Determining operator order
-            # Normal order: field_value, clause['value']
-            # i.e. condition created > 2000.01.01
-            # Here clause['value'] = '2001.01.01'.
-            # The field_value is target['created']
-            # So the natural order is: ge(field_value, clause['value']
-
-            # But!
-            # Reversed operator order for contains (b in a)
-            if isinstance(cval, list) or isinstance(fval, list):
-                if clause['operator'] in ['one_of', 'matches']:
-                    reversed_order = True
-                    # But not in every case. (i.e. tags matches 'b')
-                    # Here field_value is a list, because an annotation can
-                    # have many tags.
-                    if isinstance(field_value, list):
-                        reversed_order = False
-
-            if reversed_order:
-                lval = cval
-                rval = fval
-            else:
-                lval = fval
-                rval = cval
-
-            op = getattr(operator, self.operators[clause['operator']])
-            return op(lval, rval)
-
-    # match_policies
-    def include_any(self, target):
-        for clause in self.filter['clauses']:
-            if self.evaluate_clause(clause, target):
-                return True
-        return False
+    def uris(self):
+        """
+        Return the folded URIs that this filter is restricted to.
 
-    def include_all(self, target):
-        for clause in self.filter['clauses']:
-            if not self.evaluate_clause(clause, target):
-                return False
-        return True
+        If the filter can only ever match annotations whose ``uri`` folds to
+        one of a known set of values, return that set. Otherwise (for example
+        if the filter matches on other fields or uses an exclude policy)
+        return ``None``.
+        """
+        return self._uris
+
+
+# Compiled filters, keyed by the canonical JSON of the filters they were
+# compiled from. Entries are dropped once no socket is using the filter.
+_compiled_filters = weakref.WeakValueDictionary()
+
+
+def compile_filter(filter_json):
+    """
+    Return a :py:class:`FilterHandler` for `filter_json`.
+
+    Clients viewing the same document send identical filters (including the
+    same expanded list of URIs), so a filter which is identical to one that
+    is already in use is not compiled again: the existing handler is
+    returned instead, and shared between the sockets.
+
+    :raises ValueError: if the filter can't be compiled
+    """
+    try:
+        key = json.dumps(filter_json, sort_keys=True)
+    except (TypeError, ValueError) as exc:
+        raise ValueError('invalid filter: {!r}'.format(exc))
+
+    handler = _compiled_filters.get(key)
+    if handler is None:
+        handler = FilterHandler(filter_json)
+        _compiled_filters[key] = handler
+    return handler
+
+
+def _filter_uris(filter_json):
+    """Return the folded URIs that `filter_json` is restricted to, or None."""
+    clauses = filter_json['clauses']
+    restrictions = [_uri_clause_values(c) for c in clauses]
+
+    if filter_json['match_policy'] == 'include_any':
+        if not clauses or None in restrictions:
+            return None
+        return frozenset().union(*restrictions)
+
+    if filter_json['match_policy'] == 'include_all':
+        restrictions = [r for r in restrictions if r is not None]
+        if not restrictions:
+            return None
+        return frozenset.intersection(*restrictions)
+
+    return None
+
+
+def _uri_clause_values(clause):
+    """
+    Return the folded URIs that a single filter clause is restricted to.
+
+    Only clauses which test the annotation ``uri`` for equality with a value,
+    or for membership of a list of values, can be reduced in this way. For
+    any other clause return ``None``.
+    """
+    if clause.get('field') != '/uri':
+        return None
+
+    value = clause.get('value')
+    operator_ = clause.get('operator')
+
+    if isinstance(value, list):
+        if operator_ == 'equals':
+            # A string is never equal to a list, so this matches nothing.
+            return frozenset()
+        if operator_ not in ['one_of', 'matches']:
+            return None
+        return frozenset(uni_fold(v) for v in value
+                         if isinstance(v, (bytes, text_type)))
 
-    def exclude_all(self, target):
-        for clause in self.filter['clauses']:
-            if not self.evaluate_clause(clause, target):
+    if operator_ == 'equals' and isinstance(value, (bytes, text_type)):
+        return frozenset([uni_fold(value)])
+
+    return None
+
+
+def _compile_policy(match_policy, clauses):
+    """Return a predicate applying `match_policy` to the compiled `clauses`."""
+    if not clauses:
+        return _match_everything
+
+    predicates = [_compile_clause(clause) for clause in clauses]
+
+    def include_any(target):
+        for predicate in predicates:
+            if predicate(target):
                 return True
         return False
 
-    def exclude_any(self, target):
-        for clause in self.filter['clauses']:
-            if self.evaluate_clause(clause, target):
+    def include_all(target):
+        for predicate in predicates:
+            if not predicate(target):
                 return False
         return True
 
-    def match(self, target, action=None):
-        if not action or action == 'past' or action in self.filter['actions']:
-            if len(self.filter['clauses']) > 0:
-                return getattr(self, self.filter['match_policy'])(target)
-            else:
-                return True
-        else:
+    def exclude_all(target):
+        return not include_all(target)
+
+    def exclude_any(target):
+        return not include_any(target)
+
+    policies = {
+        'include_any': include_any,
+        'include_all': include_all,
+        'exclude_all': exclude_all,
+        'exclude_any': exclude_any,
+    }
+    try:
+        return policies[match_policy]
+    except KeyError:
+        raise ValueError('unknown match policy: {!r}'.format(match_policy))
+
+
+def _match_everything(target):
+    return True
+
+
+def _compile_clause(clause):
+    """Return a predicate which evaluates a single filter clause."""
+    if isinstance(clause['field'], list):
+        # A clause on several fields matches if it matches any one of them.
+        predicates = [_compile_clause(dict(clause, field=field))
+                      for field in clause['field']]
+
+        def evaluate_any_field(target):
+            for predicate in predicates:
+                if predicate(target):
+                    return True
+            return False
+
+        return evaluate_any_field
+
+    resolve = _compile_pointer(clause['field'])
+
+    try:
+        op = getattr(operator, FilterHandler.operators[clause['operator']])
+    except KeyError:
+        raise ValueError('unknown operator: {!r}'.format(clause['operator']))
+
+    cval = clause['value']
+    if isinstance(cval, list):
+        cval = [uni_fold(cv) for cv in cval]
+    else:
+        cval = uni_fold(cval)
+
+    # The natural operator order is op(field_value, clause['value']), i.e.
+    # for the condition "created > 2000.01.01" we evaluate
+    # gt(target['created'], '2000.01.01').
+    #
+    # But the order is reversed for "one_of" and "matches" when the clause
+    # value is a list and the field value is not: i.e. "uri one_of [a, b]"
+    # is a test of whether the field value is in the clause value.
+    reversible = (clause['operator'] in ['one_of', 'matches'] and
+                  isinstance(cval, list))
+    members = _frozenset_or_none(cval) if reversible else None
+
+    def evaluate(target):
+        field_value = resolve(target)
+        if field_value is None:
             return False
 
+        if isinstance(field_value, list):
+            return op([uni_fold(fv) for fv in field_value], cval)
+
+        fval = uni_fold(field_value)
+        if reversible:
+            if members is not None:
+                try:
+                    return fval in members
+                except TypeError:
+                    # Unhashable field value
+                    pass
+            return fval in cval
+        return op(fval, cval)
+
+    return evaluate
+
+
+def _compile_pointer(pointer):
+    """Return a function resolving JSON pointer `pointer` in a target."""
+    pointer = JsonPointer(pointer)
+    parts = pointer.parts
+
+    def resolve(target):
+        doc = target
+        for part in parts:
+            if not isinstance(doc, dict):
+                # Leave anything other than plain object lookups to the
+                # jsonpointer library.
+                return pointer.resolve(target, None)
+            doc = doc.get(part)
+            if doc is None:
+                return None
+        return doc
+
+    return resolve
+
+
+def _frozenset_or_none(values):
+    try:
+        return frozenset(values)
+    except TypeError:
+        return None
+
 
 def first_of(a, b):
     return a[0] == b
@@ -208,5 +360,10 @@ def uni_fold(text):
         return text
 
     text = text.lower()
+
+    # Lowercased ASCII text is unchanged by normalization.
+    if not _NON_ASCII.search(text):
+        return text
+
     text = unicodedata.normalize('NFKD', text)
     return "".join([c for c in text if not unicodedata.combining(c)])
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import logging
+import time
+import weakref
+
+import gevent
+
+log = logging.getLogger(__name__)
+
+# The default interval, in seconds, between pings to each socket.
+DEFAULT_INTERVAL = 30.0
+
+# The default number of slots in the wheel. The sockets in one slot are pinged
+# every `interval / slots` seconds.
+DEFAULT_SLOTS = 30
+
+
+class HeartbeatWheel(object):
+    """
+    A single timer wheel which pings all the open websockets in a process.
+
+    By default, ws4py runs a heartbeat thread (a greenlet, in the streamer)
+    for every connection, which sends an unsolicited pong every 30 seconds.
+    With tens of thousands of mostly idle connections, those greenlets and
+    their timers are a significant overhead.
+
+    Instead, the wheel spreads sockets over a ring of slots, and one greenlet
+    visits a slot at a time, so that each socket is visited once every
+    `interval` seconds and the pings are staggered over the interval. On each
+    visit, a socket which hasn't been heard from (including pongs in reply to
+    pings) for `timeout` seconds, or whose queued messages have been waiting
+    that long, is considered dead and its connection is closed. Otherwise, it
+    is sent a ping.
+
+    All references to sockets held by the wheel are weak.
+
+    :param interval: how often, in seconds, to ping each socket
+    :param slots: the number of slots to spread the sockets over
+    :param timeout: how long, in seconds, a socket may go without being heard
+        from before it is considered dead. Defaults to three intervals.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, slots=DEFAULT_SLOTS,
+                 timeout=None, clock=time.time):
+        self.interval = interval
+        self.timeout = timeout if timeout is not None else 3 * interval
+        self._clock = clock
+
+        self._slots = [weakref.WeakSet() for _ in range(slots)]
+        self._slot_for = weakref.WeakKeyDictionary()
+        self._next_slot = 0
+        self._cursor = 0
+
+        #: The number of connections closed because the peer was dead.
+        self.closed_connections = 0
+
+    def __len__(self):
+        return len(self._slot_for)
+
+    def add(self, socket):
+        """Start pinging `socket`."""
+        if socket in self._slot_for:
+            return
+        # Sockets are added to the slots in turn, so that even a burst of new
+        # connections is spread evenly around the wheel.
+        self._slots[self._next_slot].add(socket)
+        self._slot_for[socket] = self._next_slot
+        self._next_slot = (self._next_slot + 1) % len(self._slots)
+
+    def remove(self, socket):
+        """Stop pinging `socket`."""
+        slot = self._slot_for.pop(socket, None)
+        if slot is not None:
+            self._slots[slot].discard(socket)
+
+    def tick(self):
+        """Visit the sockets in the next slot."""
+        slot = self._slots[self._cursor]
+        self._cursor = (self._cursor + 1) % len(self._slots)
+
+        now = self._clock()
+        for socket in list(slot):
+            if socket.terminated:
+                self.remove(socket)
+                continue
+            # N.B. A peer which isn't reading will also stop replying to
+            # pings, but checking how long its messages have been queued
+            # means we don't have to wait for the writes to time out.
+            if (now - socket.last_seen > self.timeout or
+                    socket.send_lag > self.timeout):
+                self._close(socket)
+                continue
+            socket.send_ping()
+
+    def run(self):
+        """Tick forever, visiting every slot once per interval."""
+        tick_interval = float(self.interval) / len(self._slots)
+        while True:
+            gevent.sleep(tick_interval)
+            try:
+                self.tick()
+            except Exception:
+                log.exception('Error sending websocket heartbeats')
+
+    def _close(self, socket):
+        log.debug('Closing connection to unresponsive websocket client')
+        self.remove(socket)
+        self.closed_connections += 1
+        # N.B. This is what ws4py's own heartbeat does when it fails to send:
+        # shutting the socket down makes the socket's reader greenlet notice
+        # that the connection has gone, and clean up.
+        socket.server_terminated = True
+        socket.close_connection()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import weakref
+
+from h.streamer.filter import uni_fold
+
+
+class SocketIndex(object):
+    """
+    An index of open websockets by the document URIs they are subscribed to.
+
+    Most clients (the sidebar, in particular) send a filter which can only
+    ever match annotations on a small, known set of URIs. Sockets with such
+    filters are indexed by those URIs, so that an annotation event only needs
+    to be checked against the sockets which could possibly be interested in
+    it. Sockets whose filters can't be reduced to a set of URIs are kept
+    separately and are checked against every event.
+
+    Sockets which haven't sent a filter yet are indexed under no URIs at all,
+    as they can't receive any annotation events.
+
+    Sockets are also indexed by their authenticated userid, so that user
+    events can be sent to just that user's sockets.
+
+    All references to sockets held by the index are weak.
+    """
+
+    def __init__(self):
+        # Maps each socket to the URIs it is indexed under, or to `None` if
+        # it must be checked against every event.
+        self._uris = weakref.WeakKeyDictionary()
+        self._by_uri = {}
+        self._unindexed = weakref.WeakSet()
+        self._by_userid = {}
+
+    def __contains__(self, socket):
+        return socket in self._uris
+
+    def __iter__(self):
+        # N.B. We iterate over a copy because there's nothing to stop sockets
+        # being added or dropped during iteration.
+        return iter(list(self._uris.keys()))
+
+    def __len__(self):
+        return len(self._uris)
+
+    def add(self, socket):
+        """Add a newly-connected `socket`, which has no filter yet."""
+        if socket not in self._uris:
+            self._uris[socket] = frozenset()
+            self._add_user(socket)
+
+    def subscribe(self, socket, uris):
+        """
+        Index `socket` under `uris`, replacing any existing entry for it.
+
+        :param socket: the websocket to index
+        :param uris: the folded URIs (see :py:func:`h.streamer.filter.uni_fold`)
+            that the socket's filter is restricted to, or `None` if the filter
+            isn't restricted to any particular URIs
+        :type uris: set or None
+        """
+        if socket in self._uris:
+            self._unsubscribe(socket)
+        else:
+            self._add_user(socket)
+
+        if uris is None:
+            self._unindexed.add(socket)
+            self._uris[socket] = None
+            return
+
+        uris = frozenset(uris)
+        for uri in uris:
+            self._by_uri.setdefault(uri, weakref.WeakSet()).add(socket)
+        self._uris[socket] = uris
+
+    def remove(self, socket):
+        """Remove `socket` from the index, if present."""
+        if socket not in self._uris:
+            return
+        self._unsubscribe(socket)
+        del self._uris[socket]
+        self._remove_user(socket)
+
+    def sockets_for_uri(self, uri):
+        """
+        Return the sockets which could be interested in an event on `uri`.
+
+        The returned list is a superset of the sockets whose filters match
+        an annotation on `uri`: callers must still check each socket's filter.
+        """
+        sockets = list(self._unindexed)
+
+        key = uni_fold(uri)
+        indexed = self._by_uri.get(key)
+        if indexed is not None:
+            if indexed:
+                sockets.extend(indexed)
+            else:
+                # All the sockets watching this URI have gone away without
+                # being explicitly removed.
+                del self._by_uri[key]
+
+        return sockets
+
+    def sockets_for_user(self, userid):
+        """Return the sockets authenticated as `userid`."""
+        sockets = self._by_userid.get(userid)
+        if sockets is None:
+            return []
+        if not sockets:
+            # All the user's sockets have gone away without being explicitly
+            # removed.
+            del self._by_userid[userid]
+            return []
+        return list(sockets)
+
+    def _unsubscribe(self, socket):
+        uris = self._uris[socket]
+
+        if uris is None:
+            self._unindexed.discard(socket)
+            return
+
+        for uri in uris:
+            sockets = self._by_uri.get(uri)
+            if sockets is None:
+                continue
+            sockets.discard(socket)
+            if not sockets:
+                del self._by_uri[uri]
+
+    def _add_user(self, socket):
+        userid = socket.authenticated_userid
+        if userid is not None:
+            self._by_userid.setdefault(userid, weakref.WeakSet()).add(socket)
+
+    def _remove_user(self, socket):
+        userid = socket.authenticated_userid
+        sockets = self._by_userid.get(userid)
+        if sockets is None:
+            return
+        sockets.discard(socket)
+        if not sockets:
+            del self._by_userid[userid]
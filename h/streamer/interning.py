@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+
+class InternTable(object):
+    """
+    A table of shared, immutable values.
+
+    Many websockets hold equal values (the same effective principals, for
+    example), and each one would otherwise hold its own copy. Acquiring a
+    value from the table returns the copy which is already shared by the
+    other holders of an equal value, if there is one. The table keeps count
+    of the holders of each value, and forgets a value once all of its holders
+    have released it.
+
+    Values must be hashable.
+    """
+
+    def __init__(self):
+        # Maps each value to a list of the shared copy of the value and the
+        # number of holders of it.
+        self._entries = {}
+
+    def __contains__(self, value):
+        return value in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def acquire(self, value):
+        """Return the shared copy of `value`, and count one more holder of it."""
+        entry = self._entries.get(value)
+        if entry is None:
+            entry = self._entries[value] = [value, 0]
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, value):
+        """Count one fewer holder of `value`, forgetting it if none are left."""
+        entry = self._entries.get(value)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._entries[value]
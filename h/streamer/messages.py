@@ -27,6 +27,14 @@ log = logging.getLogger(__name__)
 # An incoming message from a subscribed realtime consumer
 Message = namedtuple('Message', ['topic', 'payload'])
 
+# The parts of an annotation needed to handle an annotation event, for use
+# when the annotation model isn't available (because the event came with a
+# snapshot) or mustn't be used (because the event outlives the database
+# transaction in the replay buffer).
+_DetachedAnnotation = namedtuple('_DetachedAnnotation', ['id',
+                                                         'userid',
+                                                         'target_uri'])
+
 
 def process_messages(settings, routing_key, work_queue, raise_error=True):
     """
@@ -64,12 +72,10 @@ def handle_message(message, settings, session, topic_handlers):
     """
     Deserialize and process a message from the reader.
 
-    For each message, `handler` is called with the deserialized message and a
-    single :py:class:`h.streamer.WebSocket` instance, and should return the
-    message to be sent to the client on that socket. The handler can return
-    `None`, to signify that no message should be sent, or a JSON-serializable
-    object. It is assumed that there is a 1:1 request-reply mapping between
-    incoming messages and messages to be sent out over the websockets.
+    For each message, the handler for the message's topic is called with the
+    deserialized message and the :py:class:`h.streamer.index.SocketIndex` of
+    open websockets. The handler is responsible for selecting the sockets
+    which should be sent a message about the event, and sending it.
     """
     try:
         handler = topic_handlers[message.topic]
@@ -77,91 +83,202 @@ def handle_message(message, settings, session, topic_handlers):
         raise RuntimeError("Don't know how to handle message from topic: "
                            "{}".format(message.topic))
 
-    # N.B. We iterate over a non-weak list of instances because there's nothing
-    # to stop connections being added or dropped during iteration, and if that
-    # happens Python will throw a "Set changed size during iteration" error.
-    sockets = list(websocket.WebSocket.instances)
-    handler(message.payload, sockets, settings, session)
+    handler(message.payload, websocket.WebSocket.index, settings, session)
 
 
 def handle_annotation_event(message, sockets, settings, session):
-    id_ = message['annotation_id']
-    annotation = storage.fetch_annotation(session, id_)
+    if has_snapshot(message):
+        event = _AnnotationEvent.from_snapshot(message, message['snapshot'])
+    else:
+        id_ = message['annotation_id']
+        annotation = storage.fetch_annotation(session, id_)
 
-    if annotation is None:
-        log.warning('received annotation event for missing annotation: %s', id_)
-        return
+        if annotation is None:
+            log.warning('received annotation event for missing annotation: %s', id_)
+            return
 
-    nipsa_service = NipsaService(session)
-    user_nipsad = nipsa_service.is_flagged(annotation.userid)
+        nipsa_service = NipsaService(session)
+        user_nipsad = nipsa_service.is_flagged(annotation.userid)
 
-    authority = text_type(settings.get('h.authority', 'localhost'))
-    group_service = GroupfinderService(session, authority)
+        authority = text_type(settings.get('h.authority', 'localhost'))
+        group_service = GroupfinderService(session, authority)
 
-    for socket in sockets:
-        reply = _generate_annotation_event(message, socket, annotation, user_nipsad, group_service)
-        if reply is None:
-            continue
-        socket.send_json(reply)
+        event = _AnnotationEvent(message, annotation, user_nipsad, group_service)
 
+    replay_buffer = websocket.WebSocket.replay_buffer
+    if replay_buffer is not None:
+        event.event_id = replay_buffer.next_id()
 
-def handle_user_event(message, sockets, settings, session):
-    for socket in sockets:
-        reply = _generate_user_event(message, socket)
-        if reply is None:
+    # Only check the sockets whose filters could match an annotation on this
+    # annotation's URI.
+    for socket in sockets.sockets_for_uri(event.annotation.target_uri):
+        notification = event.notification_for(socket)
+        if notification is None:
             continue
-        socket.send_json(reply)
+        socket.send_prepared(notification)
 
+    if replay_buffer is not None and event.action != 'read':
+        event.detach(replay_buffer.registry)
+        replay_buffer.append(event)
 
-def _generate_annotation_event(message, socket, annotation, user_nipsad, group_service):
-    """
-    Get message about annotation event `message` to be sent to `socket`.
-
-    Inspects the embedded annotation event and decides whether or not the
-    passed socket should receive notification of the event.
 
-    Returns None if the socket should not receive any message about this
-    annotation event, otherwise a dict containing information about the event.
+def has_snapshot(message):
     """
-    action = message['action']
-
-    if action == 'read':
-        return None
+    Return True if annotation event `message` carries a usable snapshot.
 
-    if message['src_client_id'] == socket.client_id:
-        return None
-
-    # We don't send anything until we have received a filter from the client
-    if socket.filter is None:
-        return None
+    Messages published with the ``h.realtime.annotation_snapshots`` setting
+    enabled carry a snapshot of the annotation, which can be used instead of
+    reading the annotation from the database. Snapshots in formats other than
+    the current one are ignored.
+    """
+    if not isinstance(message, dict):
+        return False
+    snapshot = message.get('snapshot')
+    return (isinstance(snapshot, dict) and
+            snapshot.get('version') == realtime.ANNOTATION_SNAPSHOT_VERSION)
 
-    # Don't sent annotations from NIPSA'd users to anyone other than that
-    # user.
-    if user_nipsad and socket.authenticated_userid != annotation.userid:
-        return None
 
-    notification = {
-        'type': 'annotation-notification',
-        'options': {'action': action},
-    }
+def handle_user_event(message, sockets, settings, session):
+    for socket in sockets.sockets_for_user(message['userid']):
+        reply = _generate_user_event(message, socket)
+        if reply is None:
+            continue
+        socket.send_json(reply)
 
-    base_url = socket.registry.settings.get('h.app_url',
-                                            'http://localhost:5000')
-    links_service = LinksService(base_url, socket.registry)
-    resource = AnnotationContext(annotation, group_service, links_service)
-    serialized = presenters.AnnotationJSONPresenter(resource).asdict()
 
-    permissions = serialized.get('permissions')
-    if not _authorized_to_read(socket.effective_principals, permissions):
-        return None
+class _AnnotationEvent(object):
+    """
+    An annotation event which is to be sent to some number of sockets.
 
-    if not socket.filter.match(serialized, action):
-        return None
+    The annotation is presented, its read permissions are translated and the
+    notification is serialized at most once per event, and only if at least
+    one socket might receive it. The decision of whether a socket is
+    authorized to read the annotation is cached for each distinct set of
+    effective principals.
+    """
 
-    notification['payload'] = [serialized]
-    if action == 'delete':
-        notification['payload'] = [{'id': annotation.id}]
-    return notification
+    def __init__(self, message, annotation, user_nipsad, group_service):
+        self.action = message['action']
+        self.src_client_id = message['src_client_id']
+        self.annotation = annotation
+        self.user_nipsad = user_nipsad
+        self.group_service = group_service
+
+        self._serialized = None
+        self._read_principals = None
+        self._authorized = {}
+        self._notification = None
+
+        #: The id of the event in the replay buffer, if it is enabled.
+        self.event_id = None
+
+    @classmethod
+    def from_snapshot(cls, message, snapshot):
+        """Create an event from an annotation snapshot in the message."""
+        serialized = snapshot['annotation']
+        annotation = _DetachedAnnotation(id=serialized['id'],
+                                         userid=snapshot['userid'],
+                                         target_uri=snapshot['target_uri'])
+        event = cls(message, annotation, snapshot['nipsa'], group_service=None)
+        event._serialized = serialized
+        return event
+
+    def detach(self, registry):
+        """
+        Prepare the event to outlive the current database transaction.
+
+        Presents the annotation, if that hasn't happened yet, and drops all
+        references to the annotation model and the database session.
+        """
+        self._present(registry)
+        if not isinstance(self.annotation, _DetachedAnnotation):
+            self.annotation = _DetachedAnnotation(id=self.annotation.id,
+                                                  userid=self.annotation.userid,
+                                                  target_uri=self.annotation.target_uri)
+        self.group_service = None
+
+    def notification_for(self, socket):
+        """
+        Get the notification about this event to be sent to `socket`.
+
+        Decides whether or not the passed socket should receive notification
+        of the event.
+
+        Returns None if the socket should not receive any message about this
+        annotation event, otherwise a
+        :py:class:`h.streamer.websocket.PreparedMessage`, which is shared by
+        all the sockets receiving the event.
+        """
+        if self.action == 'read':
+            return None
+
+        if self.src_client_id == socket.client_id:
+            return None
+
+        # We don't send anything until we have received a filter from the client
+        if socket.filter is None:
+            return None
+
+        # Don't sent annotations from NIPSA'd users to anyone other than that
+        # user.
+        if self.user_nipsad and socket.authenticated_userid != self.annotation.userid:
+            return None
+
+        serialized = self._present(socket.registry)
+
+        if not self._authorized_to_read(socket.effective_principals):
+            return None
+
+        if not socket.filter.match(serialized, self.action):
+            return None
+
+        if self._notification is None:
+            payload = [serialized]
+            if self.action == 'delete':
+                payload = [{'id': self.annotation.id}]
+            notification = {
+                'type': 'annotation-notification',
+                'options': {'action': self.action},
+                'payload': payload,
+            }
+            if self.event_id is not None:
+                notification['event_id'] = self.event_id
+            self._notification = websocket.PreparedMessage(notification)
+        return self._notification
+
+    def _present(self, registry):
+        # N.B. All the sockets in a process share the same registry, so it
+        # doesn't matter which socket's registry we use to present the
+        # annotation.
+        if self._serialized is None:
+            base_url = registry.settings.get('h.app_url',
+                                             'http://localhost:5000')
+            links_service = LinksService(base_url, registry)
+            resource = AnnotationContext(self.annotation,
+                                         self.group_service,
+                                         links_service)
+            self._serialized = presenters.AnnotationJSONPresenter(resource).asdict()
+        return self._serialized
+
+    def _authorized_to_read(self, effective_principals):
+        """Return True if the passed principals are authorized to read the annotation.
+
+        If the annotation belongs to a private group, this will return False if the
+        authenticated user isn't a member of that group.
+        """
+        if self._read_principals is None:
+            permissions = self._serialized.get('permissions')
+            read_permissions = permissions.get('read', [])
+            self._read_principals = frozenset(
+                translate_annotation_principals(read_permissions))
+
+        key = tuple(effective_principals)
+        try:
+            return self._authorized[key]
+        except KeyError:
+            authorized = not self._read_principals.isdisjoint(key)
+            self._authorized[key] = authorized
+            return authorized
 
 
 def _generate_user_event(message, socket):
@@ -185,16 +302,3 @@ def _generate_user_event(message, socket):
         'action': message['type'],
         'model': message['session_model']
     }
-
-
-def _authorized_to_read(effective_principals, permissions):
-    """Return True if the passed request is authorized to read the annotation.
-
-    If the annotation belongs to a private group, this will return False if the
-    authenticated user isn't a member of that group.
-    """
-    read_permissions = permissions.get('read', [])
-    read_principals = translate_annotation_principals(read_permissions)
-    if set(read_principals).intersection(effective_principals):
-        return True
-    return False
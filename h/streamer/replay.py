@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from collections import deque
+import time
+
+# How far, in microseconds, before a resuming client's last seen event id to
+# start replaying events. Event ids are assigned independently by each
+# streamer process, from its own clock, so a client which reconnects to a
+# different process may have seen that process's events under slightly
+# different ids. Replaying a little too much is harmless, as clients handle
+# repeated notifications about an annotation.
+RESUME_TOLERANCE = 1000000
+
+
+class ReplayBuffer(object):
+    """
+    A bounded buffer of the most recent annotation events.
+
+    Each event is assigned a monotonically increasing id, which is included in
+    the notifications sent to clients. A client which reconnects can then ask
+    for the events it missed since the last id it saw (see
+    :py:func:`h.streamer.websocket.handle_resume_message`), rather than
+    reloading all the annotations it is showing.
+
+    Event ids are timestamps in microseconds, so ids assigned by different
+    streamer processes are roughly comparable.
+
+    :param size: the maximum number of events to keep
+    :param registry: the application registry, used to present the buffered
+        annotations
+    """
+
+    def __init__(self, size, registry, clock=time.time):
+        self.registry = registry
+        self._events = deque(maxlen=size)
+        self._clock = clock
+        self._last_id = 0
+
+        # Events with ids up to and including the horizon may have been missed,
+        # either because they happened before the buffer was created, or
+        # because they have been dropped from the buffer.
+        self._horizon = self.next_id()
+
+    def __len__(self):
+        return len(self._events)
+
+    def next_id(self):
+        """Return a new event id, greater than all the ids returned before."""
+        self._last_id = max(self._last_id + 1, int(self._clock() * 1000000))
+        return self._last_id
+
+    def append(self, event):
+        """
+        Add `event` to the buffer, dropping the oldest event if it is full.
+
+        The event must have an ``event_id`` attribute and a
+        ``notification_for(socket)`` method, and must not hold on to anything
+        that won't survive the end of the current database transaction.
+        """
+        if len(self._events) == self._events.maxlen:
+            self._horizon = self._events[0].event_id
+        self._events.append(event)
+
+    def since(self, last_id):
+        """
+        Return the events which a client may have missed since `last_id`.
+
+        Returns a ``(complete, events)`` tuple, where `complete` is False if
+        the buffer doesn't go back far enough to be sure of including all of
+        the events the client missed.
+        """
+        start = last_id - RESUME_TOLERANCE
+        if start < self._horizon:
+            return False, []
+        return True, [e for e in self._events if e.event_id > start]
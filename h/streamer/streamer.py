@@ -3,13 +3,22 @@
 from __future__ import unicode_literals
 import logging
 import sys
+import time
 
 import gevent
+from pyramid.settings import asbool
+from sqlalchemy.orm import subqueryload
 
 from h import db
+from h import models
 from h import stats
+from h import storage
+from h.db import types
+from h.streamer import deflate
+from h.streamer import heartbeat
 from h.streamer import messages
 from h.streamer import websocket
+from h.streamer.replay import ReplayBuffer
 
 log = logging.getLogger(__name__)
 
@@ -21,6 +30,10 @@ log = logging.getLogger(__name__)
 # using .put(...) with a timeout or .put_nowait(...) as appropriate.
 WORK_QUEUE = gevent.queue.Queue(maxsize=4096)
 
+# How long, by default, to wait for a batch of messages to fill up when
+# processing the work queue in batches.
+DEFAULT_BATCH_LATENCY_MS = 10
+
 # Message queues that the streamer processes messages from
 ANNOTATION_TOPIC = 'annotation'
 USER_TOPIC = 'user'
@@ -39,7 +52,32 @@ def start(event):
     The function does not block.
     """
     settings = event.app.registry.settings
-    greenlets = [
+
+    replay_buffer_size = int(settings.get('h.streamer.replay_buffer_size', 0))
+    if replay_buffer_size > 0:
+        websocket.WebSocket.replay_buffer = ReplayBuffer(replay_buffer_size,
+                                                         event.app.registry)
+
+    if asbool(settings.get('h.streamer.permessage_deflate', False)):
+        websocket.WebSocket.permessage_deflate = deflate.PerMessageDeflate(
+            level=int(settings.get('h.streamer.deflate_level',
+                                   deflate.DEFAULT_LEVEL)),
+            context_takeover=asbool(settings.get(
+                'h.streamer.deflate_context_takeover', False)))
+
+    greenlets = []
+
+    heartbeat_mode = settings.get('h.streamer.heartbeat_mode', 'per_socket')
+    if heartbeat_mode == 'wheel':
+        interval = float(settings.get('h.streamer.heartbeat_interval',
+                                      heartbeat.DEFAULT_INTERVAL))
+        websocket.WebSocket.heartbeat = heartbeat.HeartbeatWheel(interval)
+        # A greenlet to ping all the connected websockets
+        greenlets.append(gevent.spawn(websocket.WebSocket.heartbeat.run))
+    elif heartbeat_mode != 'per_socket':
+        raise ValueError('unknown heartbeat mode: {!r}'.format(heartbeat_mode))
+
+    greenlets.extend([
         # Start greenlets to process messages from RabbitMQ
         gevent.spawn(messages.process_messages,
                      settings,
@@ -53,7 +91,7 @@ def start(event):
         gevent.spawn(report_stats, settings),
         # And one to process the queued work
         gevent.spawn(process_work_queue, settings, WORK_QUEUE)
-    ]
+    ])
 
     # Start a "greenlet of last resort" to monitor the worker greenlets and
     # bail if any unexpected errors occur.
@@ -68,6 +106,14 @@ def process_work_queue(settings, queue, session_factory=None):
     dispatching them as appropriate. The handling of each message is wrapped in
     code that ensures the database session is appropriately committed and
     closed between messages.
+
+    If the ``h.streamer.batch_size`` setting is greater than one, messages
+    are instead pulled off the queue in batches of up to that many messages,
+    waiting at most ``h.streamer.batch_latency_ms`` milliseconds for a batch
+    to fill up. All the annotations referred to by a batch are fetched from
+    the database in one query, and the whole batch is handled in a single
+    transaction. An error handling one message in a batch doesn't affect the
+    handling of the other messages.
     """
     if session_factory is None:
         session_factory = _get_session
@@ -77,47 +123,151 @@ def process_work_queue(settings, queue, session_factory=None):
         ANNOTATION_TOPIC: messages.handle_annotation_event,
         USER_TOPIC: messages.handle_user_event,
     }
+    batch_size = int(settings.get('h.streamer.batch_size', 1))
+    batch_latency = float(settings.get('h.streamer.batch_latency_ms',
+                                       DEFAULT_BATCH_LATENCY_MS)) / 1000
 
-    for msg in queue:
-        t_total = s.timer('streamer.msg.handler_total')
-        t_total.start()
-        try:
-            # All access to the database in the streamer is currently
-            # read-only, so enforce that:
-            session.execute("SET TRANSACTION "
-                            "ISOLATION LEVEL SERIALIZABLE "
-                            "READ ONLY "
-                            "DEFERRABLE")
-
-            if isinstance(msg, messages.Message):
-                with s.timer('streamer.msg.handler_message'):
-                    messages.handle_message(msg, settings, session, topic_handlers)
-            elif isinstance(msg, websocket.Message):
-                with s.timer('streamer.msg.handler_websocket'):
-                    websocket.handle_message(msg, session)
-            else:
-                raise UnknownMessageType(repr(msg))
-
-        except (KeyboardInterrupt, SystemExit):
-            session.rollback()
-            raise
-        except:  # noqa: E722
-            log.exception('Caught exception handling streamer message:')
-            session.rollback()
-        else:
+    for batch, waited in _batches(queue, batch_size, batch_latency):
+        in_transaction = False
+
+        if batch_size > 1:
+            s.gauge('streamer.batch.size', len(batch))
+            s.timing('streamer.batch.latency', int(waited * 1000))
+            in_transaction = _prefetch_annotations(session, batch)
+
+        for msg in batch:
+            t_total = s.timer('streamer.msg.handler_total')
+            t_total.start()
+            try:
+                if not in_transaction:
+                    _begin_read_only_transaction(session)
+                    in_transaction = True
+
+                if isinstance(msg, messages.Message):
+                    with s.timer('streamer.msg.handler_message'):
+                        messages.handle_message(msg, settings, session, topic_handlers)
+                elif isinstance(msg, websocket.Message):
+                    with s.timer('streamer.msg.handler_websocket'):
+                        websocket.handle_message(msg, session)
+                else:
+                    raise UnknownMessageType(repr(msg))
+
+            except (KeyboardInterrupt, SystemExit):
+                session.rollback()
+                raise
+            except:  # noqa: E722
+                log.exception('Caught exception handling streamer message:')
+                # Start a new transaction for the rest of the batch, if any.
+                session.rollback()
+                in_transaction = False
+            t_total.stop()
+
+        if in_transaction:
             session.commit()
-        finally:
-            session.close()
-        t_total.stop()
+        session.close()
         s.send()
 
 
+def _batches(queue, size, latency):
+    """
+    Yield batches of messages from `queue`.
+
+    Each batch holds up to `size` messages. Having received the first message
+    of a batch, wait at most `latency` seconds for more messages before
+    yielding the batch. Yields ``(batch, waited)`` tuples, where `waited` is
+    the time in seconds spent waiting for the batch to fill up.
+    """
+    if size <= 1:
+        for msg in queue:
+            yield [msg], 0
+        return
+
+    for msg in queue:
+        batch = [msg]
+        start = time.time()
+        deadline = start + latency
+        while len(batch) < size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    msg = queue.get(timeout=timeout)
+                else:
+                    msg = queue.get_nowait()
+            except gevent.queue.Empty:
+                break
+            if msg is StopIteration:
+                # The queue has been closed, see gevent.queue.Queue.__iter__.
+                yield batch, time.time() - start
+                return
+            batch.append(msg)
+        yield batch, time.time() - start
+
+
+def _begin_read_only_transaction(session):
+    # All access to the database in the streamer is currently read-only, so
+    # enforce that:
+    session.execute("SET TRANSACTION "
+                    "ISOLATION LEVEL SERIALIZABLE "
+                    "READ ONLY "
+                    "DEFERRABLE")
+
+
+def _prefetch_annotations(session, batch):
+    """
+    Load all the annotations referred to by `batch` in one query.
+
+    The annotations are loaded into the session, so that handling each
+    message doesn't require another query. Returns True if a transaction was
+    successfully begun, False if anything went wrong (in which case the
+    messages will fetch their own annotations as usual).
+    """
+    ids = [msg.payload['annotation_id'] for msg in batch
+           if isinstance(msg, messages.Message) and
+           msg.topic == ANNOTATION_TOPIC and
+           isinstance(msg.payload, dict) and
+           'annotation_id' in msg.payload and
+           not messages.has_snapshot(msg.payload)]
+    try:
+        _begin_read_only_transaction(session)
+        if ids:
+            storage.fetch_ordered_annotations(session, ids,
+                                              query_processor=_load_documents)
+    except (KeyboardInterrupt, SystemExit):
+        session.rollback()
+        raise
+    except types.InvalidUUID:
+        # At least one of the messages has an invalid ID, which will be dealt
+        # with when it's handled.
+        return True
+    except:  # noqa: E722
+        log.exception('Caught exception prefetching annotations for batch:')
+        session.rollback()
+        return False
+    return True
+
+
+def _load_documents(query):
+    return query.options(subqueryload(models.Annotation.document))
+
+
 def report_stats(settings):
     client = stats.get_client(settings)
     while True:
-        client.gauge('streamer.connected_clients',
-                     len(websocket.WebSocket.instances))
+        sockets = list(websocket.WebSocket.instances)
+        client.gauge('streamer.connected_clients', len(sockets))
         client.gauge('streamer.queue_length', WORK_QUEUE.qsize())
+
+        # Report on the clients which aren't keeping up with the messages
+        # sent to them.
+        client.gauge('streamer.send_queue.length',
+                     sum(s.send_queue_length for s in sockets))
+        client.gauge('streamer.send_queue.max_lag',
+                     int(max([s.send_lag for s in sockets] or [0]) * 1000))
+        client.gauge('streamer.send_queue.dropped_messages',
+                     sum(s.dropped_messages for s in sockets))
+        if websocket.WebSocket.heartbeat is not None:
+            client.gauge('streamer.heartbeat.closed_connections',
+                         websocket.WebSocket.heartbeat.closed_connections)
         gevent.sleep(10)
 
 
@@ -12,12 +12,25 @@ from h.streamer import streamer, websocket
 
 @view_config(route_name='ws')
 def websocket_view(request):
+    settings = request.registry.settings
+
+    # Negotiate compression of messages, if the server supports it.
+    deflate = None
+    if websocket.WebSocket.permessage_deflate is not None:
+        deflate = websocket.WebSocket.permessage_deflate.negotiate(
+            request.environ.get('HTTP_SEC_WEBSOCKET_EXTENSIONS'))
+
     # Provide environment which the WebSocket handler can use...
     request.environ.update({
         'h.ws.authenticated_userid': request.authenticated_userid,
         'h.ws.effective_principals': request.effective_principals,
         'h.ws.registry': request.registry,
         'h.ws.streamer_work_queue': streamer.WORK_QUEUE,
+        'h.ws.send_queue_size': int(settings.get('h.streamer.send_queue_size',
+                                                 websocket.DEFAULT_SEND_QUEUE_SIZE)),
+        'h.ws.send_queue_overflow': settings.get('h.streamer.send_queue_overflow',
+                                                 websocket.DEFAULT_OVERFLOW_POLICY),
+        'h.ws.deflate': deflate,
     })
 
     # ...and ensure that any persistent connections associated with this
@@ -25,9 +38,31 @@ def websocket_view(request):
     request.db.close()
 
     app = WebSocketWSGIApplication(handler_cls=websocket.WebSocket)
+    if deflate is not None:
+        app = _accepting_extension(app, deflate.response)
     return request.get_response(app)
 
 
+def _accepting_extension(app, response):
+    """
+    Wrap a ws4py WSGI application to accept an extension in the handshake.
+
+    ws4py only accepts extension offers which exactly match one of a fixed
+    list of extensions, so it can't negotiate extension parameters itself.
+    The extension is only accepted if the handshake succeeds.
+    """
+    # N.B. WSGI headers must be native strings.
+    header = (str('Sec-WebSocket-Extensions'), str(response))
+
+    def wrapped(environ, start_response):
+        def _start_response(status, headers, exc_info=None):
+            if status.startswith(str('101 ')):
+                headers.append(header)
+            return start_response(status, headers, exc_info)
+        return app(environ, _start_response)
+    return wrapped
+
+
 @notfound_view_config(renderer='json')
 def notfound(exc, request):
     request.response.status_code = 404
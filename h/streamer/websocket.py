@@ -1,18 +1,26 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
-from collections import namedtuple
+from collections import deque, namedtuple
 import copy
 import json
 import logging
+import numbers
+import socket
+import time
 import weakref
 
+import gevent
 from gevent.queue import Full
 import jsonschema
+from ws4py.messaging import PingControlMessage, TextMessage
 from ws4py.websocket import WebSocket as _WebSocket
 
 from h import storage
 from h.streamer import filter
+from h.streamer.deflate import DeflateStream
+from h.streamer.index import SocketIndex
+from h.streamer.interning import InternTable
 
 log = logging.getLogger(__name__)
 
@@ -20,6 +28,18 @@ log = logging.getLogger(__name__)
 # below.
 MESSAGE_HANDLERS = {}
 
+# The default maximum number of messages waiting to be sent to a client.
+DEFAULT_SEND_QUEUE_SIZE = 64
+
+# What to do when a message is sent to a client whose send queue is full:
+#
+# - "drop_oldest": drop the oldest queued message.
+# - "coalesce": merge adjacent queued annotation notifications for the same
+#   action into one message, or drop the oldest message if none can be merged.
+# - "disconnect": drop all queued messages and drop the connection.
+OVERFLOW_POLICIES = ('drop_oldest', 'coalesce', 'disconnect')
+DEFAULT_OVERFLOW_POLICY = 'drop_oldest'
+
 
 # An incoming message from a WebSocket client.
 class Message(namedtuple('Message', [
@@ -43,34 +63,172 @@ class Message(namedtuple('Message', [
         self.socket.send_json(data)
 
 
+class PreparedMessage(object):
+    """
+    A JSON message which may be sent to any number of websockets.
+
+    The payload is serialized and framed at most once, however many sockets
+    it is sent to. If it is compressed, it is compressed at most once for
+    each set of compression parameters (see :py:mod:`h.streamer.deflate`)
+    which allows compressed messages to be shared.
+    """
+
+    def __init__(self, payload):
+        self.payload = payload
+        self._data = None
+        self._frame = None
+        self._deflated_frames = None
+
+    @property
+    def data(self):
+        """The payload serialized as JSON."""
+        if self._data is None:
+            self._data = json.dumps(self.payload)
+        return self._data
+
+    @property
+    def frame(self):
+        """The payload serialized as a complete websocket text frame."""
+        if self._frame is None:
+            message = TextMessage(self.data)
+            # Frames sent by a server are never masked.
+            self._frame = message.single(mask=False)
+        return self._frame
+
+    def deflated_frame(self, deflate):
+        """
+        The payload compressed as a complete websocket text frame.
+
+        :param deflate: the :py:class:`h.streamer.deflate.Deflate` parameters
+            negotiated with the socket the frame is to be sent to
+        """
+        if not deflate.shared:
+            return deflate.frame(self.data)
+
+        key = (deflate.level, deflate.window_bits)
+        if self._deflated_frames is None:
+            self._deflated_frames = {}
+        frame = self._deflated_frames.get(key)
+        if frame is None:
+            frame = self._deflated_frames[key] = deflate.frame(self.data)
+        return frame
+
+
 class WebSocket(_WebSocket):
+    # N.B. There may be tens of thousands of these per process, so the state
+    # we add to ws4py's is kept small, and shared between sockets wherever
+    # possible: sockets with the same effective principals share one tuple of
+    # them (see `principals`), and sockets with identical filters share one
+    # compiled filter (see :py:func:`h.streamer.filter.compile_filter`).
+    #
+    # ws4py's WebSocket has no __slots__, so each instance still has a
+    # __dict__ for ws4py's own attributes. Keeping ours in slots keeps them
+    # out of it, which saves about 2 KiB per socket (see
+    # bench/streamer_memory.py).
+    __slots__ = (
+        'client_id',
+        'filter',
+        'deflate',
+        'authenticated_userid',
+        'effective_principals',
+        'registry',
+        'last_seen',
+        'dropped_messages',
+        '_work_queue',
+        '_send_queue',
+        '_send_queue_size',
+        '_overflow_policy',
+        '_writer',
+        '_disconnecting',
+    )
+
     # All instances of WebSocket, allowing us to iterate over open websockets
     instances = weakref.WeakSet()
 
-    # Instance attributes
-    client_id = None
-    filter = None
-    query = None
+    # All instances of WebSocket, indexed by the URIs that their filters are
+    # restricted to
+    index = SocketIndex()
+
+    # The effective principals of all instances of WebSocket, shared between
+    # sockets with the same principals
+    principals = InternTable()
+
+    # The server's permessage-deflate configuration, if the extension is
+    # enabled. See :py:mod:`h.streamer.deflate`.
+    permessage_deflate = None
+
+    # The heartbeat timer wheel which pings all the sockets, if enabled. See
+    # :py:mod:`h.streamer.heartbeat`. Otherwise, each socket runs its own
+    # heartbeat.
+    heartbeat = None
+
+    # The buffer of recent annotation events which clients can ask to be
+    # replayed, if enabled. See :py:mod:`h.streamer.replay`.
+    replay_buffer = None
 
     def __init__(self, sock, protocols=None, extensions=None, environ=None):
+        heartbeat_freq = None if self.heartbeat is not None else 30.0
         super(WebSocket, self).__init__(sock,
                                         protocols=protocols,
                                         extensions=extensions,
                                         environ=environ,
-                                        heartbeat_freq=30.0)
+                                        heartbeat_freq=heartbeat_freq)
+
+        self.client_id = None
+        self.filter = None
 
         self.authenticated_userid = environ['h.ws.authenticated_userid']
-        self.effective_principals = environ['h.ws.effective_principals']
+        self.effective_principals = self.principals.acquire(
+            tuple(environ['h.ws.effective_principals']))
         self.registry = environ['h.ws.registry']
 
         self._work_queue = environ['h.ws.streamer_work_queue']
 
+        # The permessage-deflate parameters negotiated in the handshake, if
+        # any. ws4py can't parse compressed messages from the client, so
+        # they're parsed by a stream of our own.
+        self.deflate = environ.get('h.ws.deflate')
+        if self.deflate is not None:
+            self.stream = DeflateStream(self.deflate, always_mask=False)
+
+        # Messages to the client are queued, and written to the socket by a
+        # writer greenlet which runs whenever the queue is not empty. This
+        # means that a slow client never holds up sending messages to other
+        # clients.
+        self._send_queue = deque()
+        self._send_queue_size = environ.get('h.ws.send_queue_size',
+                                            DEFAULT_SEND_QUEUE_SIZE)
+        self._overflow_policy = environ.get('h.ws.send_queue_overflow',
+                                            DEFAULT_OVERFLOW_POLICY)
+        if self._overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError('unknown send queue overflow policy: '
+                             '{!r}'.format(self._overflow_policy))
+        self._writer = None
+        self._disconnecting = False
+
+        # The number of messages to this client which have been dropped
+        # because its send queue was full.
+        self.dropped_messages = 0
+
+        # When we last heard from the client.
+        self.last_seen = time.time()
+
+        # Everything we need from the WSGI environ has been copied out of it,
+        # so don't keep ws4py's copy of it alive for the life of the
+        # connection.
+        self.environ = None
+
+        self.index.add(self)
+        if self.heartbeat is not None:
+            self.heartbeat.add(self)
+
     def __new__(cls, *args, **kwargs):
         instance = super(WebSocket, cls).__new__(cls)
         cls.instances.add(instance)
         return instance
 
     def received_message(self, msg):
+        self.last_seen = time.time()
         try:
             payload = json.loads(msg.data)
         except ValueError:
@@ -88,10 +246,148 @@ class WebSocket(_WebSocket):
             self.instances.remove(self)
         except KeyError:
             pass
+        else:
+            self.principals.release(self.effective_principals)
+        self.index.remove(self)
+        if self.heartbeat is not None:
+            self.heartbeat.remove(self)
+        self._send_queue.clear()
+
+    def ponged(self, pong):
+        self.last_seen = time.time()
+
+    def send_ping(self):
+        """Queue a ping to the client, which should reply with a pong."""
+        self.send_prepared(_PING)
 
     def send_json(self, payload):
-        if not self.terminated:
-            self.send(json.dumps(payload))
+        self.send_prepared(PreparedMessage(payload))
+
+    def send_prepared(self, message):
+        """Queue a :py:class:`PreparedMessage` to be sent to the client."""
+        if self.terminated or self._disconnecting:
+            return
+
+        if len(self._send_queue) >= self._send_queue_size:
+            if self._overflow_policy == 'disconnect':
+                self._disconnect_slow_client()
+                return
+            if self._overflow_policy != 'coalesce' or not self._coalesce():
+                self._send_queue.popleft()
+                self.dropped_messages += 1
+
+        self._send_queue.append((time.time(), message))
+        self._ensure_writer()
+
+    @property
+    def send_queue_length(self):
+        """The number of messages waiting to be sent to the client."""
+        return len(self._send_queue)
+
+    @property
+    def send_lag(self):
+        """How long, in seconds, the oldest queued message has been waiting."""
+        try:
+            queued_at, _ = self._send_queue[0]
+        except IndexError:
+            return 0
+        return time.time() - queued_at
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            self._writer = gevent.spawn(self._drain_send_queue)
+
+    def _drain_send_queue(self):
+        try:
+            while self._send_queue and not self.terminated:
+                _, message = self._send_queue.popleft()
+                if self.deflate is None:
+                    self._write(message.frame)
+                else:
+                    self._write(message.deflated_frame(self.deflate))
+        except (socket.error, RuntimeError):
+            # The connection has gone away: ws4py will notice and clean up.
+            log.debug('Failed to write to websocket', exc_info=True)
+            self._send_queue.clear()
+        finally:
+            self._writer = None
+
+    def _disconnect_slow_client(self):
+        self.dropped_messages += len(self._send_queue)
+        self._send_queue.clear()
+        self._disconnecting = True
+
+        # A client which has stopped reading has filled the socket's buffers,
+        # so the writer is blocked writing to it and a close frame would never
+        # be sent. Drop the connection instead, as ws4py's heartbeat does.
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.kill(block=False)
+        self.server_terminated = True
+        self.close_connection()
+
+    def _coalesce(self):
+        """
+        Merge adjacent queued annotation notifications for the same action.
+
+        Returns True if any messages were merged.
+        """
+        merged = deque()
+        for queued_at, message in self._send_queue:
+            if merged:
+                previous_queued_at, previous = merged[-1]
+                combined = _combine_notifications(previous, message)
+                if combined is not None:
+                    merged[-1] = (previous_queued_at, combined)
+                    continue
+            merged.append((queued_at, message))
+
+        if len(merged) == len(self._send_queue):
+            return False
+        self._send_queue = merged
+        return True
+
+
+class _ControlFrame(object):
+    """A prepared websocket control frame, to be queued like a message."""
+
+    payload = None
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    def deflated_frame(self, deflate):
+        # Control frames are never compressed.
+        return self.frame
+
+
+# N.B. Frames sent by servers aren't masked, so every socket can be sent the
+# same ping frame.
+_PING = _ControlFrame(PingControlMessage(data='ping').single(mask=False))
+
+
+def _combine_notifications(first, second):
+    """
+    Combine two annotation notifications into one, if possible.
+
+    Returns a new :py:class:`PreparedMessage` notifying the client of the
+    annotations in both `first` and `second`, or `None` if they aren't both
+    annotation notifications for the same action.
+    """
+    if not all(isinstance(m.payload, dict) and
+               m.payload.get('type') == 'annotation-notification'
+               for m in (first, second)):
+        return None
+    if first.payload.get('options') != second.payload.get('options'):
+        return None
+    combined = {
+        'type': 'annotation-notification',
+        'options': first.payload['options'],
+        'payload': first.payload['payload'] + second.payload['payload'],
+    }
+    if 'event_id' in second.payload:
+        combined['event_id'] = second.payload['event_id']
+    return PreparedMessage(combined)
 
 
 def handle_message(message, session=None):
@@ -148,18 +444,60 @@ def handle_filter_message(message, session=None):
     try:
         jsonschema.validate(filter_, filter.SCHEMA)
     except jsonschema.ValidationError:
-        message.reply({'type': 'error',
-                       'error': {'type': 'invalid_data',
-                                 'description': 'failed to parse filter'}},
-                      ok=False)
+        _reply_invalid_filter(message)
         return
     if session is not None:
         # Add backend expands for clauses
         _expand_clauses(session, filter_)
-    message.socket.filter = filter.FilterHandler(filter_)
+    try:
+        message.socket.filter = filter.compile_filter(filter_)
+    except ValueError:
+        _reply_invalid_filter(message)
+        return
+    WebSocket.index.subscribe(message.socket, message.socket.filter.uris())
 MESSAGE_HANDLERS['filter'] = handle_filter_message  # noqa: E305
 
 
+def handle_resume_message(message, session=None):
+    """
+    A reconnecting client asking for the annotation events it missed.
+
+    The client sends the ``event_id`` of the last annotation notification it
+    received, and is sent the notifications for any later events in the
+    replay buffer which pass its filter, followed by a reply. The reply's
+    ``complete`` field is False if the buffer doesn't go back far enough,
+    in which case no events are sent and the client must reload instead.
+    """
+    last_event_id = message.payload.get('last_event_id')
+    if not isinstance(last_event_id, numbers.Integral) or isinstance(last_event_id, bool):
+        message.reply({'type': 'error',
+                       'error': {'type': 'invalid_data',
+                                 'description': '"last_event_id" is missing or invalid'}},
+                      ok=False)
+        return
+
+    socket = message.socket
+    if socket.filter is None:
+        message.reply({'type': 'error',
+                       'error': {'type': 'invalid_data',
+                                 'description': 'a filter must be set before resuming'}},
+                      ok=False)
+        return
+
+    if WebSocket.replay_buffer is None:
+        complete, events = False, []
+    else:
+        complete, events = WebSocket.replay_buffer.since(last_event_id)
+
+    for event in events:
+        notification = event.notification_for(socket)
+        if notification is not None:
+            socket.send_prepared(notification)
+
+    message.reply({'type': 'resume', 'complete': complete})
+MESSAGE_HANDLERS['resume'] = handle_resume_message  # noqa: E305
+
+
 def handle_ping_message(message, session=None):
     """A client requesting a pong."""
     message.reply({'type': 'pong'})
@@ -184,6 +522,13 @@ def handle_unknown_message(message, session=None):
 MESSAGE_HANDLERS[None] = handle_unknown_message  # noqa: E305
 
 
+def _reply_invalid_filter(message):
+    message.reply({'type': 'error',
+                   'error': {'type': 'invalid_data',
+                             'description': 'failed to parse filter'}},
+                  ok=False)
+
+
 def _expand_clauses(session, filter_):
     for clause in filter_['clauses']:
         if 'field' in clause and clause['field'] == '/uri':
@@ -200,4 +545,6 @@ def _expand_uris(session, clause):
     for item in uris:
         expanded.update(storage.expand_uri(session, item))
 
-    clause['value'] = list(expanded)
+    # N.B. The expanded URIs are sorted so that clients viewing the same
+    # document end up with identical filters, which can then be shared.
+    clause['value'] = sorted(expanded)
@@ -2,11 +2,19 @@
 
 
 from __future__ import unicode_literals
+
+from pyramid.settings import asbool
+
 from h import __version__
 from h import emails
+from h import presenters
+from h import realtime
 from h import storage
+from h.interfaces import IGroupService
 from h.notification import reply
+from h.tasks import annotation_counts
 from h.tasks import mailer
+from h.traversal import AnnotationContext
 
 
 def add_renderer_globals(event):
@@ -31,15 +39,56 @@ def add_renderer_globals(event):
 
 
 def publish_annotation_event(event):
-    """Publish an annotation event to the message queue."""
+    """
+    Publish an annotation event to the message queue.
+
+    If the ``h.realtime.annotation_snapshots`` setting is enabled, the message
+    also carries a snapshot of everything the streamer needs to know about the
+    annotation, so that each streamer process doesn't have to read the
+    annotation from the database itself.
+    """
     data = {
         'action': event.action,
         'annotation_id': event.annotation_id,
         'src_client_id': event.request.headers.get('X-Client-Id'),
     }
+
+    settings = event.request.registry.settings
+    if asbool(settings.get('h.realtime.annotation_snapshots', False)):
+        snapshot = _annotation_snapshot(event.request, event.annotation_id)
+        if snapshot is not None:
+            data['snapshot'] = snapshot
+
     event.request.realtime.publish_annotation(data)
 
 
+def _annotation_snapshot(request, annotation_id):
+    """
+    Return a snapshot of the annotation for embedding in a realtime message.
+
+    Returns None if the annotation doesn't exist.
+    """
+    with request.tm:
+        annotation = storage.fetch_annotation(request.db, annotation_id)
+        if annotation is None:
+            return None
+
+        nipsa_service = request.find_service(name='nipsa')
+        resource = AnnotationContext(annotation,
+                                     request.find_service(IGroupService),
+                                     request.find_service(name='links'))
+
+        return {
+            'version': realtime.ANNOTATION_SNAPSHOT_VERSION,
+            'annotation': presenters.AnnotationJSONPresenter(resource).asdict(),
+            'userid': annotation.userid,
+            'groupid': annotation.groupid,
+            'shared': annotation.shared,
+            'target_uri': annotation.target_uri,
+            'nipsa': nipsa_service.is_flagged(annotation.userid),
+        }
+
+
 def send_reply_notifications(event,
                              get_notification=reply.get_notification,
                              generate_mail=emails.reply_notification.generate,
@@ -54,3 +103,13 @@ def send_reply_notifications(event,
             return
         send_params = generate_mail(request, notification)
         send(*send_params)
+
+
+def update_annotation_document_count(event):
+    """Queue a recount of the public annotations of the annotation's document."""
+    annotation_counts.update_annotation_document_count.delay(event.annotation_id)
+
+
+def update_merged_document_count(event):
+    """Queue a recount of the public annotations of a merged document."""
+    annotation_counts.update_document_annotation_counts.delay([event.document_id])
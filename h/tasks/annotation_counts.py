@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from h import storage
+from h.celery import celery
+
+
+@celery.task
+def update_annotation_document_count(annotation_id):
+    """Recount the public annotations of an annotation's document."""
+    annotation = storage.fetch_annotation(celery.request.db, annotation_id)
+    if annotation is None:
+        return
+
+    svc = celery.request.find_service(name='document_annotation_count')
+    svc.update([annotation.document_id])
+
+
+@celery.task
+def update_document_annotation_counts(document_ids):
+    """Recount the public annotations of the given documents."""
+    svc = celery.request.find_service(name='document_annotation_count')
+    svc.update(document_ids)
+
+
+@celery.task
+def reconcile_document_annotation_counts():
+    """Recount the public annotations of every document."""
+    svc = celery.request.find_service(name='document_annotation_count')
+
+    # Commit each window of counts as it's done, so that the rows aren't all
+    # locked against the per-annotation recounts until the end.
+    for _ in svc.update_all():
+        celery.request.tm.commit()
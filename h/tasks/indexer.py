@@ -3,6 +3,7 @@
 from __future__ import unicode_literals
 from h import models, storage
 from h.celery import celery, get_task_logger
+from h.search import result_cache
 from h.search.index import BatchIndexer, delete, index
 
 log = get_task_logger(__name__)
@@ -21,6 +22,8 @@ def add_annotation(id_):
             index(celery.request.es, annotation, celery.request,
                   target_index=future_index)
 
+        _invalidate_search_results(annotation)
+
         if annotation.is_reply:
             add_annotation.delay(annotation.thread_root_id)
 
@@ -35,6 +38,12 @@ def delete_annotation(id_):
     if future_index is not None:
         delete(celery.request.es, id_, target_index=future_index)
 
+    if result_cache.cache.enabled:
+        # Deleted annotations are kept in the database, marked as deleted.
+        annotation = storage.fetch_annotation(celery.request.db, id_)
+        if annotation is not None:
+            _invalidate_search_results(annotation)
+
 
 @celery.task
 def reindex_user_annotations(userid):
@@ -46,6 +55,30 @@ def reindex_user_annotations(userid):
         log.warning('Failed to re-index annotations into ES6 %s', errored)
 
 
+@celery.task
+def reindex_document_annotations(document_id):
+    ids = [a.id for a in celery.request.db.query(models.Annotation.id).filter_by(document_id=document_id)]
+
+    indexer = BatchIndexer(celery.request.db, celery.request.es, celery.request)
+    errored = indexer.index(ids)
+    if errored:
+        log.warning('Failed to re-index annotations into ES6 %s', errored)
+
+
+def _invalidate_search_results(annotation):
+    # Now that the change is in Elasticsearch, the search results cached by
+    # the web processes for the URIs of the annotation, or for any other URI
+    # of its document, are out of date. This process never caches any, so it
+    # tells them (see h.search.result_cache).
+    if not result_cache.cache.enabled:
+        return
+
+    uris = [annotation.target_uri_normalized]
+    if annotation.document is not None:
+        uris.extend(u.uri_normalized for u in annotation.document.document_uris)
+    celery.request.realtime.publish_search_invalidation({'uris': uris})
+
+
 def _current_reindex_new_name(request, new_index_setting_name):
     settings = celery.request.find_service(name='settings')
     new_index = settings.get(new_index_setting_name)
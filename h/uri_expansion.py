@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+A process-wide cache of URI expansions.
+
+Expanding a URI (see :py:func:`h.storage.expand_uri`) takes a database query,
+and the URIs of the same few popular pages are expanded over and over again by
+the search API and by the websocket server. When enabled, this cache keeps
+recent expansions for a limited time.
+
+Expansions are invalidated when the URIs of a document change (see
+:py:func:`h.models.document.update_document_metadata` and
+:py:func:`h.models.document.merge_documents`), but only in the process which
+changed them: other processes may go on using an out-of-date expansion until
+it expires.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import threading
+import time
+
+from h import stats
+from h.util.uri import normalize as uri_normalize
+
+# The default maximum number of expansions to cache.
+DEFAULT_SIZE = 10000
+
+
+class ExpansionCache(object):
+    """
+    A cache of URI expansions, bounded in size and in age.
+
+    :param ttl: how long, in seconds, to keep each expansion. If 0 (the
+        default) nothing is cached.
+    :param size: the maximum number of expansions to keep. The least recently
+        used expansion is dropped to make room for a new one.
+    :param stats: a statsd client to which to report cache hits and misses
+    :param clock: a function returning the current time, in seconds
+    """
+
+    def __init__(self, ttl=0, size=DEFAULT_SIZE, stats=None, clock=time.time):
+        self.ttl = ttl
+        self.size = size
+        self.stats = stats
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        # Maps each URI to the time its expansion expires and the expansion,
+        # least recently used first.
+        self._expansions = OrderedDict()
+        # Maps each normalized URI to the URIs which normalize to it, for
+        # invalidation.
+        self._by_normalized = {}
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def __len__(self):
+        return len(self._expansions)
+
+    def get(self, uri):
+        """Return the cached expansion of `uri`, or `None`."""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            try:
+                expires, expanded = self._expansions.pop(uri)
+            except KeyError:
+                expanded = None
+            else:
+                if expires > self._clock():
+                    # Mark the expansion as the most recently used.
+                    self._expansions[uri] = (expires, expanded)
+                else:
+                    self._forget(uri)
+                    expanded = None
+
+        self._incr('hit' if expanded is not None else 'miss')
+        return list(expanded) if expanded is not None else None
+
+    def set(self, uri, expanded):
+        """Cache `expanded` as the expansion of `uri`."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if uri in self._expansions:
+                del self._expansions[uri]
+            else:
+                self._by_normalized.setdefault(uri_normalize(uri), set()).add(uri)
+            self._expansions[uri] = (self._clock() + self.ttl, tuple(expanded))
+
+            while len(self._expansions) > self.size:
+                oldest = next(iter(self._expansions))
+                del self._expansions[oldest]
+                self._forget(oldest)
+
+    def invalidate(self, uris):
+        """
+        Forget the expansions of `uris`.
+
+        The expansions of all the URIs which normalize to the same URI as one
+        of `uris` are forgotten.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            for normalized in set(uri_normalize(u) for u in uris):
+                for uri in self._by_normalized.pop(normalized, ()):
+                    self._expansions.pop(uri, None)
+
+    def clear(self):
+        with self._lock:
+            self._expansions.clear()
+            self._by_normalized.clear()
+
+    def _forget(self, uri):
+        normalized = uri_normalize(uri)
+        uris = self._by_normalized.get(normalized)
+        if uris is not None:
+            uris.discard(uri)
+            if not uris:
+                del self._by_normalized[normalized]
+
+    def _incr(self, outcome):
+        if self.stats is not None:
+            self.stats.incr('uri_expansion.cache.{}'.format(outcome))
+
+
+# The cache of URI expansions for this process.
+cache = ExpansionCache()
+
+
+def includeme(config):
+    settings = config.registry.settings
+    cache.ttl = float(settings.get('h.uri_expansion.cache_ttl', 0))
+    cache.size = int(settings.get('h.uri_expansion.cache_size', DEFAULT_SIZE))
+    cache.stats = stats.get_client(settings)
+    cache.clear()
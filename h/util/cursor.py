@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+"""Opaque cursors for paging through search results."""
+
+from __future__ import unicode_literals
+
+import base64
+import binascii
+import json
+
+
+def encode(values):
+    """
+    Return an opaque cursor for a list of sort values.
+
+    :param values: the JSON-serializable sort values of the last result of a
+        page, as passed to Elasticsearch's ``search_after``
+    :rtype: unicode
+    """
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode(cursor):
+    """
+    Return the list of sort values of a cursor returned by :py:func:`encode`.
+
+    :raises ValueError: if `cursor` isn't a valid cursor
+    """
+    try:
+        # N.B. urlsafe_b64decode() only accepts byte strings on Python 2.
+        data = base64.urlsafe_b64decode((cursor + '=' * (-len(cursor) % 4)).encode('ascii'))
+        values = json.loads(data.decode('utf-8'))
+    except (TypeError, ValueError, binascii.Error, UnicodeError):
+        raise ValueError('invalid cursor: {!r}'.format(cursor))
+
+    if not isinstance(values, list) or not values:
+        raise ValueError('invalid cursor: {!r}'.format(cursor))
+    return values
@@ -5,6 +5,7 @@ from pyramid import httpexceptions
 from pyramid.view import view_config
 from sqlalchemy.exc import IntegrityError
 
+from h import blocklist
 from h import models
 from h.i18n import TranslationString as _  # noqa: N813
 
@@ -36,6 +37,8 @@ def badge_add(request):
         msg = _("{uri} is already blocked.").format(uri=uri)
         request.session.flash(msg, 'error')
 
+    _reload_blocklist_after_commit(request)
+
     index = request.route_path('admin.badge')
     return httpexceptions.HTTPSeeOther(location=index)
 
@@ -49,5 +52,13 @@ def badge_remove(request):
     uri = request.params['remove']
     request.db.query(models.Blocklist).filter_by(uri=uri).delete()
 
+    _reload_blocklist_after_commit(request)
+
     index = request.route_path('admin.badge')
     return httpexceptions.HTTPSeeOther(location=index)
+
+
+def _reload_blocklist_after_commit(request):
+    # Reloading before the transaction commits would load the old blocklist
+    # again, so wait until the edit is committed.
+    request.tm.get().addAfterCommitHook(lambda success: blocklist.matcher.invalidate())
@@ -19,6 +19,7 @@ objects and Pyramid ACLs in :mod:`h.traversal`.
 from __future__ import unicode_literals
 from pyramid import i18n
 from pyramid import security
+from pyramid.response import Response
 import newrelic.agent
 
 from h import search as search_lib
@@ -29,6 +30,7 @@ from h.events import AnnotationEvent
 from h.interfaces import IGroupService
 from h.presenters import AnnotationJSONLDPresenter
 from h.traversal import AnnotationContext
+from h.schemas import ValidationError
 from h.schemas.util import validate_query_params
 from h.schemas.annotation import (
     CreateAnnotationSchema,
@@ -107,28 +109,87 @@ def search(request):
     _record_search_api_usage_metrics(params)
 
     separate_replies = params.pop('_separate_replies', False)
+    all_replies = params.pop('_all_replies', False)
+    replies_cursor = params.pop('_replies_cursor', None)
 
     stats = getattr(request, 'stats', None)
 
     search = search_lib.Search(request,
                                separate_replies=separate_replies,
-                               stats=stats)
+                               stats=stats,
+                               all_replies=all_replies,
+                               replies_max=int(request.registry.settings.get(
+                                   'h.search.replies_max', search_lib.REPLIES_MAX_DEFAULT)),
+                               replies_cursor=replies_cursor)
     search.append_modifier(UriCombinedWildcardFilter(request, separate_keys=True))
     result = search.run(params)
 
     svc = request.find_service(name='annotation_json_presentation')
 
-    out = {
-        'total': result.total,
-        'rows': svc.present_all(result.annotation_ids)
-    }
+    if not separate_replies:
+        out = {
+            'total': result.total,
+            'rows': svc.present_all(result.annotation_ids),
+        }
+    else:
+        # Present the annotations and their replies together, so that they're
+        # fetched from the database at once, and then separate them again.
+        reply_ids = set(result.reply_ids)
+        presented = svc.present_all(result.annotation_ids + result.reply_ids)
+
+        out = {
+            'total': result.total,
+            'rows': [a for a in presented if a['id'] not in reply_ids],
+            'replies': [a for a in presented if a['id'] in reply_ids],
+        }
+
+        if result.replies_cursor is not None:
+            out['replies_cursor'] = result.replies_cursor
 
-    if separate_replies:
-        out['replies'] = svc.present_all(result.reply_ids)
+    if result.next_cursor is not None:
+        out['next_cursor'] = result.next_cursor
 
     return out
 
 
+@api_config(route_name='api.export',
+            effective_principals=security.Authenticated,
+            link_name='export',
+            description='Export annotations')
+def export(request):
+    """
+    Stream all the annotations matching the given query.
+
+    The response is newline-delimited JSON, one annotation per line, without
+    any limit on the number of annotations. Exports are only for
+    authenticated users, and must be limited to a group or a user. The Public
+    group, which has every public annotation, can only be exported a user at a
+    time.
+    """
+    schema = SearchParamsSchema()
+    params = validate_query_params(schema, request.params)
+    if not (params.get('group') or params.get('user')):
+        raise ValidationError(_('Exports must be limited to a group or a user'))
+    if '__world__' in params.getall('group') and not params.get('user'):
+        raise ValidationError(_('Exports of the Public group must be limited to a user'))
+
+    svc = request.find_service(name='annotation_export')
+    return Response(app_iter=_export_lines(request, svc.export(params)),
+                    content_type='application/x-ndjson',
+                    charset='utf-8')
+
+
+def _export_lines(request, lines):
+    try:
+        for line in lines:
+            yield line.encode('utf-8')
+    finally:
+        # The response is streamed after the request's transaction has ended,
+        # so end the transaction and close the session used to stream it.
+        request.tm.abort()
+        request.db.close()
+
+
 @api_config(route_name='api.annotations',
             request_method='POST',
             effective_principals=security.Authenticated,
@@ -2,13 +2,19 @@
 
 from __future__ import unicode_literals
 
+from collections import OrderedDict
+
 from pyramid import httpexceptions
 from webob.multidict import MultiDict
 
 from h import models, search
 from h.util.view import json_view
+from h.views.api.config import api_config
 from h.util.uri import normalize
 
+# The maximum number of URIs which can be counted by one batch badge request.
+BATCH_MAX_URIS = 100
+
 
 def _has_uri_ever_been_annotated(db, uri):
     """Return `True` if a given URI has ever been annotated."""
@@ -38,6 +44,9 @@ def badge(request):
     if not uri:
         raise httpexceptions.HTTPBadRequest()
 
+    if request.feature('badge_counts'):
+        return {'total': _stored_count(request, uri)}
+
     # Do a cheap check to see if this URI has ever been annotated. If not,
     # and most haven't, then we can skip the costs of a blocklist lookup or
     # search request. In addition to the Elasticsearch query, the search request
@@ -48,10 +57,78 @@ def badge(request):
     elif models.Blocklist.is_blocked(request.db, uri):
         count = 0
     else:
-        query = MultiDict({'uri': uri, 'limit': 0})
-        s = search.Search(request, stats=request.stats)
-        s.append_modifier(search.UriFilter(request))
-        result = s.run(query)
-        count = result.total
+        count = _search_count(request, uri)
 
     return {'total': count}
+
+
+@api_config(route_name='badge.batch', request_method=('GET', 'POST'))
+def badge_batch(request):
+    """Return the numbers of public annotations on several pages.
+
+    This is for showing counts next to lists of links. It takes up to
+    ``BATCH_MAX_URIS`` ``uri`` parameters, and returns an object mapping each
+    of them to its number of annotations, as :py:func:`badge` would.
+
+    The counts are read from the stored per-document counts with one query,
+    and the URIs are checked against the blocklist with another. Any URIs
+    which haven't been counted yet are counted with one multi-search.
+
+    """
+    if not request.feature('badge_counts'):
+        raise httpexceptions.HTTPNotFound()
+
+    # Deduplicate the URIs, keeping them in the order they were given.
+    uris = list(OrderedDict.fromkeys(request.params.getall('uri')))
+
+    if not uris:
+        raise httpexceptions.HTTPBadRequest()
+    if len(uris) > BATCH_MAX_URIS:
+        raise httpexceptions.HTTPBadRequest(
+            'At most {} URIs can be counted at once'.format(BATCH_MAX_URIS))
+
+    counts = request.find_service(name='document_annotation_count').counts(uris)
+    blocked = models.Blocklist.blocked_uris(request.db,
+                                            [uri for uri in uris if counts[uri] != 0])
+
+    uncounted = [uri for uri in uris if counts[uri] is None and uri not in blocked]
+    counts.update(zip(uncounted, _search_counts(request, uncounted)))
+
+    totals = OrderedDict()
+    for uri in uris:
+        totals[uri] = 0 if uri in blocked else counts[uri]
+
+    return totals
+
+
+def _stored_count(request, uri):
+    """
+    Return the number of public annotations of `uri` from the stored counts.
+
+    Falls back to a search if the documents of `uri` haven't been counted yet.
+    """
+    count = request.find_service(name='document_annotation_count').count(uri)
+    if count == 0:
+        return 0
+    if models.Blocklist.is_blocked(request.db, uri):
+        return 0
+    if count is None:
+        return _search_count(request, uri)
+    return count
+
+
+def _search_count(request, uri):
+    query = MultiDict({'uri': uri, 'limit': 0})
+    s = search.Search(request, stats=request.stats)
+    s.append_modifier(search.UriFilter(request))
+    result = s.run(query)
+    return result.total
+
+
+def _search_counts(request, uris):
+    if not uris:
+        return []
+
+    s = search.Search(request, stats=request.stats)
+    s.append_modifier(search.UriFilter(request))
+    return s.run_totals([MultiDict({'uri': uri, 'limit': 0}) for uri in uris])
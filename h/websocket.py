@@ -160,6 +160,7 @@ def create_app(global_config, **settings):
     config.include('h.sentry')
     config.include('h.services')
     config.include('h.stats')
+    config.include('h.uri_expansion')
 
     # We include links in order to set up the alternative link registrations
     # for annotations.
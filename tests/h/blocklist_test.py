@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import mock
+import pytest
+
+from h import blocklist
+
+
+class TestCompilePatterns(object):
+    @pytest.mark.parametrize('patterns,uri,blocked', [
+        (['http://example.com'], 'http://example.com', True),
+        (['http://example.com'], 'http://example.com/', False),
+        (['http://example.com'], 'HTTP://EXAMPLE.COM', False),
+        (['%//example.com%'], 'https://example.com/foo', True),
+        (['%//example.com%'], 'https://example.org/', False),
+        (['http://example.com/_'], 'http://example.com/a', True),
+        (['http://example.com/_'], 'http://example.com/ab', False),
+        (['http://example.com/?a=1'], 'http://example.com/?a=1', True),
+        (['http://example.com/?a=1'], 'http://example.com/a=1', False),
+        (['http://example.com/100\\%'], 'http://example.com/100%', True),
+        (['http://example.com/100\\%'], 'http://example.com/1000', False),
+        (['http://a.com', 'http://b.com/%'], 'http://b.com/foo', True),
+        ([], 'http://example.com', False),
+    ])
+    def test_it_matches_like_postgresql(self, patterns, uri, blocked):
+        regex = blocklist.compile_patterns(patterns)
+
+        assert (regex.match(uri) is not None) == blocked
+
+
+class TestBlocklistMatcher(object):
+    def test_is_blocked(self, matcher):
+        assert matcher.is_blocked('http://example.com/foo', self.load(['%example.com%']))
+        assert not matcher.is_blocked('http://example.org/', self.load(['%example.com%']))
+
+    def test_blocked_uris(self, matcher):
+        blocked = matcher.blocked_uris(['http://example.com/', 'http://example.org/'],
+                                       self.load(['%example.com%']))
+
+        assert blocked == set(['http://example.com/'])
+
+    def test_it_loads_the_patterns_once(self, matcher):
+        load_patterns = self.load(['%example.com%'])
+
+        matcher.is_blocked('http://example.com/', load_patterns)
+        matcher.is_blocked('http://example.org/', load_patterns)
+
+        assert load_patterns.call_count == 1
+
+    def test_it_reloads_the_patterns_once_they_expire(self, matcher, clock):
+        matcher.is_blocked('http://example.com/', self.load(['%example.com%']))
+
+        clock.return_value += 60
+
+        assert not matcher.is_blocked('http://example.com/', self.load([]))
+
+    def test_invalidate_reloads_the_patterns(self, matcher):
+        matcher.is_blocked('http://example.com/', self.load(['%example.com%']))
+
+        matcher.invalidate()
+
+        assert not matcher.is_blocked('http://example.com/', self.load([]))
+
+    def test_it_reports_reloads(self, matcher):
+        matcher.stats = mock.Mock(spec_set=['incr'])
+
+        matcher.is_blocked('http://example.com/', self.load([]))
+
+        matcher.stats.incr.assert_called_once_with('blocklist.matcher.reload')
+
+    def test_enabled(self):
+        assert not blocklist.BlocklistMatcher().enabled
+        assert blocklist.BlocklistMatcher(ttl=30).enabled
+
+    def load(self, patterns):
+        return mock.Mock(return_value=patterns)
+
+    @pytest.fixture
+    def clock(self):
+        return mock.Mock(return_value=1000.0)
+
+    @pytest.fixture
+    def matcher(self, clock):
+        return blocklist.BlocklistMatcher(ttl=30, clock=clock)
+
+
+class TestIncludeMe(object):
+    def test_configures_the_matcher(self, pyramid_config):
+        pyramid_config.registry.settings['h.blocklist.cache_ttl'] = 30
+
+        try:
+            blocklist.includeme(pyramid_config)
+
+            assert blocklist.matcher.ttl == 30
+        finally:
+            blocklist.matcher.ttl = 0
+            blocklist.matcher.invalidate()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+
+import mock
+import pytest
+
+from h.cli.commands import export
+
+
+class TestExportCommand(object):
+    def test_it_exports_annotations_matching_the_params(self, cli, cliconfig, export_service):
+        result = cli.invoke(export.export, ['group=abc123', 'tag=foo', 'tag=bar'], obj=cliconfig)
+
+        assert result.exit_code == 0
+        params = export_service.export.call_args[0][0]
+        assert params['group'] == 'abc123'
+        assert params.getall('tag') == ['foo', 'bar']
+
+    def test_it_writes_the_exported_annotations(self, cli, cliconfig):
+        result = cli.invoke(export.export, ['--output', 'export.ndjson'], obj=cliconfig)
+
+        assert result.exit_code == 0
+        with io.open('export.ndjson', encoding='utf-8') as f:
+            assert f.read() == '{"id": "a"}\n{"id": "b"}\n'
+
+    def test_it_reports_the_number_of_annotations_exported(self, cli, cliconfig):
+        result = cli.invoke(export.export, ['--output', 'export.ndjson'], obj=cliconfig)
+
+        assert 'Exported 2 annotations' in result.output
+
+    @pytest.mark.parametrize('params', [
+        ['group'],
+        ['sort=bogus'],
+    ])
+    def test_it_raises_for_invalid_params(self, cli, cliconfig, export_service, params):
+        result = cli.invoke(export.export, params, obj=cliconfig)
+
+        assert result.exit_code != 0
+        assert not export_service.export.called
+
+    @pytest.fixture
+    def export_service(self, pyramid_config):
+        svc = mock.Mock(spec_set=['export'])
+        svc.export.return_value = iter(['{"id": "a"}\n', '{"id": "b"}\n'])
+        pyramid_config.register_service(svc, name='annotation_export')
+        return svc
+
+    @pytest.fixture
+    def cliconfig(self, pyramid_request, export_service):
+        return {'bootstrap': mock.Mock(return_value=pyramid_request)}
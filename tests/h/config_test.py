@@ -11,6 +11,23 @@ from h.config import configure
     ('DB_SESSION_CHECKS', "False", 'h.db_session_checks', False),
     ('SECRET_KEY', 'dont_tell_anyone', 'secret_key', b'dont_tell_anyone'),
     ('SECRET_SALT', 'best_with_pepper', 'secret_salt', b'best_with_pepper'),
+    ('REALTIME_ANNOTATION_SNAPSHOTS', 'true', 'h.realtime.annotation_snapshots', True),
+    ('REALTIME_FLUSH_INTERVAL_MS', '50', 'h.realtime.flush_interval_ms', 50),
+    ('REALTIME_BUFFER_SIZE', '100', 'h.realtime.buffer_size', 100),
+    ('STREAMER_BATCH_SIZE', '100', 'h.streamer.batch_size', 100),
+    ('STREAMER_BATCH_LATENCY_MS', '25', 'h.streamer.batch_latency_ms', 25),
+    ('STREAMER_DEFLATE_CONTEXT_TAKEOVER', 'true', 'h.streamer.deflate_context_takeover', True),
+    ('BLOCKLIST_CACHE_TTL', '30', 'h.blocklist.cache_ttl', 30.0),
+    ('STREAMER_DEFLATE_LEVEL', '1', 'h.streamer.deflate_level', 1),
+    ('STREAMER_HEARTBEAT_INTERVAL', '15', 'h.streamer.heartbeat_interval', 15.0),
+    ('STREAMER_PERMESSAGE_DEFLATE', 'true', 'h.streamer.permessage_deflate', True),
+    ('STREAMER_REPLAY_BUFFER_SIZE', '500', 'h.streamer.replay_buffer_size', 500),
+    ('STREAMER_SEND_QUEUE_SIZE', '16', 'h.streamer.send_queue_size', 16),
+    ('SEARCH_REPLIES_MAX', '1000', 'h.search.replies_max', 1000),
+    ('SEARCH_RESULT_CACHE_SIZE', '500', 'h.search.result_cache_size', 500),
+    ('SEARCH_RESULT_CACHE_TTL', '5', 'h.search.result_cache_ttl', 5.0),
+    ('URI_EXPANSION_CACHE_SIZE', '500', 'h.uri_expansion.cache_size', 500),
+    ('URI_EXPANSION_CACHE_TTL', '60', 'h.uri_expansion.cache_ttl', 60.0),
 
     # There are many other settings that can be updated from env vars.
     # These are not currently tested.
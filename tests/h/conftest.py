@@ -71,6 +71,7 @@ class DummySession(object):
         self.added = []
         self.deleted = []
         self.flushed = False
+        self.info = {}
 
     def add(self, obj):
         self.added.append(obj)
@@ -45,3 +45,19 @@ class TestSubscribeAnnotationEvent(object):
     @pytest.fixture
     def delete_annotation(self, patch):
         return patch('h.indexer.subscribers.delete_annotation')
+
+
+class TestSubscribeDocumentMergedEvent(object):
+
+    def test_it_enqueues_reindex_document_annotations_celery_task(self,
+                                                                  pyramid_request,
+                                                                  reindex_document_annotations):
+        event = events.DocumentMergedEvent(pyramid_request, 123)
+
+        subscribers.subscribe_document_merged_event(event)
+
+        reindex_document_annotations.delay.assert_called_once_with(123)
+
+    @pytest.fixture
+    def reindex_document_annotations(self, patch):
+        return patch('h.indexer.subscribers.reindex_document_annotations')
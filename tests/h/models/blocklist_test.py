@@ -2,6 +2,9 @@
 
 from __future__ import unicode_literals
 
+import pytest
+
+from h import blocklist
 from h import models
 
 
@@ -22,3 +25,56 @@ def test_is_blocked_with_wildcards(db_session):
     assert models.Blocklist.is_blocked(db_session, "http://example.com/")
     assert models.Blocklist.is_blocked(db_session, "http://example.com/bar")
     assert models.Blocklist.is_blocked(db_session, "http://example.com/foo")
+
+
+def test_blocked_uris(db_session):
+    db_session.add(models.Blocklist(uri="http://example.com"))
+    db_session.add(models.Blocklist(uri="%//blocked.com%"))
+    db_session.flush()
+
+    blocked = models.Blocklist.blocked_uris(db_session, ["http://example.com",
+                                                         "http://example.com/foo",
+                                                         "http://blocked.com/",
+                                                         "https://blocked.com/bar"])
+
+    assert blocked == set(["http://example.com", "http://blocked.com/", "https://blocked.com/bar"])
+
+
+def test_blocked_uris_with_no_uris(db_session):
+    assert models.Blocklist.blocked_uris(db_session, []) == set()
+
+
+class TestWithMatcher(object):
+    def test_is_blocked(self, db_session):
+        db_session.add(models.Blocklist(uri="%//example.com%"))
+        db_session.flush()
+
+        assert models.Blocklist.is_blocked(db_session, "http://example.com/bar")
+        assert not models.Blocklist.is_blocked(db_session, "http://example.org/")
+
+    def test_is_blocked_does_not_query_the_database_again(self, db_session):
+        db_session.add(models.Blocklist(uri="http://example.com"))
+        db_session.flush()
+        models.Blocklist.is_blocked(db_session, "http://example.com")
+
+        db_session.query(models.Blocklist).delete()
+
+        assert models.Blocklist.is_blocked(db_session, "http://example.com")
+
+    def test_blocked_uris(self, db_session):
+        db_session.add(models.Blocklist(uri="%//blocked.com%"))
+        db_session.flush()
+
+        blocked = models.Blocklist.blocked_uris(db_session, ["http://example.com/",
+                                                             "http://blocked.com/"])
+
+        assert blocked == set(["http://blocked.com/"])
+
+    @pytest.fixture(autouse=True)
+    def matcher(self):
+        matcher = blocklist.matcher
+        matcher.ttl = 30
+        matcher.invalidate()
+        yield matcher
+        matcher.ttl = 0
+        matcher.invalidate()
@@ -683,6 +683,22 @@ class TestMergeDocuments(object):
         with pytest.raises(transaction.interfaces.TransientError):
             document.merge_documents(db_session, merge_data)
 
+    def test_merge_documents_invalidates_uri_expansions(self, db_session, merge_data, patch):
+        cache = patch('h.models.document.uri_expansion.cache')
+
+        document.merge_documents(db_session, merge_data)
+
+        cache.invalidate.assert_called_once_with(
+            ['https://en.wikipedia.org/wiki/Main_Page'] * 3)
+
+    def test_merge_documents_records_master_for_reindexing(self, db_session, merge_data):
+        master, _, _ = merge_data
+
+        document.merge_documents(db_session, merge_data)
+
+        assert document.pop_merged_document_ids(db_session) == {master.id}
+        assert document.pop_merged_document_ids(db_session) == set()
+
     @pytest.fixture
     def merge_data(self, db_session, request):
         master = document.Document(document_uris=[document.DocumentURI(
@@ -797,6 +813,8 @@ class TestUpdateDocumentMetadata(object):
         """If it finds only one document it calls first()."""
         Document.find_or_create_by_uris.return_value = mock.Mock(
             count=mock.Mock(return_value=1))
+        Document.find_or_create_by_uris.return_value.first.return_value = (
+            mock.Mock(document_uris=[]))
 
         document.update_document_metadata(session, annotation, [], [])
 
@@ -810,7 +828,7 @@ class TestUpdateDocumentMetadata(object):
                                          session):
         yesterday_ = "yesterday"
         document_ = merge_documents.return_value = mock.Mock(
-            updated=yesterday_)
+            updated=yesterday_, document_uris=[])
         Document.find_or_create_by_uris.return_value.first.return_value = (
             document_)
 
@@ -874,7 +892,7 @@ class TestUpdateDocumentMetadata(object):
                                          Document,
                                          factories,
                                          session):
-        document_ = mock.Mock(web_uri=None)
+        document_ = mock.Mock(web_uri=None, document_uris=[])
         Document.find_or_create_by_uris.return_value.count.return_value = 1
         Document.find_or_create_by_uris.return_value.first.return_value = document_
 
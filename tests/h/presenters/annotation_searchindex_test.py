@@ -6,12 +6,16 @@ import datetime
 
 import mock
 import pytest
+from pyramid import security
 
+from h.interfaces import IGroupService
 from h.presenters.annotation_searchindex import AnnotationSearchIndexPresenter
 from h.services.annotation_moderation import AnnotationModerationService
+from h.services.groupfinder import GroupfinderService
 
 
-@pytest.mark.usefixtures('DocumentSearchIndexPresenter', 'moderation_service', 'thread_ids')
+@pytest.mark.usefixtures('DocumentSearchIndexPresenter', 'moderation_service', 'thread_ids',
+                         'groupfinder_service')
 class TestAnnotationSearchIndexPresenter(object):
 
     def test_asdict(self, DocumentSearchIndexPresenter, pyramid_request, thread_ids):
@@ -27,6 +31,7 @@ class TestAnnotationSearchIndexPresenter(object):
             tags=['magic'],
             groupid='__world__',
             shared=True,
+            document_id=123,
             target_selectors=[{'TestSelector': 'foobar'}],
             references=['referenced-id-1', 'referenced-id-2'],
             thread_ids=thread_ids,
@@ -52,6 +57,8 @@ class TestAnnotationSearchIndexPresenter(object):
                         'source': 'http://example.com',
                         'selector': [{'TestSelector': 'foobar'}]}],
             'document': {'foo': 'bar'},
+            'document_id': 123,
+            'read_principals': [security.Everyone],
             'references': ['referenced-id-1', 'referenced-id-2'],
             'thread_ids': thread_ids,
             'hidden': False,
@@ -131,6 +138,32 @@ class TestAnnotationSearchIndexPresenter(object):
 
         assert annotation_dict['hidden'] is True
 
+    def test_it_lets_members_of_a_private_group_read_shared_annotations(self, pyramid_request,
+                                                                        groupfinder_service, factories):
+        groupfinder_service.find.return_value = factories.Group.build(pubid='abc123')
+        annotation = mock.MagicMock(userid='acct:luke@hypothes.is', groupid='abc123', shared=True)
+
+        annotation_dict = AnnotationSearchIndexPresenter(annotation, pyramid_request).asdict()
+
+        groupfinder_service.find.assert_called_once_with('abc123')
+        assert annotation_dict['read_principals'] == ['group:abc123']
+
+    def test_it_lets_nobody_read_shared_annotations_in_missing_groups(self, pyramid_request,
+                                                                      groupfinder_service):
+        groupfinder_service.find.return_value = None
+        annotation = mock.MagicMock(userid='acct:luke@hypothes.is', shared=True)
+
+        annotation_dict = AnnotationSearchIndexPresenter(annotation, pyramid_request).asdict()
+
+        assert annotation_dict['read_principals'] == []
+
+    def test_it_lets_only_the_author_read_private_annotations(self, pyramid_request):
+        annotation = mock.MagicMock(userid='acct:luke@hypothes.is', shared=False)
+
+        annotation_dict = AnnotationSearchIndexPresenter(annotation, pyramid_request).asdict()
+
+        assert annotation_dict['read_principals'] == ['acct:luke@hypothes.is']
+
     @pytest.fixture
     def DocumentSearchIndexPresenter(self, patch):
         class_ = patch('h.presenters.annotation_searchindex.DocumentSearchIndexPresenter')
@@ -147,6 +180,14 @@ def moderation_service(pyramid_config):
     return svc
 
 
+@pytest.fixture
+def groupfinder_service(pyramid_config, factories):
+    svc = mock.create_autospec(GroupfinderService, spec_set=True, instance=True)
+    svc.find.return_value = factories.OpenGroup.build()
+    pyramid_config.register_service(svc, iface=IGroupService)
+    return svc
+
+
 @pytest.fixture
 def thread_ids():
     # Annotation reply ids are referred to as thread_ids in our code base.
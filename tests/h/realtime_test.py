@@ -2,10 +2,13 @@
 
 from __future__ import unicode_literals
 from datetime import datetime
+import time
 
 import pytest
 import mock
 
+from pyramid.interfaces import IRequestExtensions
+
 from h import realtime
 
 
@@ -99,12 +102,12 @@ class TestConsumer(object):
 
 
 class TestPublisher(object):
-    def test_publish_annotation(self, matchers, producer_pool, pyramid_request):
+    def test_publish_annotation(self, matchers, producer_pool):
         payload = {'action': 'create', 'annotation': {'id': 'foobar'}}
         producer = producer_pool['foobar'].acquire().__enter__()
         exchange = realtime.get_exchange()
 
-        publisher = realtime.Publisher(pyramid_request)
+        publisher = realtime.Publisher({})
         publisher.publish_annotation(payload)
 
         expected_headers = matchers.MappingContaining('timestamp')
@@ -114,12 +117,12 @@ class TestPublisher(object):
                                                  routing_key='annotation',
                                                  headers=expected_headers)
 
-    def test_publish_user(self, matchers, producer_pool, pyramid_request):
+    def test_publish_user(self, matchers, producer_pool):
         payload = {'action': 'create', 'user': {'id': 'foobar'}}
         producer = producer_pool['foobar'].acquire().__enter__()
         exchange = realtime.get_exchange()
 
-        publisher = realtime.Publisher(pyramid_request)
+        publisher = realtime.Publisher({})
         publisher.publish_user(payload)
 
         expected_headers = matchers.MappingContaining('timestamp')
@@ -129,10 +132,172 @@ class TestPublisher(object):
                                                  routing_key='user',
                                                  headers=expected_headers)
 
+    def test_publish_search_invalidation(self, matchers, producer_pool):
+        payload = {'uris': ['httpx://example.com']}
+        producer = producer_pool['foobar'].acquire().__enter__()
+        exchange = realtime.get_exchange()
+
+        publisher = realtime.Publisher({})
+        publisher.publish_search_invalidation(payload)
+
+        expected_headers = matchers.MappingContaining('timestamp')
+        producer.publish.assert_called_once_with(payload,
+                                                 exchange=exchange,
+                                                 declare=[exchange],
+                                                 routing_key='search_invalidation',
+                                                 headers=expected_headers)
+
+    def test_reuses_its_connection(self, Connection, producer_pool):
+        publisher = realtime.Publisher({})
+
+        publisher.publish_user({})
+        publisher.publish_annotation({})
+
+        Connection.assert_called_once_with(mock.ANY)
+        assert producer_pool.__getitem__.call_args_list == [
+            mock.call(Connection.return_value),
+            mock.call(Connection.return_value),
+        ]
+
+    def test_buffers_messages_when_publishing_asynchronously(self, producer_pool, thread):
+        producer = producer_pool['foobar'].acquire().__enter__()
+        publisher = realtime.Publisher({}, flush_interval=1)
+
+        publisher.publish_annotation({'id': 1})
+        publisher.publish_user({'id': 2})
+
+        assert not producer.publish.called
+        thread.return_value.start.assert_called_once_with()
+
+    def test_flush_publishes_buffered_messages(self, producer_pool, thread):
+        pool = producer_pool.__getitem__.return_value
+        producer = pool.acquire.return_value.__enter__.return_value
+        publisher = realtime.Publisher({}, flush_interval=1)
+        publisher.publish_annotation({'id': 1})
+        publisher.publish_user({'id': 2})
+
+        publisher.flush()
+
+        assert [(c[0][0], c[1]['routing_key']) for c in producer.publish.call_args_list] == [
+            ({'id': 1}, 'annotation'),
+            ({'id': 2}, 'user'),
+        ]
+        pool.acquire.assert_called_once_with(block=True)
+
+    def test_flush_does_nothing_if_buffer_empty(self, producer_pool):
+        publisher = realtime.Publisher({}, flush_interval=1)
+
+        publisher.flush()
+
+        assert not producer_pool.__getitem__.called
+
+    def test_publishes_buffer_when_full(self, producer_pool, thread):
+        producer = producer_pool['foobar'].acquire().__enter__()
+        publisher = realtime.Publisher({}, flush_interval=1, buffer_size=2)
+
+        publisher.publish_annotation({'id': 1})
+        assert not producer.publish.called
+        publisher.publish_annotation({'id': 2})
+
+        assert producer.publish.call_count == 2
+
+        publisher.flush()
+        assert producer.publish.call_count == 2
+
+    def test_restarts_flusher_thread_if_not_running(self, producer_pool, thread):
+        publisher = realtime.Publisher({}, flush_interval=1)
+        publisher.publish_annotation({'id': 1})
+        thread.return_value.is_alive.return_value = False
+
+        publisher.publish_annotation({'id': 2})
+
+        assert thread.return_value.start.call_count == 2
+
+    def test_flusher_thread_publishes_buffered_messages(self, producer_pool):
+        producer = producer_pool['foobar'].acquire().__enter__()
+        publisher = realtime.Publisher({}, flush_interval=0.001)
+
+        publisher.publish_annotation({'id': 1})
+        for _ in range(100):
+            if producer.publish.called:
+                break
+            time.sleep(0.01)
+        publisher.close()
+
+        producer.publish.assert_called_once_with({'id': 1},
+                                                 exchange=mock.ANY,
+                                                 declare=mock.ANY,
+                                                 routing_key='annotation',
+                                                 headers=mock.ANY)
+
+    def test_close_stops_the_flusher_thread(self, producer_pool):
+        publisher = realtime.Publisher({}, flush_interval=60)
+        publisher.publish_annotation({'id': 1})
+
+        publisher.close()
+
+        assert not publisher._flusher.is_alive()
+
+    def test_close_publishes_buffered_messages(self, producer_pool, thread):
+        producer = producer_pool['foobar'].acquire().__enter__()
+        publisher = realtime.Publisher({}, flush_interval=60)
+        publisher.publish_annotation({'id': 1})
+
+        publisher.close()
+
+        assert producer.publish.call_count == 1
+
+    def test_publishes_synchronously_once_closed(self, producer_pool, thread):
+        producer = producer_pool['foobar'].acquire().__enter__()
+        publisher = realtime.Publisher({}, flush_interval=60)
+        publisher.close()
+
+        publisher.publish_annotation({'id': 1})
+
+        assert producer.publish.call_count == 1
+        assert not thread.called
+
+    @pytest.fixture
+    def Connection(self, patch):
+        return patch('h.realtime.kombu.Connection')
+
     @pytest.fixture
     def producer_pool(self, patch):
         return patch('h.realtime.producer_pool')
 
+    @pytest.fixture
+    def thread(self, patch):
+        thread = patch('h.realtime.threading.Thread')
+        thread.return_value.is_alive.return_value = True
+        return thread
+
+
+class TestGetPublisher(object):
+    def test_publishes_synchronously_by_default(self):
+        publisher = realtime.get_publisher({})
+
+        assert publisher.flush_interval is None
+
+    def test_configures_asynchronous_publishing(self, atexit):
+        publisher = realtime.get_publisher({'h.realtime.flush_interval_ms': 250,
+                                            'h.realtime.buffer_size': 10})
+
+        assert publisher.flush_interval == 0.25
+        assert publisher.buffer_size == 10
+        atexit.register.assert_called_once_with(publisher.close)
+
+    @pytest.fixture
+    def atexit(self, patch):
+        return patch('h.realtime.atexit')
+
+
+class TestIncludeMe(object):
+    def test_shares_one_publisher_between_requests(self, pyramid_config):
+        pyramid_config.include('h.realtime')
+        request_factory = pyramid_config.registry.queryUtility(IRequestExtensions)
+        assert 'realtime' in request_factory.descriptors
+        assert isinstance(pyramid_config.registry.realtime, realtime.Publisher)
+
 
 class TestGetExchange(object):
     def test_returns_the_exchange(self):
@@ -94,10 +94,12 @@ def test_includeme():
         call('api.profile', '/api/profile'),
         call('api.debug_token', '/api/debug-token'),
         call('api.group_member', '/api/groups/{pubid}/members/{userid}', factory='h.traversal.GroupRoot', traverse='/{pubid}'),
+        call('api.export', '/api/export'),
         call('api.search', '/api/search'),
         call('api.users', '/api/users'),
         call('api.user', '/api/users/{username}'),
         call('badge', '/api/badge'),
+        call('badge.batch', '/api/badge/batch'),
         call('token', '/api/token'),
         call('oauth_authorize', '/oauth/authorize'),
         call('oauth_revoke', '/oauth/revoke'),
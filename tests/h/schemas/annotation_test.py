@@ -14,6 +14,10 @@ from h.schemas.annotation import (
     SearchParamsSchema,
     UpdateAnnotationSchema)
 from h.schemas.util import validate_query_params
+from h.util import cursor
+
+# A cursor returned by a search sorted by `created`.
+SEARCH_CURSOR = cursor.encode(['created', 'asc', 1514764800000, 'abc'])
 
 
 def create_annotation_schema_validate(request, data):
@@ -620,6 +624,8 @@ class TestSearchParamsSchema(object):
     def test_it_returns_only_known_params(self, schema):
         expected_params = MultiDict({
             '_separate_replies': True,
+            '_all_replies': True,
+            '_replies_cursor': 'WzEsImlkIl0',
             'group': "group1",
             'quote': "quote me",
             'references': "3456TA12",
@@ -637,9 +643,12 @@ class TestSearchParamsSchema(object):
             'order': "asc",
             'offset': 0,
             'search_after': "2018-01-01",
+            'cursor': SEARCH_CURSOR,
         })
         input_params = NestedMultiDict(MultiDict({
             '_separate_replies': '1',
+            '_all_replies': '1',
+            '_replies_cursor': 'WzEsImlkIl0',
             'group': "group1",
             'quote': "quote me",
             'references': "3456TA12",
@@ -659,6 +668,7 @@ class TestSearchParamsSchema(object):
             'unknown': "no_exist",
             'no_exist': "unknown",
             'search_after': "2018-01-01",
+            'cursor': SEARCH_CURSOR,
         }))
 
         params = validate_query_params(schema, input_params)
@@ -678,6 +688,37 @@ class TestSearchParamsSchema(object):
         assert params.getall("url") == ["http://foobar", "http://foobat"]
         assert "unknownparam" not in params
 
+    @pytest.mark.parametrize('replies_cursor', [
+        'not-a-cursor',
+        cursor.encode([1.5]),
+        cursor.encode(['a', 'b', 'c']),
+        cursor.encode([1514764800000]),
+        cursor.encode(['2018-01-01', 'id']),
+        cursor.encode([True, 'id']),
+        cursor.encode([1514764800000, 1]),
+        SEARCH_CURSOR,
+    ])
+    def test_it_raises_if_replies_cursor_is_invalid(self, schema, replies_cursor):
+        input_params = NestedMultiDict(MultiDict({'_replies_cursor': replies_cursor}))
+
+        with pytest.raises(ValidationError):
+            validate_query_params(schema, input_params)
+
+    @pytest.mark.parametrize('cursor_', [
+        'not-a-cursor',
+        # A replies cursor.
+        'WzEsImlkIl0',
+        cursor.encode(['created', 'asc']),
+        cursor.encode(['text', 'asc', 'foo', 'abc']),
+        cursor.encode(['created', 'sideways', 1514764800000, 'abc']),
+        cursor.encode(['created', 'asc', 1, 'abc', 'extra']),
+    ])
+    def test_it_raises_if_cursor_is_invalid(self, schema, cursor_):
+        input_params = NestedMultiDict(MultiDict({'cursor': cursor_}))
+
+        with pytest.raises(ValidationError):
+            validate_query_params(schema, input_params)
+
     def test_it_defaults_limit(self, schema):
 
         params = validate_query_params(schema, NestedMultiDict())
@@ -760,6 +801,15 @@ class TestSearchParamsSchema(object):
         assert params["offset"] == 0
         assert params["search_after"] == "2009-02-16"
 
+    def test_sets_offset_to_0_if_cursor(self, schema):
+        input_params = NestedMultiDict(
+            MultiDict({"cursor": SEARCH_CURSOR,
+                       "offset": 5}))
+
+        params = validate_query_params(schema, input_params)
+
+        assert params["offset"] == 0
+
     @pytest.mark.parametrize('wildcard_uri', (
         "https://localhost:3000*",
         "file://localhost*/foo.pdf",
@@ -5,7 +5,9 @@ import mock
 import pytest
 
 import h.search.index
+from h.interfaces import IGroupService
 from h.services.group import GroupService
+from h.services.groupfinder import GroupfinderService
 
 
 @pytest.fixture(autouse=True)
@@ -16,6 +18,20 @@ def group_service(pyramid_config):
     return group_service
 
 
+@pytest.fixture(autouse=True)
+def groupfinder_service(pyramid_config, db_session):
+    groupfinder_service = GroupfinderService(db_session, 'example.com')
+    pyramid_config.register_service(groupfinder_service, iface=IGroupService)
+    return groupfinder_service
+
+
+@pytest.fixture(autouse=True)
+def search_by_read_principals(pyramid_request):
+    # Most tests exercise the AuthFilter and GroupAuthFilter, which
+    # ReadPrincipalsFilter replaces when this flag is on.
+    pyramid_request.feature.flags['search_by_read_principals'] = False
+
+
 @pytest.fixture
 def Annotation(factories, index):
     """Create and index an annotation.
@@ -10,9 +10,13 @@ Tests for filtering/matching/aggregating on specific annotation fields are in
 from __future__ import unicode_literals
 
 import datetime
+
+import mock
+import pytest
 from webob.multidict import MultiDict
 
 from h import search
+from h.search import result_cache
 
 
 class TestSearch(object):
@@ -123,6 +127,39 @@ class TestSearch(object):
 
         assert result.reply_ids == []
 
+    def test_it_filters_by_read_principals_if_the_feature_is_on(self, pyramid_request, Annotation):
+        pyramid_request.feature.flags['search_by_read_principals'] = True
+        Annotation(shared=False)
+        annotation = Annotation(shared=True)
+
+        result = search.Search(pyramid_request).run(MultiDict({}))
+
+        assert result.annotation_ids == [annotation.id]
+
+
+class TestRunTotals(object):
+    def test_it_returns_the_total_of_each_search(self, factories, pyramid_request, Annotation):
+        user = factories.User()
+        Annotation(userid=user.userid, shared=True)
+        Annotation(userid=user.userid, shared=True)
+        Annotation(shared=True)
+
+        totals = search.Search(pyramid_request).run_totals([
+            MultiDict({'user': user.userid, 'limit': 0}),
+            MultiDict({'limit': 0}),
+            MultiDict({'user': 'acct:nobody@example.com', 'limit': 0}),
+        ])
+
+        assert totals == [2, 3, 0]
+
+    def test_it_makes_one_query(self, pyramid_request, Annotation):
+        Annotation(shared=True)
+        stats = mock.MagicMock()
+
+        search.Search(pyramid_request, stats=stats).run_totals([MultiDict({}), MultiDict({})])
+
+        stats.pipeline.return_value.timer.assert_called_once_with('search.query')
+
 
 class TestSearchWithSeparateReplies(object):
     """Unit tests for search.Search when separate_replies=True is given."""
@@ -230,3 +267,109 @@ class TestSearchWithSeparateReplies(object):
 
         assert len(result.reply_ids) == 3
         assert oldest_reply.id not in result.reply_ids
+
+
+class TestSearchWithResultCache(object):
+    """Unit tests for search.Search with the cache of results enabled."""
+
+    def test_it_returns_cached_results_for_uri_searches(self, pyramid_request, Annotation):
+        expected_ids = [Annotation(target_uri='http://example.com', shared=True).id]
+        search.Search(pyramid_request).run(MultiDict({'uri': 'http://example.com'}))
+        Annotation(target_uri='http://example.com', shared=True)
+
+        result = search.Search(pyramid_request).run(MultiDict({'uri': 'http://example.com'}))
+
+        assert result.annotation_ids == expected_ids
+
+    def test_it_does_not_cache_searches_without_uris(self, pyramid_request, Annotation):
+        search.Search(pyramid_request).run(MultiDict({}))
+        annotation = Annotation(shared=True)
+
+        result = search.Search(pyramid_request).run(MultiDict({}))
+
+        assert result.annotation_ids == [annotation.id]
+
+    def test_it_caches_results_separately_for_each_user(self, pyramid_config, pyramid_request, Annotation):
+        search.Search(pyramid_request).run(MultiDict({'uri': 'http://example.com'}))
+        annotation = Annotation(target_uri='http://example.com', userid='acct:bob@example.com', shared=False)
+        pyramid_config.testing_securitypolicy('acct:bob@example.com')
+
+        result = search.Search(pyramid_request).run(MultiDict({'uri': 'http://example.com'}))
+
+        assert result.annotation_ids == [annotation.id]
+
+    def test_invalidating_uris_forgets_results(self, pyramid_request, Annotation):
+        search.Search(pyramid_request).run(MultiDict({'uri': 'http://example.com'}))
+        annotation = Annotation(target_uri='http://example.com', shared=True)
+
+        result_cache.cache.invalidate([annotation.target_uri_normalized])
+        result = search.Search(pyramid_request).run(MultiDict({'uri': 'http://example.com'}))
+
+        assert result.annotation_ids == [annotation.id]
+
+    def test_it_reports_cache_hits_and_misses(self, pyramid_request, Annotation):
+        stats = mock.Mock(spec_set=['pipeline'])
+
+        for _ in range(2):
+            search.Search(pyramid_request, stats=stats).run(MultiDict({'uri': 'http://example.com'}))
+
+        timers = [c[0][0] for c in stats.pipeline.return_value.timer.call_args_list]
+        assert timers == ['search.cache.miss', 'search.query', 'search.cache.hit']
+
+    def test_it_listens_for_invalidations_before_caching_results(self, pyramid_request, Annotation,
+                                                                 listener):
+        search.Search(pyramid_request).run(MultiDict({'uri': 'http://example.com'}))
+
+        listener.ensure_running.assert_called_once_with()
+
+    @pytest.fixture(autouse=True)
+    def cache(self):
+        result_cache.cache.ttl = 60
+        yield result_cache.cache
+        result_cache.cache.ttl = 0
+        result_cache.cache.clear()
+
+    @pytest.fixture(autouse=True)
+    def listener(self, patch):
+        return patch('h.search.core.result_cache.listener')
+
+
+class TestSearchWithAllReplies(object):
+    """Unit tests for search.Search when all_replies=True is given."""
+
+    def test_it_returns_all_replies(self, pyramid_request, Annotation):
+        annotation = Annotation(shared=True)
+        replies = [Annotation(references=[annotation.id], shared=True) for _ in range(5)]
+
+        result = self.search(pyramid_request).run(MultiDict({}))
+
+        assert sorted(result.reply_ids) == sorted(r.id for r in replies)
+        assert result.replies_cursor is None
+
+    def test_it_does_not_skip_replies_updated_at_the_same_time(self, pyramid_request, Annotation):
+        annotation = Annotation(shared=True)
+        updated = datetime.datetime.now()
+        replies = [Annotation(references=[annotation.id], shared=True, updated=updated)
+                   for _ in range(5)]
+
+        result = self.search(pyramid_request).run(MultiDict({}))
+
+        assert sorted(result.reply_ids) == sorted(r.id for r in replies)
+
+    def test_it_returns_a_cursor_if_there_are_too_many_replies(self, pyramid_request, Annotation):
+        annotation = Annotation(shared=True)
+        replies = [Annotation(references=[annotation.id], shared=True) for _ in range(5)]
+
+        first = self.search(pyramid_request, replies_max=3).run(MultiDict({}))
+        rest = self.search(pyramid_request, replies_max=3,
+                           replies_cursor=first.replies_cursor).run(MultiDict({}))
+
+        assert len(first.reply_ids) == 3
+        assert first.replies_cursor is not None
+        assert sorted(first.reply_ids + rest.reply_ids) == sorted(r.id for r in replies)
+        assert rest.replies_cursor is None
+
+    def search(self, pyramid_request, **kwargs):
+        # Page through the replies two at a time.
+        return search.Search(pyramid_request, separate_replies=True, all_replies=True,
+                             _replies_limit=2, **kwargs)
@@ -7,6 +7,7 @@ import pytest
 import webob
 
 from h.search import Search, index, query
+from h.util import cursor
 from hypothesis import strategies as st
 from hypothesis import given
 
@@ -233,6 +234,78 @@ class TestSorter(object):
 
         assert result.annotation_ids == ann_ids
 
+    def test_it_breaks_ties_by_id(self, es_dsl_search):
+        q = query.Sorter()(es_dsl_search, {"sort": "created", "order": "asc"}).to_dict()
+
+        assert q["sort"] == [{"created": {"order": "asc", "unmapped_type": "boolean"}},
+                             {"id": {"order": "asc"}}]
+
+    def test_it_does_not_break_ties_with_search_after(self, es_dsl_search):
+        q = query.Sorter()(es_dsl_search, {"search_after": "2018"}).to_dict()
+
+        assert q["sort"] == [{"updated": {"order": "desc", "unmapped_type": "boolean"}}]
+
+    def test_it_sorts_and_searches_after_cursor(self, es_dsl_search):
+        params = {"sort": "id", "order": "asc", "offset": 40,
+                  "cursor": cursor.encode(["created", "asc", 1514764800000, "abc"])}
+
+        q = query.Sorter()(es_dsl_search, params).to_dict()
+
+        assert q["sort"] == [{"created": {"order": "asc", "unmapped_type": "boolean"}},
+                             {"id": {"order": "asc"}}]
+        assert q["search_after"] == [1514764800000, "abc"]
+        assert "offset" not in params
+
+    @pytest.mark.parametrize("cursor_", [
+        "not a cursor",
+        cursor.encode(["created", "asc"]),
+        cursor.encode(["text", "asc", "foo", "abc"]),
+        cursor.encode(["created", "sideways", 1514764800000, "abc"]),
+    ])
+    def test_it_raises_for_invalid_cursors(self, es_dsl_search, cursor_):
+        with pytest.raises(ValueError):
+            query.Sorter()(es_dsl_search, {"cursor": cursor_})
+
+    def test_it_pages_through_annotations_with_next_cursor(self, search, Annotation):
+        dt = datetime.datetime
+        # Annotations updated at the same time are paged through by id.
+        ann_ids = [Annotation(updated=dt(2017, 1, 1)).id for _ in range(4)]
+        ann_ids.append(Annotation(updated=dt(2016, 1, 1)).id)
+
+        params = {"limit": 2}
+        result_ids = []
+        while True:
+            result = search.run(webob.multidict.MultiDict(params))
+            result_ids.extend(result.annotation_ids)
+            if result.next_cursor is None:
+                break
+            params["cursor"] = result.next_cursor
+
+        assert result_ids == sorted(ann_ids[:4], reverse=True) + [ann_ids[4]]
+
+
+class TestNextCursor(object):
+    def test_it_returns_cursor_for_last_hit_of_full_page(self, es_dsl_search):
+        search = query.Sorter()(es_dsl_search.extra(size=2), {"sort": "created", "order": "asc"})
+        hits = [{"_id": "abc", "sort": [1, "abc"]}, {"_id": "def", "sort": [2, "def"]}]
+
+        assert cursor.decode(query.next_cursor(search, hits)) == ["created", "asc", 2, "def"]
+
+    def test_it_returns_None_for_unknown_sort_fields(self, es_dsl_search):
+        search = query.Sorter()(es_dsl_search.extra(size=1), {"sort": "no_such_field"})
+        hits = [{"_id": "abc", "sort": [None, "abc"]}]
+
+        assert query.next_cursor(search, hits) is None
+
+    @pytest.mark.parametrize("hits", [
+        [],
+        [{"_id": "abc", "sort": [1, "abc"]}],
+    ])
+    def test_it_returns_None_unless_page_is_full(self, es_dsl_search, hits):
+        search = query.Sorter()(es_dsl_search.extra(size=2), {})
+
+        assert query.next_cursor(search, hits) is None
+
 
 class TestTopLevelAnnotationsFilter(object):
 
@@ -360,12 +433,72 @@ class TestGroupAuthFilter(object):
 
         assert sorted(result.annotation_ids) == sorted(expected_ids)
 
+    def test_looks_up_readable_groups_once(self, es_dsl_search, pyramid_request, group_service):
+        groupauthfilter = query.GroupAuthFilter(pyramid_request)
+
+        groupauthfilter(es_dsl_search, {})
+        groupauthfilter(es_dsl_search, {})
+
+        assert group_service.groupids_readable_by.call_count == 1
+
     @pytest.fixture
     def search(self, search, pyramid_request):
         search.append_modifier(query.GroupAuthFilter(pyramid_request))
         return search
 
 
+class TestReadPrincipalsFilter(object):
+    def test_logged_out_user_can_only_see_shared_annotations_in_public_groups(
+        self, search, Annotation, factories,
+    ):
+        group = factories.Group()
+        Annotation(shared=False)
+        Annotation(groupid=group.pubid, shared=True)
+        expected_ids = [Annotation(shared=True).id]
+
+        result = search.run(webob.multidict.MultiDict({}))
+
+        assert result.annotation_ids == expected_ids
+
+    def test_logged_in_user_can_see_their_private_annotations(self, search, pyramid_config, Annotation):
+        userid = "acct:bar@auth2"
+        pyramid_config.testing_securitypolicy(userid)
+        Annotation(userid="acct:foo@auth2", shared=False)
+        expected_ids = [Annotation(userid=userid, shared=False).id]
+
+        result = search.run(webob.multidict.MultiDict({}))
+
+        assert result.annotation_ids == expected_ids
+
+    def test_group_members_can_see_shared_annotations_in_their_groups(
+        self, search, pyramid_config, Annotation, factories,
+    ):
+        group = factories.Group()
+        other_group = factories.Group()
+        pyramid_config.testing_securitypolicy("acct:bar@auth2",
+                                              groupids=["group:{}".format(group.pubid)])
+        Annotation(groupid=other_group.pubid, shared=True)
+        expected_ids = [Annotation(groupid=group.pubid, shared=True).id]
+
+        result = search.run(webob.multidict.MultiDict({}))
+
+        assert result.annotation_ids == expected_ids
+
+    def test_it_filters_by_the_requests_readable_principals(self, es_dsl_search, pyramid_config, pyramid_request):
+        pyramid_config.testing_securitypolicy("acct:bar@auth2",
+                                              groupids=["group:xyz", "group:abc", "role:admin"])
+
+        q = query.ReadPrincipalsFilter(pyramid_request)(es_dsl_search, {}).to_dict()
+
+        assert q["query"]["bool"]["filter"] == [{"terms": {"read_principals": [
+            "acct:bar@auth2", "group:abc", "group:xyz", "system.Everyone"]}}]
+
+    @pytest.fixture
+    def search(self, search, pyramid_request):
+        search.append_modifier(query.ReadPrincipalsFilter(pyramid_request))
+        return search
+
+
 class TestUserFilter(object):
     def test_filters_annotations_by_user(self, search, Annotation):
         Annotation(userid="acct:foo@auth2", shared=True)
@@ -443,7 +576,8 @@ class TestUriFilter(object):
 
         assert sorted(result.annotation_ids) == sorted(expected_ids)
 
-    def test_returns_all_annotations_with_equivalent_uris(self, search, Annotation, storage):
+    def test_returns_all_annotations_with_equivalent_uris(self, search, Annotation, pyramid_request, storage):
+        pyramid_request.feature.flags['search_by_document_id'] = False
         # Mark all these uri's as equivalent uri's.
         storage.expand_uri.side_effect = lambda _, x: [
             "urn:x-pdf:1234",
@@ -481,6 +615,46 @@ class TestUriFilter(object):
 
         assert sorted(result.annotation_ids) == sorted(expected_ids)
 
+    def test_filters_by_document_id(self, es_dsl_search, pyramid_request, storage):
+        storage.document_id_for_uri.return_value = 123
+        urifilter = query.UriFilter(pyramid_request)
+
+        q = urifilter(es_dsl_search, webob.multidict.MultiDict({"uri": "http://bar.com"})).to_dict()
+
+        storage.document_id_for_uri.assert_called_once_with(pyramid_request.db, "http://bar.com")
+        assert q['query']['bool']['filter'] == [{'term': {'document_id': 123}}]
+
+    def test_filters_by_uri_if_there_is_no_document(self, es_dsl_search, pyramid_request, storage):
+        storage.document_id_for_uri.side_effect = lambda _, u: 123 if u == "http://bar.com" else None
+        urifilter = query.UriFilter(pyramid_request)
+        params = webob.multidict.MultiDict([("uri", "http://bar.com"), ("url", "http://foo.com")])
+
+        q = urifilter(es_dsl_search, params).to_dict()
+
+        assert q['query']['bool']['filter'] == [{'bool': {'should': [
+            {'term': {'document_id': 123}},
+            {'terms': {'target.scope': ['httpx://foo.com']}},
+        ]}}]
+
+    def test_does_not_expand_uris_when_filtering_by_document_id(self, search, pyramid_request, storage):
+        storage.document_id_for_uri.return_value = 123
+
+        search.run(webob.multidict.MultiDict({"uri": "http://bar.com"}))
+
+        assert not storage.expand_uri.called
+
+    def test_finds_annotations_by_document_id(self, search, Annotation, factories, pyramid_request):
+        document = factories.Document(document_uris=[
+            factories.DocumentURI(uri="http://bar.com", claimant="http://bar.com", type="self-claim"),
+            factories.DocumentURI(uri="http://baz.com", claimant="http://bar.com", type="rel-alternate"),
+        ])
+        Annotation(target_uri="http://baz.com")
+        expected_ids = [Annotation(target_uri="http://baz.com", document=document, document_id=document.id).id]
+
+        result = search.run(webob.multidict.MultiDict({"uri": "http://bar.com"}))
+
+        assert result.annotation_ids == expected_ids
+
     # TODO - Explicit test of URL normalization (ie. that search normalizes input
     # URL using `h.util.uri.normalize` and queries with that).
 
@@ -662,6 +836,15 @@ class TestNipsaFilter(object):
 
         assert sorted(result.annotation_ids) == sorted(expected_ids)
 
+    def test_looks_up_created_groups_once(self, es_dsl_search, pyramid_request, user, group_service):
+        pyramid_request.user = user
+        nipsafilter = query.NipsaFilter(pyramid_request)
+
+        nipsafilter(es_dsl_search, {})
+        nipsafilter(es_dsl_search, {})
+
+        assert group_service.groupids_created_by.call_count == 1
+
     @pytest.fixture
     def banned_user(self, factories):
         return factories.User(username="banned", nipsa=True)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import mock
+import pytest
+
+from h.search import result_cache
+
+
+class TestResultCache(object):
+    def test_get_returns_none_for_uncached_key(self, cache):
+        assert cache.get('key') is None
+
+    def test_get_returns_cached_result(self, cache):
+        cache.set('key', mock.sentinel.result, ['httpx://example.com'])
+
+        assert cache.get('key') == mock.sentinel.result
+
+    def test_get_returns_none_once_the_result_expires(self, cache, clock):
+        cache.set('key', mock.sentinel.result, ['httpx://example.com'])
+
+        clock.return_value += 60
+
+        assert cache.get('key') is None
+        assert len(cache) == 0
+
+    def test_set_drops_the_least_recently_used_result(self, cache):
+        cache.size = 2
+        cache.set('a', mock.sentinel.a, ['httpx://a.com'])
+        cache.set('b', mock.sentinel.b, ['httpx://b.com'])
+        cache.get('a')
+
+        cache.set('c', mock.sentinel.c, ['httpx://c.com'])
+
+        assert cache.get('a') == mock.sentinel.a
+        assert cache.get('b') is None
+        assert cache.get('c') == mock.sentinel.c
+
+    def test_invalidate_forgets_results_for_uris(self, cache):
+        cache.set('a', mock.sentinel.a, ['httpx://a.com'])
+        cache.set('ab', mock.sentinel.ab, ['httpx://a.com', 'httpx://b.com'])
+        cache.set('c', mock.sentinel.c, ['httpx://c.com'])
+
+        cache.invalidate(['httpx://b.com'])
+
+        assert cache.get('a') == mock.sentinel.a
+        assert cache.get('ab') is None
+        assert cache.get('c') == mock.sentinel.c
+
+    def test_invalidate_forgets_replaced_results_uris(self, cache):
+        cache.set('key', mock.sentinel.old, ['httpx://a.com'])
+        cache.set('key', mock.sentinel.new, ['httpx://b.com'])
+
+        cache.invalidate(['httpx://a.com'])
+
+        assert cache.get('key') == mock.sentinel.new
+
+    def test_nothing_is_cached_if_ttl_is_zero(self, cache):
+        cache.ttl = 0
+
+        cache.set('key', mock.sentinel.result, ['httpx://example.com'])
+
+        assert cache.get('key') is None
+        assert len(cache) == 0
+
+    @pytest.fixture
+    def clock(self):
+        return mock.Mock(return_value=1000.0)
+
+    @pytest.fixture
+    def cache(self, clock):
+        return result_cache.ResultCache(ttl=30, clock=clock)
+
+
+class TestListener(object):
+    def test_handle_invalidates_the_uris(self, cache, listener):
+        listener.handle({'uris': ['httpx://a.com', 'httpx://b.com']})
+
+        cache.invalidate.assert_called_once_with(['httpx://a.com', 'httpx://b.com'])
+
+    def test_consumer_listens_for_invalidations(self, listener, realtime):
+        consumer = listener.consumer()
+
+        realtime.get_connection.assert_called_once_with(listener.settings)
+        realtime.Consumer.assert_called_once_with(connection=realtime.get_connection.return_value,
+                                                  routing_key='search_invalidation',
+                                                  handler=listener.handle)
+        assert consumer == realtime.Consumer.return_value
+
+    def test_ensure_running_runs_the_consumer_in_a_thread(self, listener, realtime, Thread):
+        listener.ensure_running()
+
+        Thread.assert_called_once_with(target=listener._listen, name='search-result-cache')
+        assert Thread.return_value.daemon is True
+        Thread.return_value.start.assert_called_once_with()
+        listener._listen()
+        realtime.Consumer.return_value.run.assert_called_once_with()
+
+    def test_ensure_running_does_nothing_if_already_running(self, listener, Thread):
+        listener.ensure_running()
+        Thread.return_value.is_alive.return_value = True
+
+        listener.ensure_running()
+
+        assert Thread.call_count == 1
+
+    def test_ensure_running_restarts_the_thread_if_it_stopped(self, listener, Thread):
+        listener.ensure_running()
+        Thread.return_value.is_alive.return_value = False
+
+        listener.ensure_running()
+
+        assert Thread.call_count == 2
+
+    @pytest.fixture
+    def cache(self):
+        return mock.Mock(spec_set=result_cache.ResultCache())
+
+    @pytest.fixture
+    def listener(self, cache):
+        return result_cache.Listener(cache, {'broker_url': 'memory://'})
+
+    @pytest.fixture
+    def realtime(self, patch):
+        return patch('h.search.result_cache.realtime')
+
+    @pytest.fixture
+    def Thread(self, patch):
+        return patch('h.search.result_cache.threading.Thread')
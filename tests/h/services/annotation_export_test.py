@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+
+import mock
+import pytest
+from webob.multidict import MultiDict
+
+from h.search.core import SearchResult
+from h.services.annotation_export import AnnotationExportService
+from h.services.annotation_export import annotation_export_service_factory
+
+
+class TestAnnotationExportService(object):
+    def test_it_exports_annotations_as_lines_of_json(self, svc, presentation_svc):
+        presentation_svc.present_all.return_value = [{'id': 'a'}, {'id': 'b'}]
+
+        lines = list(svc.export(MultiDict()))
+
+        assert [json.loads(line) for line in lines] == [{'id': 'a'}, {'id': 'b'}]
+        assert all(line.endswith('\n') and '\n' not in line[:-1] for line in lines)
+
+    def test_it_searches_oldest_first_a_page_at_a_time(self, svc, search_run):
+        list(svc.export(MultiDict({'group': 'abc123', 'sort': 'updated', 'order': 'desc',
+                                   'limit': 10, 'offset': 20, '_separate_replies': True})))
+
+        params = search_run.call_args[0][0]
+        assert params == MultiDict({'group': 'abc123', 'sort': 'created', 'order': 'asc', 'limit': 2})
+
+    def test_it_follows_the_next_cursor_of_each_page(self, svc, search_run, presentation_svc):
+        search_run.side_effect = [SearchResult(3, ['a', 'b'], [], {}, next_cursor='cursor1'),
+                                  SearchResult(3, ['c'], [], {})]
+        presentation_svc.present_all.side_effect = lambda ids: [{'id': id_} for id_ in ids]
+
+        lines = list(svc.export(MultiDict()))
+
+        assert [json.loads(line)['id'] for line in lines] == ['a', 'b', 'c']
+        assert 'cursor' not in search_run.call_args_list[0][0][0]
+        assert search_run.call_args_list[1][0][0]['cursor'] == 'cursor1'
+
+    def test_it_presents_each_page_with_a_new_presentation_service(self, svc, search_run,
+                                                                   presentation_svc_factory):
+        search_run.side_effect = [SearchResult(3, ['a', 'b'], [], {}, next_cursor='cursor1'),
+                                  SearchResult(3, ['c'], [], {})]
+
+        list(svc.export(MultiDict()))
+
+        assert presentation_svc_factory.call_count == 2
+
+    def test_it_filters_by_uri(self, svc, search_lib, UriCombinedWildcardFilter, pyramid_request):
+        list(svc.export(MultiDict()))
+
+        UriCombinedWildcardFilter.assert_called_once_with(pyramid_request, separate_keys=True)
+        search_lib.Search.return_value.append_modifier.assert_called_once_with(
+            UriCombinedWildcardFilter.return_value)
+
+    @pytest.fixture
+    def presentation_svc(self):
+        svc = mock.Mock(spec_set=['present_all'])
+        svc.present_all.return_value = []
+        return svc
+
+    @pytest.fixture
+    def presentation_svc_factory(self, presentation_svc):
+        return mock.Mock(return_value=presentation_svc)
+
+    @pytest.fixture
+    def svc(self, pyramid_request, presentation_svc_factory):
+        return AnnotationExportService(pyramid_request, presentation_svc_factory, page_size=2)
+
+
+class TestAnnotationExportServiceFactory(object):
+    def test_it_returns_service(self, pyramid_request):
+        svc = annotation_export_service_factory(None, pyramid_request)
+
+        assert isinstance(svc, AnnotationExportService)
+
+    def test_it_makes_presentation_services_for_the_request(self, pyramid_request, patch):
+        factory = patch('h.services.annotation_export.annotation_json_presentation_service_factory')
+
+        svc = annotation_export_service_factory(None, pyramid_request)
+
+        assert svc.presentation_svc_factory() == factory.return_value
+        factory.assert_called_once_with(None, pyramid_request)
+
+
+@pytest.fixture(autouse=True)
+def search_lib(patch):
+    search_lib = patch('h.services.annotation_export.search_lib')
+    search_lib.Search.return_value.run.return_value = SearchResult(0, [], [], {})
+    return search_lib
+
+
+@pytest.fixture
+def search_run(search_lib):
+    return search_lib.Search.return_value.run
+
+
+@pytest.fixture(autouse=True)
+def UriCombinedWildcardFilter(patch):
+    return patch('h.services.annotation_export.UriCombinedWildcardFilter')
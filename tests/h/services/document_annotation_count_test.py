@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import mock
+import pytest
+
+from h.models import Document, DocumentAnnotationCount
+from h.services.document_annotation_count import DocumentAnnotationCountService
+from h.services.document_annotation_count import document_annotation_count_service_factory
+
+
+class TestCount(object):
+    def test_it_returns_zero_if_the_uri_has_never_been_annotated(self, svc):
+        assert svc.count('http://example.com/never-annotated') == 0
+
+    def test_it_returns_none_if_the_document_has_not_been_counted(self, svc, factories, db_session):
+        factories.DocumentURI(uri='http://example.com/')
+        db_session.flush()
+
+        assert svc.count('http://example.com/') is None
+
+    def test_it_returns_the_stored_count(self, svc, document, db_session):
+        db_session.add(DocumentAnnotationCount(document_id=document.id, top_level=3, total=5))
+        db_session.flush()
+
+        assert svc.count('http://example.com/') == 5
+
+    def test_it_normalizes_the_uri(self, svc, document, db_session):
+        db_session.add(DocumentAnnotationCount(document_id=document.id, top_level=3, total=5))
+        db_session.flush()
+
+        assert svc.count('http://example.com/#fragment') == 5
+
+    def test_it_adds_up_the_counts_of_the_uris_documents(self, svc, factories, document, db_session):
+        other_document = factories.DocumentURI(uri='http://example.com/',
+                                               claimant='http://example.com/other/').document
+        db_session.flush()
+        db_session.add_all([DocumentAnnotationCount(document_id=document.id, top_level=3, total=5),
+                            DocumentAnnotationCount(document_id=other_document.id, top_level=1, total=2)])
+        db_session.flush()
+
+        assert svc.count('http://example.com/') == 7
+
+
+class TestCounts(object):
+    def test_it_returns_the_count_of_each_uri(self, svc, factories, document, db_session):
+        factories.DocumentURI(uri='http://example.com/uncounted')
+        db_session.add(DocumentAnnotationCount(document_id=document.id, top_level=3, total=5))
+        db_session.flush()
+
+        counts = svc.counts(['http://example.com/',
+                             'http://example.com/#fragment',
+                             'http://example.com/uncounted',
+                             'http://example.com/never-annotated'])
+
+        assert counts == {'http://example.com/': 5,
+                          'http://example.com/#fragment': 5,
+                          'http://example.com/uncounted': None,
+                          'http://example.com/never-annotated': 0}
+
+    def test_it_returns_an_empty_dict_for_no_uris(self, svc):
+        assert svc.counts([]) == {}
+
+
+class TestUpdate(object):
+    def test_it_counts_shared_annotations_in_world_readable_groups(self, svc, factories, document,
+                                                                   group, stored_count):
+        factories.Annotation.create_batch(2, target_uri='http://example.com/', groupid=group.pubid, shared=True)
+
+        svc.update([document.id])
+
+        assert stored_count(document) == (2, 2)
+
+    def test_it_counts_replies_in_the_total_only(self, svc, factories, document, group, stored_count):
+        parent = factories.Annotation(target_uri='http://example.com/', groupid=group.pubid, shared=True)
+        factories.Annotation(target_uri='http://example.com/', groupid=group.pubid, shared=True,
+                             references=[parent.id])
+
+        svc.update([document.id])
+
+        assert stored_count(document) == (1, 2)
+
+    @pytest.mark.parametrize('kwargs', [
+        {'shared': False},
+        {'shared': True, 'deleted': True},
+    ])
+    def test_it_does_not_count_non_public_annotations(self, svc, factories, document, group,
+                                                      stored_count, kwargs):
+        factories.Annotation(target_uri='http://example.com/', groupid=group.pubid, **kwargs)
+
+        svc.update([document.id])
+
+        assert stored_count(document) == (0, 0)
+
+    def test_it_does_not_count_annotations_in_private_groups(self, svc, factories, document,
+                                                             stored_count):
+        private_group = factories.Group()
+        factories.Annotation(target_uri='http://example.com/', groupid=private_group.pubid, shared=True)
+
+        svc.update([document.id])
+
+        assert stored_count(document) == (0, 0)
+
+    def test_it_does_not_count_annotations_by_nipsad_users(self, svc, factories, document, group,
+                                                           nipsa_service, stored_count):
+        factories.Annotation(target_uri='http://example.com/', groupid=group.pubid, shared=True,
+                             userid='acct:nipsad@example.com')
+        nipsa_service.fetch_all_flagged_userids.return_value = set(['acct:nipsad@example.com'])
+
+        svc.update([document.id])
+
+        assert stored_count(document) == (0, 0)
+
+    def test_it_replaces_existing_counts(self, svc, document, db_session, stored_count):
+        db_session.add(DocumentAnnotationCount(document_id=document.id, top_level=3, total=5))
+        db_session.flush()
+
+        svc.update([document.id])
+
+        assert stored_count(document) == (0, 0)
+
+    def test_it_ignores_documents_which_do_not_exist(self, svc, db_session):
+        svc.update([123456789])
+
+        assert db_session.query(DocumentAnnotationCount).count() == 0
+
+
+class TestUpdateAll(object):
+    def test_it_counts_every_document(self, svc, factories, group, db_session):
+        annotations = [factories.Annotation(groupid=group.pubid, shared=True) for _ in range(3)]
+        document_ids = sorted(id_ for (id_,) in db_session.query(Document.id))
+
+        windows = list(svc.update_all(window_size=2))
+
+        assert windows == [document_ids[i:i + 2] for i in range(0, len(document_ids), 2)]
+        expected = dict((id_, 0) for id_ in document_ids)
+        expected.update((annotation.document_id, 1) for annotation in annotations)
+        assert dict(db_session.query(DocumentAnnotationCount.document_id,
+                                     DocumentAnnotationCount.total)) == expected
+
+    def test_it_fetches_the_nipsad_users_once(self, svc, factories, nipsa_service, db_session):
+        factories.Document.create_batch(3)
+        db_session.flush()
+
+        list(svc.update_all(window_size=1))
+
+        assert nipsa_service.fetch_all_flagged_userids.call_count == 1
+
+
+class TestDocumentAnnotationCountServiceFactory(object):
+    def test_it_returns_service(self, pyramid_request, nipsa_service):
+        svc = document_annotation_count_service_factory(None, pyramid_request)
+
+        assert isinstance(svc, DocumentAnnotationCountService)
+        assert svc.session == pyramid_request.db
+        assert svc.nipsa_svc == nipsa_service
+
+
+@pytest.fixture
+def document(factories, db_session):
+    document = factories.DocumentURI(uri='http://example.com/').document
+    db_session.flush()
+    return document
+
+
+@pytest.fixture
+def group(factories):
+    return factories.OpenGroup()
+
+
+@pytest.fixture
+def nipsa_service(pyramid_config):
+    svc = mock.Mock(spec_set=['fetch_all_flagged_userids'])
+    svc.fetch_all_flagged_userids.return_value = set()
+    pyramid_config.register_service(svc, name='nipsa')
+    return svc
+
+
+@pytest.fixture
+def stored_count(db_session):
+    def stored_count(document):
+        count = db_session.query(DocumentAnnotationCount).get(document.id)
+        db_session.refresh(count)
+        return (count.top_level, count.total)
+    return stored_count
+
+
+@pytest.fixture
+def svc(db_session, nipsa_service):
+    return DocumentAnnotationCountService(db_session, nipsa_service)
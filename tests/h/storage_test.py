@@ -10,7 +10,7 @@ import mock
 from h.models.annotation import Annotation
 from h.models.document import Document, DocumentURI
 
-from h import storage
+from h import events, storage
 from h.schemas import ValidationError
 
 
@@ -90,6 +90,53 @@ class TestExpandURI(object):
             'http://bar.com/'
         ]
 
+    def test_expand_uri_uses_cached_expansion(self, db_session, cache):
+        cache.get.return_value = ['http://example.com/', 'http://example.org/']
+
+        actual = storage.expand_uri(db_session, 'http://example.com/')
+
+        cache.get.assert_called_once_with('http://example.com/')
+        assert actual == ['http://example.com/', 'http://example.org/']
+
+    def test_expand_uri_caches_expansion(self, db_session, cache):
+        cache.get.return_value = None
+
+        storage.expand_uri(db_session, 'http://example.com/')
+
+        cache.set.assert_called_once_with('http://example.com/',
+                                          ['http://example.com/'])
+
+    @pytest.fixture
+    def cache(self, patch):
+        return patch('h.storage.uri_expansion.cache')
+
+
+class TestDocumentIdForURI(object):
+
+    def test_it_returns_none_if_there_is_no_document(self, db_session):
+        assert storage.document_id_for_uri(db_session, 'http://example.com/') is None
+
+    def test_it_returns_the_document_id(self, db_session):
+        document = Document(document_uris=[
+            DocumentURI(uri='http://foo.com/', claimant='http://bar.com'),
+            DocumentURI(uri='http://bar.com/', claimant='http://bar.com'),
+        ])
+        db_session.add(document)
+        db_session.flush()
+
+        assert storage.document_id_for_uri(db_session, 'http://foo.com/') == document.id
+
+    def test_it_returns_none_for_canonical_uris(self, db_session):
+        document = Document(document_uris=[
+            DocumentURI(uri='http://foo.com/', claimant='http://example.com'),
+            DocumentURI(uri='http://example.com/', type='rel-canonical',
+                        claimant='http://example.com'),
+        ])
+        db_session.add(document)
+        db_session.flush()
+
+        assert storage.document_id_for_uri(db_session, 'http://example.com/') is None
+
 
 @pytest.mark.usefixtures('models', 'group_service', 'update_document_metadata')
 class TestCreateAnnotation(object):
@@ -293,6 +340,21 @@ class TestCreateAnnotation(object):
             updated=datetime.utcnow(),
         )
 
+    def test_it_notifies_merges_of_documents(self,
+                                             models,
+                                             pyramid_request,
+                                             group_service,
+                                             pop_merged_document_ids):
+        pyramid_request.notify_after_commit = mock.Mock()
+        pop_merged_document_ids.return_value = {123}
+
+        storage.create_annotation(pyramid_request, self.annotation_data(), group_service)
+
+        pop_merged_document_ids.assert_called_once_with(pyramid_request.db)
+        event = pyramid_request.notify_after_commit.call_args[0][0]
+        assert isinstance(event, events.DocumentMergedEvent)
+        assert event.document_id == 123
+
     def test_it_sets_the_annotations_document_id(self,
                                                  models,
                                                  pyramid_request,
@@ -501,6 +563,23 @@ class TestUpdateAnnotation(object):
             updated=datetime.utcnow()
         )
 
+    def test_it_notifies_merges_of_documents(self,
+                                             annotation_data,
+                                             pyramid_request,
+                                             group_service,
+                                             pop_merged_document_ids):
+        pyramid_request.notify_after_commit = mock.Mock()
+        pop_merged_document_ids.return_value = {123}
+
+        storage.update_annotation(pyramid_request,
+                                  'test_annotation_id',
+                                  annotation_data,
+                                  group_service)
+
+        event = pyramid_request.notify_after_commit.call_args[0][0]
+        assert isinstance(event, events.DocumentMergedEvent)
+        assert event.document_id == 123
+
     def test_it_updates_the_annotations_document_id(self,
                                                     annotation_data,
                                                     pyramid_request,
@@ -592,10 +671,16 @@ def update_document_metadata(patch):
     return patch('h.storage.update_document_metadata')
 
 
+@pytest.fixture
+def pop_merged_document_ids(patch):
+    return patch('h.storage.pop_merged_document_ids')
+
+
 @pytest.fixture
 def session(db_session):
     session = mock.Mock(spec=db_session)
     session.query.return_value.get.return_value.extra = {}
+    session.info = {}
     return session
 
 
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import os
+import struct
+import zlib
+
+import pytest
+from ws4py.framing import (Frame, OPCODE_CONTINUATION, OPCODE_PING,
+                           OPCODE_TEXT)
+
+from h.streamer import deflate
+
+
+def compress(data, context=None):
+    compressor = context or zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return body[:-4]
+
+
+def decompress(body):
+    return zlib.decompressobj(-zlib.MAX_WBITS).decompress(body + b'\x00\x00\xff\xff')
+
+
+def client_frame(body, opcode=OPCODE_TEXT, fin=1, rsv1=1):
+    """A masked frame, as sent by a client."""
+    return Frame(opcode=opcode, body=body, masking_key=os.urandom(4),
+                 fin=fin, rsv1=rsv1).build()
+
+
+def parse_server_frame(frame):
+    """Return the RSV1 bit and body of an unmasked frame of < 126 bytes."""
+    first_byte, length = struct.unpack('!BB', frame[:2])
+    assert length == len(frame) - 2
+    return (first_byte >> 6) & 1, frame[2:]
+
+
+class TestPerMessageDeflate(object):
+    def test_negotiate_accepts_offer_without_context_takeover(self):
+        result = deflate.PerMessageDeflate().negotiate('permessage-deflate; client_max_window_bits')
+
+        assert result.response == ('permessage-deflate; '
+                                   'server_no_context_takeover; '
+                                   'client_no_context_takeover')
+
+    def test_negotiate_accepts_offer_with_context_takeover_if_configured(self):
+        result = deflate.PerMessageDeflate(context_takeover=True).negotiate('permessage-deflate')
+
+        assert result.response == 'permessage-deflate'
+        assert not result.shared
+
+    def test_negotiate_respects_offered_no_context_takeover(self):
+        permessage_deflate = deflate.PerMessageDeflate(context_takeover=True)
+
+        result = permessage_deflate.negotiate('permessage-deflate; server_no_context_takeover')
+
+        assert result.response == 'permessage-deflate; server_no_context_takeover'
+        assert result.shared
+
+    def test_negotiate_respects_offered_server_window_size(self):
+        result = deflate.PerMessageDeflate().negotiate('permessage-deflate; server_max_window_bits=10')
+
+        assert result.window_bits == 10
+        assert result.response.endswith('; server_max_window_bits=10')
+
+    @pytest.mark.parametrize('header', [
+        None,
+        '',
+        'x-webkit-deflate-frame',
+        'permessage-deflate; server_max_window_bits',
+        'permessage-deflate; server_max_window_bits=8',
+        'permessage-deflate; server_max_window_bits=16',
+        'permessage-deflate; client_max_window_bits=7',
+        'permessage-deflate; server_no_context_takeover=1',
+        'permessage-deflate; server_no_context_takeover; server_no_context_takeover',
+        'permessage-deflate; bogus',
+    ])
+    def test_negotiate_rejects_unacceptable_offers(self, header):
+        assert deflate.PerMessageDeflate().negotiate(header) is None
+
+    def test_negotiate_accepts_first_acceptable_offer(self):
+        result = deflate.PerMessageDeflate().negotiate(
+            'permessage-deflate; bogus, permessage-deflate; server_max_window_bits=12')
+
+        assert result.window_bits == 12
+
+    def test_negotiate_shares_parameters_without_context_takeover(self):
+        permessage_deflate = deflate.PerMessageDeflate()
+
+        first = permessage_deflate.negotiate('permessage-deflate')
+        second = permessage_deflate.negotiate('permessage-deflate; client_max_window_bits')
+
+        assert first is second
+
+    def test_raises_for_invalid_level(self):
+        with pytest.raises(ValueError):
+            deflate.PerMessageDeflate(level=10)
+
+
+class TestDeflate(object):
+    def test_frame_is_compressed_unmasked_text_frame(self):
+        params = deflate.Deflate(6, None, False, False)
+
+        rsv1, body = parse_server_frame(params.frame('{"foo": "bar"}'))
+
+        assert rsv1 == 1
+        assert decompress(body) == b'{"foo": "bar"}'
+
+    def test_frame_compresses_each_message_alone_without_context_takeover(self):
+        params = deflate.Deflate(6, None, False, False)
+
+        first = params.frame('{"foo": "bar"}')
+        second = params.frame('{"foo": "bar"}')
+
+        assert first == second
+
+    def test_frame_keeps_context_with_context_takeover(self):
+        params = deflate.Deflate(6, None, True, True)
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+        for _ in range(2):
+            _, body = parse_server_frame(params.frame('{"foo": "bar"}'))
+            assert decompressor.decompress(body + b'\x00\x00\xff\xff') == b'{"foo": "bar"}'
+
+
+class TestDeflateStream(object):
+    def test_parses_compressed_messages(self):
+        stream = self.stream()
+
+        stream.parser.send(client_frame(compress(b'{"type": "ping"}')))
+
+        assert stream.has_message
+        assert stream.message.data == b'{"type": "ping"}'
+
+    def test_parses_uncompressed_messages(self):
+        stream = self.stream()
+
+        stream.parser.send(client_frame(b'{"type": "ping"}', rsv1=0))
+
+        assert stream.message.data == b'{"type": "ping"}'
+
+    def test_parses_fragmented_compressed_messages(self):
+        stream = self.stream()
+        body = compress(b'{"type": "ping"}')
+
+        stream.parser.send(client_frame(body[:5], fin=0))
+        stream.parser.send(client_frame(body[5:], opcode=OPCODE_CONTINUATION, rsv1=0))
+
+        assert stream.message.data == b'{"type": "ping"}'
+
+    def test_parses_messages_compressed_with_context_takeover(self):
+        stream = self.stream(deflate.Deflate(6, None, True, True))
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+        for _ in range(2):
+            stream.parser.send(client_frame(compress(b'{"type": "ping"}', compressor)))
+            assert stream.message.data == b'{"type": "ping"}'
+            stream.message = None
+
+    def test_rejects_compressed_control_frames(self):
+        stream = self.stream()
+
+        stream.parser.send(client_frame(b'', opcode=OPCODE_PING))
+
+        assert [e.code for e in stream.errors] == [1002]
+
+    def test_rejects_invalid_compressed_data(self):
+        stream = self.stream()
+
+        stream.parser.send(client_frame(b'\xff\xff\xff\xff'))
+
+        assert [e.code for e in stream.errors] == [1002]
+
+    def test_rejects_messages_too_large_once_decompressed(self):
+        stream = self.stream()
+
+        stream.parser.send(client_frame(compress(b' ' * (deflate.MAX_INFLATED_SIZE + 1))))
+
+        assert [e.code for e in stream.errors] == [1002]
+
+    def stream(self, params=None):
+        return deflate.DeflateStream(params or deflate.Deflate(6, None, False, False))
+
+
+class TestParseExtensions(object):
+    def test_parses_extensions_and_params(self):
+        header = 'permessage-deflate; client_max_window_bits; server_max_window_bits="10", foo'
+
+        assert deflate.parse_extensions(header) == [
+            ('permessage-deflate', [('client_max_window_bits', None),
+                                    ('server_max_window_bits', '10')]),
+            ('foo', []),
+        ]
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytest
+
+from h.streamer.filter import FilterHandler, compile_filter, uni_fold
+
+
+def uri_clause(operator, value):
+    return {'field': '/uri', 'operator': operator, 'value': value}
+
+
+def make_handler(clauses, match_policy='include_any'):
+    return FilterHandler({
+        'match_policy': match_policy,
+        'clauses': clauses,
+        'actions': {'create': True, 'update': True, 'delete': True},
+    })
+
+
+ANNOTATION = {
+    'uri': 'http://example.com/page',
+    'created': '2018-06-01T12:00:00',
+    'text': 'Café society',
+    'tags': ['foo', 'bar'],
+    'permissions': {'read': ['group:__world__']},
+}
+
+
+class TestFilterHandler(object):
+    @pytest.mark.parametrize('clause,expected', [
+        (uri_clause('equals', 'http://EXAMPLE.com/page'), True),
+        (uri_clause('equals', 'http://example.com/other'), False),
+        (uri_clause('one_of', ['http://example.org/', 'http://example.com/page']), True),
+        (uri_clause('one_of', ['http://example.org/']), False),
+        (uri_clause('matches', 'example.com'), True),
+        (uri_clause('matches', 'example.org'), False),
+        ({'field': '/tags', 'operator': 'one_of', 'value': 'Foo'}, True),
+        ({'field': '/tags', 'operator': 'matches', 'value': 'baz'}, False),
+        ({'field': '/tags', 'operator': 'first_of', 'value': 'foo'}, True),
+        ({'field': '/tags', 'operator': 'first_of', 'value': 'bar'}, False),
+        ({'field': '/tags', 'operator': 'match_of', 'value': ['baz', 'bar']}, True),
+        ({'field': '/tags', 'operator': 'match_of', 'value': ['baz']}, False),
+        ({'field': '/tags', 'operator': 'lene', 'value': 2}, True),
+        ({'field': '/tags', 'operator': 'leng', 'value': 2}, False),
+        ({'field': '/tags', 'operator': 'lenge', 'value': 2}, True),
+        ({'field': '/tags', 'operator': 'lenl', 'value': 2}, False),
+        ({'field': '/tags', 'operator': 'lenle', 'value': 2}, True),
+        ({'field': '/created', 'operator': 'gt', 'value': '2018-01-01'}, True),
+        ({'field': '/created', 'operator': 'lt', 'value': '2018-01-01'}, False),
+        ({'field': '/created', 'operator': 'ge', 'value': '2018-06-01'}, True),
+        ({'field': '/created', 'operator': 'le', 'value': '2018-06-01'}, False),
+        ({'field': '/text', 'operator': 'matches', 'value': 'CAFE'}, True),
+        ({'field': '/permissions/read/0', 'operator': 'equals', 'value': 'group:__world__'}, True),
+        ({'field': '/missing', 'operator': 'equals', 'value': 'foo'}, False),
+        ({'field': ['/text', '/tags'], 'operator': 'one_of', 'value': 'bar'}, True),
+        ({'field': ['/text', '/tags'], 'operator': 'one_of', 'value': 'baz'}, False),
+    ])
+    def test_evaluates_clause(self, clause, expected):
+        handler = make_handler([clause])
+
+        assert handler.match(ANNOTATION) is expected
+
+    @pytest.mark.parametrize('match_policy,expected', [
+        ('include_any', True),
+        ('include_all', False),
+        ('exclude_any', False),
+        ('exclude_all', True),
+    ])
+    def test_applies_match_policy(self, match_policy, expected):
+        handler = make_handler([uri_clause('equals', 'http://example.com/page'),
+                                uri_clause('equals', 'http://example.com/other')],
+                               match_policy=match_policy)
+
+        assert handler.match(ANNOTATION) is expected
+
+    def test_matches_everything_without_clauses(self):
+        handler = make_handler([], match_policy='include_all')
+
+        assert handler.match(ANNOTATION) is True
+
+    @pytest.mark.parametrize('action,expected', [
+        (None, True),
+        ('past', True),
+        ('create', True),
+        ('delete', False),
+    ])
+    def test_checks_action(self, action, expected):
+        handler = FilterHandler({
+            'match_policy': 'include_any',
+            'clauses': [],
+            'actions': {'create': True, 'update': True},
+        })
+
+        assert handler.match(ANNOTATION, action) is expected
+
+    @pytest.mark.parametrize('filter_json', [
+        {'match_policy': 'include_any', 'clauses': [uri_clause('bogus', 'foo')], 'actions': {}},
+        {'match_policy': 'bogus', 'clauses': [uri_clause('equals', 'foo')], 'actions': {}},
+        {'match_policy': 'include_any', 'clauses': [{'field': '/uri', 'operator': 'equals'}], 'actions': {}},
+        {'match_policy': 'include_any', 'clauses': [uri_clause('equals', 'foo')]},
+        {'match_policy': 'include_any', 'clauses': [{'field': 'uri', 'operator': 'equals', 'value': 'foo'}], 'actions': {}},
+    ])
+    def test_raises_for_invalid_filters(self, filter_json):
+        with pytest.raises(ValueError):
+            FilterHandler(filter_json)
+
+
+class TestCompileFilter(object):
+    def test_returns_filter_handler(self):
+        handler = compile_filter(self.filter_json())
+
+        assert isinstance(handler, FilterHandler)
+        assert handler.match(ANNOTATION)
+
+    def test_shares_handler_between_identical_filters(self):
+        handler = compile_filter(self.filter_json())
+
+        assert compile_filter(self.filter_json()) is handler
+
+    def test_does_not_share_handler_between_different_filters(self):
+        handler = compile_filter(self.filter_json())
+
+        assert compile_filter(self.filter_json('http://example.org/')) is not handler
+
+    def test_raises_for_invalid_filters(self):
+        with pytest.raises(ValueError):
+            compile_filter({'match_policy': 'bogus', 'clauses': [uri_clause('equals', 'foo')], 'actions': {}})
+
+    def filter_json(self, uri='http://example.com/page'):
+        return {
+            'match_policy': 'include_any',
+            'clauses': [uri_clause('one_of', [uri])],
+            'actions': {'create': True, 'update': True, 'delete': True},
+        }
+
+
+class TestUniFold(object):
+    @pytest.mark.parametrize('value,expected', [
+        ('Hello World', 'hello world'),
+        (b'Hello World', 'hello world'),
+        ('Café', 'cafe'),
+        ('ＦＵＬＬ', 'full'),
+        (42, 42),
+        (None, None),
+    ])
+    def test_folds(self, value, expected):
+        assert uni_fold(value) == expected
+
+
+class TestFilterHandlerURIs(object):
+    def test_returns_folded_values_of_one_of_uri_clause(self):
+        handler = make_handler([uri_clause('one_of', ['http://Example.com/', 'http://example.org/'])])
+
+        assert handler.uris() == {'http://example.com/', 'http://example.org/'}
+
+    def test_returns_folded_value_of_equals_uri_clause(self):
+        handler = make_handler([uri_clause('equals', 'http://Example.com/')])
+
+        assert handler.uris() == {'http://example.com/'}
+
+    def test_returns_nothing_for_equals_uri_clause_with_list_value(self):
+        handler = make_handler([uri_clause('equals', ['http://example.com/'])])
+
+        assert handler.uris() == set()
+
+    def test_returns_union_for_include_any(self):
+        handler = make_handler([uri_clause('one_of', ['http://example.com/']),
+                                uri_clause('equals', 'http://example.org/')])
+
+        assert handler.uris() == {'http://example.com/', 'http://example.org/'}
+
+    def test_returns_intersection_for_include_all(self):
+        handler = make_handler([uri_clause('one_of', ['http://example.com/', 'http://example.org/']),
+                                uri_clause('one_of', ['http://example.org/']),
+                                {'field': '/group', 'operator': 'equals', 'value': '__world__'}],
+                               match_policy='include_all')
+
+        assert handler.uris() == {'http://example.org/'}
+
+    @pytest.mark.parametrize('clauses,match_policy', [
+        # No clauses at all matches everything.
+        ([], 'include_any'),
+        # A clause on another field could match any URI.
+        ([{'field': '/group', 'operator': 'equals', 'value': '__world__'}], 'include_any'),
+        ([uri_clause('one_of', ['http://example.com/']),
+          {'field': '/group', 'operator': 'equals', 'value': '__world__'}], 'include_any'),
+        ([{'field': '/group', 'operator': 'equals', 'value': '__world__'}], 'include_all'),
+        # Substring matches can't be indexed.
+        ([uri_clause('matches', 'example.com')], 'include_any'),
+        ([uri_clause('one_of', 'example.com')], 'include_any'),
+        ([uri_clause('lt', 'http://example.com/')], 'include_any'),
+        # Neither can exclusions.
+        ([uri_clause('one_of', ['http://example.com/'])], 'exclude_any'),
+        ([uri_clause('one_of', ['http://example.com/'])], 'exclude_all'),
+    ])
+    def test_returns_none_if_filter_is_not_restricted_to_uris(self, clauses, match_policy):
+        handler = make_handler(clauses, match_policy=match_policy)
+
+        assert handler.uris() is None
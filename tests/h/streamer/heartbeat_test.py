@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import gc
+
+import mock
+import pytest
+
+from h.streamer.heartbeat import HeartbeatWheel
+
+
+class FakeSocket(object):
+    def __init__(self, last_seen=1000.0):
+        self.terminated = False
+        self.server_terminated = False
+        self.last_seen = last_seen
+        self.send_lag = 0
+        self.send_ping = mock.Mock()
+        self.close_connection = mock.Mock()
+
+
+class TestHeartbeatWheel(object):
+    def test_timeout_defaults_to_three_intervals(self):
+        assert HeartbeatWheel(interval=10).timeout == 30
+
+    def test_add_spreads_sockets_over_slots(self, wheel):
+        sockets = [FakeSocket() for _ in range(6)]
+        for socket in sockets:
+            wheel.add(socket)
+
+        wheel.tick()
+
+        pinged = [s for s in sockets if s.send_ping.called]
+        assert pinged == [sockets[0], sockets[3]]
+
+    def test_add_ignores_sockets_already_added(self, wheel):
+        socket = FakeSocket()
+
+        wheel.add(socket)
+        wheel.add(socket)
+
+        assert len(wheel) == 1
+
+    def test_visits_every_socket_once_per_revolution(self, wheel):
+        sockets = [FakeSocket() for _ in range(7)]
+        for socket in sockets:
+            wheel.add(socket)
+
+        for _ in range(3):
+            wheel.tick()
+
+        assert [s.send_ping.call_count for s in sockets] == [1] * 7
+
+    def test_remove(self, wheel):
+        socket = FakeSocket()
+        wheel.add(socket)
+
+        wheel.remove(socket)
+        wheel.tick()
+
+        assert len(wheel) == 0
+        assert not socket.send_ping.called
+
+    def test_remove_ignores_unknown_sockets(self, wheel):
+        wheel.remove(FakeSocket())
+
+    def test_tick_removes_terminated_sockets(self, wheel):
+        socket = FakeSocket()
+        socket.terminated = True
+        wheel.add(socket)
+
+        wheel.tick()
+
+        assert len(wheel) == 0
+        assert not socket.send_ping.called
+
+    def test_tick_closes_sockets_not_heard_from_within_timeout(self, wheel, clock):
+        socket = FakeSocket(last_seen=1000.0)
+        wheel.add(socket)
+        clock.return_value = 1000.0 + wheel.timeout + 1
+
+        wheel.tick()
+
+        assert socket.server_terminated
+        socket.close_connection.assert_called_once_with()
+        assert not socket.send_ping.called
+        assert len(wheel) == 0
+        assert wheel.closed_connections == 1
+
+    def test_tick_closes_sockets_with_messages_queued_for_longer_than_timeout(self, wheel):
+        socket = FakeSocket()
+        socket.send_lag = wheel.timeout + 1
+        wheel.add(socket)
+
+        wheel.tick()
+
+        socket.close_connection.assert_called_once_with()
+        assert wheel.closed_connections == 1
+
+    def test_does_not_keep_sockets_alive(self, wheel):
+        wheel.add(FakeSocket())
+        gc.collect()
+
+        assert len(wheel) == 0
+
+    @pytest.fixture
+    def clock(self):
+        return mock.Mock(return_value=1000.0)
+
+    @pytest.fixture
+    def wheel(self, clock):
+        return HeartbeatWheel(interval=30, slots=3, clock=clock)
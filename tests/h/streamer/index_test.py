@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytest
+
+from h.streamer.index import SocketIndex
+
+
+class FakeSocket(object):
+    def __init__(self, authenticated_userid=None):
+        self.authenticated_userid = authenticated_userid
+
+
+class TestSocketIndex(object):
+    def test_add_adds_socket(self, index, socket):
+        index.add(socket)
+
+        assert socket in index
+        assert list(index) == [socket]
+
+    def test_added_sockets_are_not_candidates_for_any_uri(self, index, socket):
+        index.add(socket)
+
+        assert index.sockets_for_uri('http://example.com') == []
+
+    def test_add_does_not_reset_subscription(self, index, socket):
+        index.subscribe(socket, {'http://example.com'})
+
+        index.add(socket)
+
+        assert index.sockets_for_uri('http://example.com') == [socket]
+
+    def test_sockets_for_uri_returns_subscribed_sockets(self, index):
+        socket_a = FakeSocket()
+        socket_b = FakeSocket()
+        index.subscribe(socket_a, {'http://example.com', 'http://example.org'})
+        index.subscribe(socket_b, {'http://example.org'})
+
+        assert index.sockets_for_uri('http://example.com') == [socket_a]
+        assert set(index.sockets_for_uri('http://example.org')) == {socket_a, socket_b}
+
+    def test_sockets_for_uri_folds_uri(self, index, socket):
+        index.subscribe(socket, {'http://example.com/foo'})
+
+        assert index.sockets_for_uri('HTTP://Example.com/Foo') == [socket]
+
+    def test_sockets_for_uri_returns_unindexed_sockets(self, index, socket):
+        index.subscribe(socket, None)
+
+        assert index.sockets_for_uri('http://example.com') == [socket]
+        assert index.sockets_for_uri('http://example.org') == [socket]
+
+    def test_subscribe_replaces_previous_subscription(self, index, socket):
+        index.subscribe(socket, {'http://example.com'})
+
+        index.subscribe(socket, {'http://example.org'})
+
+        assert index.sockets_for_uri('http://example.com') == []
+        assert index.sockets_for_uri('http://example.org') == [socket]
+
+    def test_subscribe_replaces_unindexed_subscription(self, index, socket):
+        index.subscribe(socket, None)
+
+        index.subscribe(socket, {'http://example.org'})
+
+        assert index.sockets_for_uri('http://example.com') == []
+
+    def test_remove_removes_socket(self, index, socket):
+        index.subscribe(socket, {'http://example.com'})
+
+        index.remove(socket)
+
+        assert socket not in index
+        assert index.sockets_for_uri('http://example.com') == []
+
+    def test_remove_removes_unindexed_socket(self, index, socket):
+        index.subscribe(socket, None)
+
+        index.remove(socket)
+
+        assert index.sockets_for_uri('http://example.com') == []
+
+    def test_remove_ignores_unknown_sockets(self, index, socket):
+        index.remove(socket)
+
+    def test_does_not_keep_sockets_alive(self, index):
+        index.subscribe(FakeSocket(), {'http://example.com'})
+        index.subscribe(FakeSocket(), None)
+
+        assert len(index) == 0
+        assert index.sockets_for_uri('http://example.com') == []
+
+    def test_sockets_for_user_returns_users_sockets(self, index):
+        socket_a = FakeSocket('acct:amy@example.com')
+        socket_b = FakeSocket('acct:amy@example.com')
+        socket_c = FakeSocket('acct:bob@example.com')
+        index.add(socket_a)
+        index.subscribe(socket_b, {'http://example.com'})
+        index.add(socket_c)
+
+        assert set(index.sockets_for_user('acct:amy@example.com')) == {socket_a, socket_b}
+        assert index.sockets_for_user('acct:bob@example.com') == [socket_c]
+        assert index.sockets_for_user('acct:cat@example.com') == []
+
+    def test_anonymous_sockets_are_not_indexed_by_user(self, index, socket):
+        index.add(socket)
+
+        assert index.sockets_for_user(None) == []
+
+    def test_subscribe_keeps_socket_indexed_by_user(self, index):
+        socket = FakeSocket('acct:amy@example.com')
+        index.add(socket)
+
+        index.subscribe(socket, {'http://example.com'})
+        index.subscribe(socket, None)
+
+        assert index.sockets_for_user('acct:amy@example.com') == [socket]
+
+    def test_remove_removes_socket_from_user_index(self, index):
+        socket = FakeSocket('acct:amy@example.com')
+        index.add(socket)
+
+        index.remove(socket)
+
+        assert index.sockets_for_user('acct:amy@example.com') == []
+
+    def test_does_not_keep_users_sockets_alive(self, index):
+        index.add(FakeSocket('acct:amy@example.com'))
+
+        assert index.sockets_for_user('acct:amy@example.com') == []
+
+    @pytest.fixture
+    def index(self):
+        return SocketIndex()
+
+    @pytest.fixture
+    def socket(self):
+        return FakeSocket()
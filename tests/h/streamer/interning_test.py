@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytest
+
+from h.streamer.interning import InternTable
+
+
+class TestInternTable(object):
+    def test_acquire_returns_value(self, table):
+        value = ('a', 'b')
+
+        assert table.acquire(value) is value
+
+    def test_acquire_returns_shared_copy_of_equal_values(self, table):
+        first = table.acquire(tuple(['a', 'b']))
+
+        assert table.acquire(tuple(['a', 'b'])) is first
+
+    def test_release_keeps_value_while_it_has_holders(self, table):
+        first = table.acquire(tuple(['a', 'b']))
+        table.acquire(tuple(['a', 'b']))
+
+        table.release(('a', 'b'))
+
+        assert ('a', 'b') in table
+        assert table.acquire(tuple(['a', 'b'])) is first
+
+    def test_release_forgets_value_with_no_holders(self, table):
+        table.acquire(('a', 'b'))
+
+        table.release(('a', 'b'))
+
+        assert ('a', 'b') not in table
+        assert len(table) == 0
+
+    def test_release_ignores_unknown_values(self, table):
+        table.release(('a', 'b'))
+
+        assert len(table) == 0
+
+    @pytest.fixture
+    def table(self):
+        return InternTable()
@@ -7,7 +7,10 @@ from gevent.queue import Queue
 from pyramid import security
 from pyramid import registry
 
+from h import realtime
 from h.streamer import messages
+from h.streamer import websocket
+from h.streamer.index import SocketIndex
 
 
 class FakeSocket(object):
@@ -28,9 +31,23 @@ class FakeSocket(object):
 
         self.send_json_payloads = []
 
+        self.prepared_messages = []
+
     def send_json(self, payload):
         self.send_json_payloads.append(payload)
 
+    def send_prepared(self, message):
+        self.prepared_messages.append(message)
+        self.send_json_payloads.append(message.payload)
+
+
+def socket_index(*sockets):
+    """Return a SocketIndex in which `sockets` are checked for every event."""
+    index = SocketIndex()
+    for socket in sockets:
+        index.subscribe(socket, None)
+    return index
+
 
 @pytest.mark.usefixtures('fake_sentry', 'fake_stats')
 class TestProcessMessages(object):
@@ -127,16 +144,21 @@ class TestProcessMessages(object):
 
 
 class TestHandleMessage(object):
-    def test_calls_handler_with_list_of_sockets(self, websocket):
+    def test_calls_handler_with_socket_index(self, websocket):
         handler = mock.Mock(return_value=None)
         session = mock.sentinel.db_session
         settings = mock.sentinel.settings
         message = messages.Message(topic='foo', payload={'foo': 'bar'})
-        websocket.instances = [FakeSocket('a'), FakeSocket('b')]
 
         messages.handle_message(message, settings, session, topic_handlers={'foo': handler})
 
-        handler.assert_called_once_with(message.payload, list(websocket.instances), settings, session)
+        handler.assert_called_once_with(message.payload, websocket.index, settings, session)
+
+    def test_raises_for_unknown_topic(self, websocket):
+        message = messages.Message(topic='foo', payload={'foo': 'bar'})
+
+        with pytest.raises(RuntimeError):
+            messages.handle_message(message, {}, None, topic_handlers={})
 
     @pytest.fixture
     def websocket(self, patch):
@@ -156,7 +178,7 @@ class TestHandleAnnotationEvent(object):
         settings = {'foo': 'bar'}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         fetch_annotation.assert_called_once_with(session, 'panda')
 
@@ -177,7 +199,7 @@ class TestHandleAnnotationEvent(object):
         settings = {'foo': 'bar'}
         fetch_annotation.return_value = None
 
-        result = messages.handle_annotation_event(message, [socket], settings, session)
+        result = messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         assert result is None
 
@@ -187,7 +209,7 @@ class TestHandleAnnotationEvent(object):
         socket = FakeSocket('giraffe')
         settings = {'h.authority': 'example.org'}
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         groupfinder_service.assert_called_once_with(session, 'example.org')
 
@@ -204,7 +226,7 @@ class TestHandleAnnotationEvent(object):
         presenters.AnnotationJSONPresenter.return_value.asdict.return_value = (
             self.serialized_annotation())
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         annotation_resource.assert_called_once_with(
             fetch_annotation.return_value,
@@ -227,7 +249,7 @@ class TestHandleAnnotationEvent(object):
         settings = {'foo': 'bar'}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         assert socket.send_json_payloads[0] == {
             'payload': [self.serialized_annotation()],
@@ -248,7 +270,7 @@ class TestHandleAnnotationEvent(object):
         settings = {'foo': 'bar'}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         assert socket.send_json_payloads[0] == {
             'payload': [{'id': annotation.id}],
@@ -264,7 +286,7 @@ class TestHandleAnnotationEvent(object):
         settings = {'foo': 'bar'}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         assert socket.send_json_payloads == []
 
@@ -277,7 +299,7 @@ class TestHandleAnnotationEvent(object):
         settings = {'foo': 'bar'}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         assert socket.send_json_payloads == []
 
@@ -289,7 +311,7 @@ class TestHandleAnnotationEvent(object):
         settings = {'foo': 'bar'}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         assert socket.send_json_payloads == []
 
@@ -302,7 +324,7 @@ class TestHandleAnnotationEvent(object):
         settings = {'foo': 'bar'}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         assert socket.send_json_payloads == []
 
@@ -315,7 +337,7 @@ class TestHandleAnnotationEvent(object):
         presenter_asdict.return_value = self.serialized_annotation()
         nipsa_service.return_value.is_flagged.return_value = True
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         assert socket.send_json_payloads == []
 
@@ -330,7 +352,7 @@ class TestHandleAnnotationEvent(object):
         presenter_asdict.return_value = self.serialized_annotation()
         nipsa_service.return_value.is_flagged.return_value = True
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         assert len(socket.send_json_payloads) == 1
 
@@ -350,7 +372,7 @@ class TestHandleAnnotationEvent(object):
         settings = {'foo': 'bar'}
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         assert len(socket.send_json_payloads) == 1
 
@@ -364,10 +386,81 @@ class TestHandleAnnotationEvent(object):
         presenter_asdict.return_value = self.serialized_annotation({
             'permissions': {'read': ['group:private-group']}})
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         assert socket.send_json_payloads == []
 
+    def test_only_checks_sockets_subscribed_to_the_annotation_uri(self,
+                                                                  fetch_annotation,
+                                                                  presenter_asdict):
+        message = {'action': '_', 'src_client_id': '_', 'annotation_id': '_'}
+        fetch_annotation.return_value.target_uri = 'http://Example.com/Page'
+        watching = FakeSocket('giraffe')
+        elsewhere = FakeSocket('pigeon')
+        unindexed = FakeSocket('panda')
+        index = SocketIndex()
+        index.subscribe(watching, {'http://example.com/page'})
+        index.subscribe(elsewhere, {'http://example.com/other'})
+        index.subscribe(unindexed, None)
+        presenter_asdict.return_value = self.serialized_annotation()
+
+        messages.handle_annotation_event(message, index, {}, mock.sentinel.db_session)
+
+        assert len(watching.send_json_payloads) == 1
+        assert len(unindexed.send_json_payloads) == 1
+        assert elsewhere.send_json_payloads == []
+        assert not elsewhere.filter.match.called
+
+    def test_presents_annotation_once_for_all_sockets(self, presenters):
+        message = {'action': '_', 'src_client_id': '_', 'annotation_id': '_'}
+        sockets = [FakeSocket('giraffe'), FakeSocket('pigeon')]
+        presenters.AnnotationJSONPresenter.return_value.asdict.return_value = (
+            self.serialized_annotation())
+
+        messages.handle_annotation_event(message, socket_index(*sockets), {}, mock.sentinel.db_session)
+
+        assert presenters.AnnotationJSONPresenter.call_count == 1
+        assert presenters.AnnotationJSONPresenter.return_value.asdict.call_count == 1
+
+    def test_does_not_present_annotation_if_no_socket_could_receive_it(self, presenters):
+        message = {'action': '_', 'src_client_id': 'pigeon', 'annotation_id': '_'}
+        socket = FakeSocket('pigeon')
+
+        messages.handle_annotation_event(message, socket_index(socket), {}, mock.sentinel.db_session)
+
+        assert not presenters.AnnotationJSONPresenter.called
+
+    def test_sends_the_same_prepared_message_to_all_sockets(self, presenter_asdict):
+        message = {'action': '_', 'src_client_id': '_', 'annotation_id': '_'}
+        sockets = [FakeSocket('giraffe'), FakeSocket('pigeon')]
+        presenter_asdict.return_value = self.serialized_annotation()
+
+        messages.handle_annotation_event(message, socket_index(*sockets), {}, mock.sentinel.db_session)
+
+        prepared = sockets[0].prepared_messages
+        assert len(prepared) == 1
+        assert sockets[1].prepared_messages == prepared
+        assert sockets[1].prepared_messages[0] is prepared[0]
+
+    def test_authorizes_each_socket_with_its_own_principals(self, presenter_asdict):
+        message = {'action': '_', 'src_client_id': '_', 'annotation_id': '_'}
+        member = FakeSocket('giraffe')
+        member.effective_principals.append('group:private-group')
+        other_member = FakeSocket('panda')
+        other_member.effective_principals.append('group:private-group')
+        non_member = FakeSocket('pigeon')
+        presenter_asdict.return_value = self.serialized_annotation({
+            'permissions': {'read': ['group:private-group']}})
+
+        messages.handle_annotation_event(message,
+                                         socket_index(member, non_member, other_member),
+                                         {},
+                                         mock.sentinel.db_session)
+
+        assert len(member.send_json_payloads) == 1
+        assert len(other_member.send_json_payloads) == 1
+        assert non_member.send_json_payloads == []
+
     def test_sends_if_in_group(self, presenter_asdict):
         """Users should see annotations in groups they are members of."""
         message = {'action': '_', 'src_client_id': '_', 'annotation_id': '_'}
@@ -379,10 +472,136 @@ class TestHandleAnnotationEvent(object):
         presenter_asdict.return_value = self.serialized_annotation({
             'permissions': {'read': ['group:private-group']}})
 
-        messages.handle_annotation_event(message, [socket], settings, session)
+        messages.handle_annotation_event(message, socket_index(socket), settings, session)
 
         assert len(socket.send_json_payloads) == 1
 
+    def test_it_uses_the_snapshot_instead_of_the_database(self,
+                                                          fetch_annotation,
+                                                          nipsa_service,
+                                                          presenters):
+        message = self.snapshot_message()
+        socket = FakeSocket('giraffe')
+
+        messages.handle_annotation_event(message, socket_index(socket), {}, mock.sentinel.db_session)
+
+        assert not fetch_annotation.called
+        assert not nipsa_service.called
+        assert not presenters.AnnotationJSONPresenter.called
+        assert socket.send_json_payloads == [{
+            'payload': [message['snapshot']['annotation']],
+            'type': 'annotation-notification',
+            'options': {'action': 'update'},
+        }]
+
+    def test_it_uses_the_snapshot_uri_to_select_sockets(self, presenter_asdict):
+        message = self.snapshot_message()
+        watching = FakeSocket('giraffe')
+        elsewhere = FakeSocket('pigeon')
+        index = SocketIndex()
+        index.subscribe(watching, {'http://example.com'})
+        index.subscribe(elsewhere, {'http://example.org'})
+
+        messages.handle_annotation_event(message, index, {}, mock.sentinel.db_session)
+
+        assert len(watching.send_json_payloads) == 1
+        assert elsewhere.send_json_payloads == []
+
+    def test_it_uses_the_snapshot_nipsa_status(self, presenter_asdict):
+        message = self.snapshot_message(nipsa=True)
+        owner = FakeSocket('giraffe')
+        owner.authenticated_userid = 'acct:fred@example.com'
+        other = FakeSocket('pigeon')
+
+        messages.handle_annotation_event(message, socket_index(owner, other), {}, mock.sentinel.db_session)
+
+        assert len(owner.send_json_payloads) == 1
+        assert other.send_json_payloads == []
+
+    def test_delete_notification_from_snapshot_has_only_the_id(self, presenter_asdict):
+        message = self.snapshot_message(action='delete')
+        socket = FakeSocket('giraffe')
+
+        messages.handle_annotation_event(message, socket_index(socket), {}, mock.sentinel.db_session)
+
+        assert socket.send_json_payloads[0]['payload'] == [{'id': 'panda'}]
+
+    def test_it_ignores_snapshots_in_other_formats(self, fetch_annotation, presenter_asdict):
+        message = self.snapshot_message()
+        message['snapshot']['version'] = 'unknown'
+        presenter_asdict.return_value = self.serialized_annotation()
+
+        messages.handle_annotation_event(message, socket_index(FakeSocket('giraffe')), {}, mock.sentinel.db_session)
+
+        fetch_annotation.assert_called_once_with(mock.sentinel.db_session, 'panda')
+
+    def test_notifications_include_the_event_id(self, presenter_asdict, replay_buffer):
+        message = {'action': 'update', 'src_client_id': '_', 'annotation_id': '_'}
+        socket = FakeSocket('giraffe')
+        presenter_asdict.return_value = self.serialized_annotation()
+
+        messages.handle_annotation_event(message, socket_index(socket), {}, mock.sentinel.db_session)
+
+        assert socket.send_json_payloads[0]['event_id'] == replay_buffer.next_id.return_value
+
+    def test_notifications_have_no_event_id_without_replay_buffer(self, presenter_asdict):
+        message = {'action': 'update', 'src_client_id': '_', 'annotation_id': '_'}
+        socket = FakeSocket('giraffe')
+        presenter_asdict.return_value = self.serialized_annotation()
+
+        messages.handle_annotation_event(message, socket_index(socket), {}, mock.sentinel.db_session)
+
+        assert 'event_id' not in socket.send_json_payloads[0]
+
+    def test_adds_detached_event_to_replay_buffer(self,
+                                                  fetch_annotation,
+                                                  presenter_asdict,
+                                                  replay_buffer):
+        annotation = fetch_annotation.return_value
+        message = {'action': 'update', 'src_client_id': 'pigeon', 'annotation_id': '_'}
+        presenter_asdict.return_value = self.serialized_annotation()
+
+        # N.B. No sockets are connected, but the event should still be
+        # buffered for any which reconnect later.
+        messages.handle_annotation_event(message, SocketIndex(), {}, mock.sentinel.db_session)
+
+        event = replay_buffer.append.call_args[0][0]
+        assert event.event_id == replay_buffer.next_id.return_value
+        assert event.annotation == (annotation.id, annotation.userid, annotation.target_uri)
+        assert event.group_service is None
+
+        # The buffered event can be replayed to a socket later.
+        socket = FakeSocket('giraffe')
+        notification = event.notification_for(socket)
+        assert notification.payload['payload'] == [self.serialized_annotation()]
+
+    def test_does_not_buffer_read_events(self, presenter_asdict, replay_buffer):
+        message = {'action': 'read', 'src_client_id': '_', 'annotation_id': '_'}
+
+        messages.handle_annotation_event(message, SocketIndex(), {}, mock.sentinel.db_session)
+
+        assert not replay_buffer.append.called
+
+    def snapshot_message(self, action='update', nipsa=False):
+        return {
+            'annotation_id': 'panda',
+            'action': action,
+            'src_client_id': 'pigeon',
+            'snapshot': {
+                'version': realtime.ANNOTATION_SNAPSHOT_VERSION,
+                'annotation': self.serialized_annotation({
+                    'id': 'panda',
+                    'uri': 'http://example.com',
+                    'user': 'acct:fred@example.com',
+                }),
+                'userid': 'acct:fred@example.com',
+                'groupid': '__world__',
+                'shared': True,
+                'target_uri': 'http://example.com',
+                'nipsa': nipsa,
+            },
+        }
+
     def serialized_annotation(self, data=None):
         if data is None:
             data = {}
@@ -426,6 +645,32 @@ class TestHandleAnnotationEvent(object):
     def annotation_resource(self, patch):
         return patch('h.streamer.messages.AnnotationContext')
 
+    @pytest.fixture
+    def replay_buffer(self):
+        replay_buffer = mock.Mock(spec_set=['append', 'next_id', 'registry'])
+        replay_buffer.next_id.return_value = 1234
+        replay_buffer.registry = registry.Registry('streamer_test')
+        replay_buffer.registry.settings = {}
+        with mock.patch.object(websocket.WebSocket, 'replay_buffer', replay_buffer):
+            yield replay_buffer
+
+
+class TestHasSnapshot(object):
+    def test_true_for_current_snapshot_version(self):
+        message = {'snapshot': {'version': realtime.ANNOTATION_SNAPSHOT_VERSION}}
+
+        assert messages.has_snapshot(message)
+
+    @pytest.mark.parametrize('message', [
+        {},
+        {'snapshot': None},
+        {'snapshot': {}},
+        {'snapshot': {'version': 'unknown'}},
+        'not a dict',
+    ])
+    def test_false_for_messages_without_usable_snapshot(self, message):
+        assert not messages.has_snapshot(message)
+
 
 class TestHandleUserEvent(object):
     def test_sends_session_change_when_joining_or_leaving_group(self):
@@ -439,7 +684,7 @@ class TestHandleUserEvent(object):
         socket = FakeSocket('clientid')
         socket.authenticated_userid = 'amy'
 
-        messages.handle_user_event(message, [socket], None, None)
+        messages.handle_user_event(message, socket_index(socket), None, None)
 
         assert socket.send_json_payloads[0] == {
             'type': 'session-change',
@@ -457,6 +702,6 @@ class TestHandleUserEvent(object):
         socket = FakeSocket('clientid')
         socket.authenticated_userid = 'bob'
 
-        messages.handle_user_event(message, [socket], None, None)
+        messages.handle_user_event(message, socket_index(socket), None, None)
 
         assert socket.send_json_payloads == []
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import mock
+import pytest
+
+from h.streamer.replay import RESUME_TOLERANCE, ReplayBuffer
+
+
+class TestReplayBuffer(object):
+    def test_next_id_is_a_timestamp_in_microseconds(self, clock):
+        buffer_ = ReplayBuffer(10, mock.sentinel.registry, clock=clock)
+        clock.return_value = 1500.25
+
+        assert buffer_.next_id() == 1500250000
+
+    def test_next_id_increases_even_if_clock_does_not(self, clock):
+        buffer_ = ReplayBuffer(10, mock.sentinel.registry, clock=clock)
+
+        first = buffer_.next_id()
+        clock.return_value = 900.0
+        second = buffer_.next_id()
+
+        assert second == first + 1
+
+    def test_since_returns_events_after_last_id(self, buffer_):
+        events = self.append_events(buffer_, 3)
+
+        complete, replayed = buffer_.since(events[0].event_id + RESUME_TOLERANCE)
+
+        assert complete
+        assert replayed == events[1:]
+
+    def test_since_replays_events_within_tolerance_of_last_id(self, buffer_):
+        events = self.append_events(buffer_, 3)
+
+        complete, replayed = buffer_.since(events[1].event_id)
+
+        assert complete
+        assert replayed == events
+
+    def test_since_is_incomplete_before_buffer_was_created(self, buffer_):
+        self.append_events(buffer_, 3)
+
+        complete, replayed = buffer_.since(900000000)
+
+        assert not complete
+        assert replayed == []
+
+    def test_since_is_incomplete_if_missed_events_were_dropped(self, clock):
+        buffer_ = ReplayBuffer(2, mock.sentinel.registry, clock=clock)
+        clock.return_value = 1010.0
+        events = self.append_events(buffer_, 3)
+
+        assert buffer_.since(events[0].event_id + RESUME_TOLERANCE - 1) == (False, [])
+        assert buffer_.since(events[0].event_id + RESUME_TOLERANCE) == (True, events[1:])
+
+    def test_keeps_at_most_size_events(self, clock):
+        buffer_ = ReplayBuffer(2, mock.sentinel.registry, clock=clock)
+
+        self.append_events(buffer_, 5)
+
+        assert len(buffer_) == 2
+
+    def append_events(self, buffer_, count):
+        events = []
+        for _ in range(count):
+            event = mock.Mock(event_id=buffer_.next_id())
+            buffer_.append(event)
+            events.append(event)
+        return events
+
+    @pytest.fixture
+    def clock(self):
+        return mock.Mock(return_value=1000.0)
+
+    @pytest.fixture
+    def buffer_(self, clock):
+        buffer_ = ReplayBuffer(10, mock.sentinel.registry, clock=clock)
+        clock.return_value = 1010.0
+        return buffer_
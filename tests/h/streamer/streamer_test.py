@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+import gevent
 import mock
 from mock import call
 import pytest
+from gevent.queue import Queue
 
+from h import realtime
 from h.streamer import messages
 from h.streamer import streamer
 from h.streamer import websocket
@@ -110,6 +113,238 @@ def test_process_work_queue_calls_close_after_rollback(session):
     ]
 
 
+class TestStart(object):
+    def test_creates_replay_buffer_if_configured(self, event, replay_buffer_class):
+        event.app.registry.settings['h.streamer.replay_buffer_size'] = '100'
+
+        streamer.start(event)
+
+        replay_buffer_class.assert_called_once_with(100, event.app.registry)
+        assert websocket.WebSocket.replay_buffer == replay_buffer_class.return_value
+
+    def test_does_not_create_replay_buffer_by_default(self, event, replay_buffer_class):
+        streamer.start(event)
+
+        assert not replay_buffer_class.called
+        assert websocket.WebSocket.replay_buffer is None
+
+    def test_enables_permessage_deflate_if_configured(self, event, permessage_deflate_class):
+        event.app.registry.settings.update({
+            'h.streamer.permessage_deflate': 'true',
+            'h.streamer.deflate_level': '1',
+            'h.streamer.deflate_context_takeover': 'true',
+        })
+
+        streamer.start(event)
+
+        permessage_deflate_class.assert_called_once_with(level=1, context_takeover=True)
+        assert websocket.WebSocket.permessage_deflate == permessage_deflate_class.return_value
+
+    def test_does_not_enable_permessage_deflate_by_default(self, event, permessage_deflate_class):
+        streamer.start(event)
+
+        assert not permessage_deflate_class.called
+        assert websocket.WebSocket.permessage_deflate is None
+
+    def test_starts_heartbeat_wheel_if_configured(self, event, gevent, heartbeat_wheel_class):
+        event.app.registry.settings['h.streamer.heartbeat_mode'] = 'wheel'
+        event.app.registry.settings['h.streamer.heartbeat_interval'] = '15'
+
+        streamer.start(event)
+
+        heartbeat_wheel_class.assert_called_once_with(15.0)
+        wheel = heartbeat_wheel_class.return_value
+        assert websocket.WebSocket.heartbeat == wheel
+        gevent.spawn.assert_any_call(wheel.run)
+
+    def test_does_not_start_heartbeat_wheel_by_default(self, event, heartbeat_wheel_class):
+        streamer.start(event)
+
+        assert not heartbeat_wheel_class.called
+        assert websocket.WebSocket.heartbeat is None
+
+    def test_raises_for_unknown_heartbeat_mode(self, event, heartbeat_wheel_class):
+        event.app.registry.settings['h.streamer.heartbeat_mode'] = 'sometimes'
+
+        with pytest.raises(ValueError):
+            streamer.start(event)
+
+    @pytest.fixture
+    def event(self):
+        event = mock.Mock()
+        event.app.registry.settings = {}
+        return event
+
+    @pytest.fixture(autouse=True)
+    def gevent(self, patch):
+        return patch('h.streamer.streamer.gevent')
+
+    @pytest.fixture
+    def replay_buffer_class(self, patch):
+        with mock.patch.object(websocket.WebSocket, 'replay_buffer', None):
+            yield patch('h.streamer.streamer.ReplayBuffer')
+
+    @pytest.fixture
+    def permessage_deflate_class(self, patch):
+        with mock.patch.object(websocket.WebSocket, 'permessage_deflate', None):
+            yield patch('h.streamer.streamer.deflate.PerMessageDeflate')
+
+    @pytest.fixture
+    def heartbeat_wheel_class(self, patch):
+        with mock.patch.object(websocket.WebSocket, 'heartbeat', None):
+            yield patch('h.streamer.streamer.heartbeat.HeartbeatWheel')
+
+
+class TestProcessWorkQueueInBatches(object):
+    def test_handles_batch_in_a_single_transaction(self, session, settings):
+        queue = make_queue([messages.Message(topic='user', payload='bar'),
+                            websocket.Message(socket=mock.sentinel.SOCKET, payload='bar'),
+                            messages.Message(topic='user', payload='baz')])
+
+        streamer.process_work_queue(settings, queue, session_factory=lambda _: session)
+
+        assert messages.handle_message.call_count == 2
+        assert websocket.handle_message.call_count == 1
+        assert session.execute.call_count == 1
+        assert session.commit.call_count == 1
+        assert session.close.call_count == 1
+
+    def test_splits_queue_into_batches_of_batch_size(self, session, settings):
+        settings['h.streamer.batch_size'] = '2'
+        queue = make_queue([messages.Message(topic='user', payload=str(i))
+                            for i in range(5)])
+
+        streamer.process_work_queue(settings, queue, session_factory=lambda _: session)
+
+        assert messages.handle_message.call_count == 5
+        assert session.commit.call_count == 3
+
+    def test_prefetches_annotations_referred_to_by_batch(self, session, settings, storage):
+        queue = make_queue([
+            messages.Message(topic='annotation', payload={'annotation_id': 'foo', 'action': 'create'}),
+            messages.Message(topic='user', payload={'userid': 'acct:bob@example.com'}),
+            messages.Message(topic='annotation', payload={'annotation_id': 'bar', 'action': 'delete'}),
+        ])
+
+        streamer.process_work_queue(settings, queue, session_factory=lambda _: session)
+
+        storage.fetch_ordered_annotations.assert_called_once_with(session,
+                                                                  ['foo', 'bar'],
+                                                                  query_processor=mock.ANY)
+
+    def test_does_not_prefetch_annotations_with_snapshots(self, session, settings, storage):
+        snapshot = {'version': realtime.ANNOTATION_SNAPSHOT_VERSION}
+        queue = make_queue([
+            messages.Message(topic='annotation', payload={'annotation_id': 'foo', 'action': 'create'}),
+            messages.Message(topic='annotation', payload={'annotation_id': 'bar', 'action': 'create',
+                                                          'snapshot': snapshot}),
+        ])
+
+        streamer.process_work_queue(settings, queue, session_factory=lambda _: session)
+
+        storage.fetch_ordered_annotations.assert_called_once_with(session,
+                                                                  ['foo'],
+                                                                  query_processor=mock.ANY)
+
+    def test_does_not_prefetch_without_annotation_messages(self, session, settings, storage):
+        queue = make_queue([messages.Message(topic='user', payload='bar')])
+
+        streamer.process_work_queue(settings, queue, session_factory=lambda _: session)
+
+        assert not storage.fetch_ordered_annotations.called
+
+    def test_still_handles_batch_if_prefetch_fails(self, session, settings, storage):
+        storage.fetch_ordered_annotations.side_effect = RuntimeError('explosion')
+        queue = make_queue([
+            messages.Message(topic='annotation', payload={'annotation_id': 'foo', 'action': 'create'}),
+        ])
+
+        streamer.process_work_queue(settings, queue, session_factory=lambda _: session)
+
+        assert messages.handle_message.call_count == 1
+        assert session.method_calls == [
+            call.execute(mock.ANY),
+            call.rollback(),
+            call.execute(mock.ANY),
+            call.commit(),
+            call.close(),
+        ]
+
+    def test_isolates_errors_to_a_single_message(self, session, settings):
+        message1 = messages.Message(topic='foo', payload='bar')
+        message2 = messages.Message(topic='foo', payload='baz')
+        queue = make_queue([message1, message2])
+        messages.handle_message.side_effect = [RuntimeError('explosion'), None]
+
+        streamer.process_work_queue(settings, queue, session_factory=lambda _: session)
+
+        assert messages.handle_message.call_count == 2
+        assert session.method_calls == [
+            call.execute(mock.ANY),
+            call.rollback(),
+            call.execute(mock.ANY),
+            call.commit(),
+            call.close(),
+        ]
+
+    def test_does_not_commit_if_last_message_fails(self, session, settings):
+        queue = make_queue([messages.Message(topic='foo', payload='bar')])
+        messages.handle_message.side_effect = RuntimeError('explosion')
+
+        streamer.process_work_queue(settings, queue, session_factory=lambda _: session)
+
+        session.commit.assert_not_called()
+        assert session.method_calls[-2:] == [call.rollback(), call.close()]
+
+    def test_reports_batch_size_and_latency(self, session, settings, stats):
+        queue = make_queue([messages.Message(topic='user', payload='bar'),
+                            messages.Message(topic='user', payload='baz')])
+
+        streamer.process_work_queue(settings, queue, session_factory=lambda _: session)
+
+        pipeline = stats.get_client.return_value.pipeline.return_value
+        pipeline.gauge.assert_called_once_with('streamer.batch.size', 2)
+        pipeline.timing.assert_called_once_with('streamer.batch.latency', mock.ANY)
+
+    def test_does_not_wait_longer_than_batch_latency(self, session, settings):
+        settings['h.streamer.batch_latency_ms'] = '20'
+        queue = Queue()
+        queue.put(messages.Message(topic='user', payload='bar'))
+        gevent.spawn_later(0.5, queue.put, StopIteration)
+
+        greenlet = gevent.spawn(streamer.process_work_queue,
+                                settings,
+                                queue,
+                                session_factory=lambda _: session)
+        gevent.sleep(0.2)
+
+        # The first batch has been handled well before the queue was closed.
+        assert messages.handle_message.call_count == 1
+        assert session.commit.call_count == 1
+        greenlet.join()
+
+    @pytest.fixture
+    def settings(self):
+        return {'h.streamer.batch_size': '10',
+                'h.streamer.batch_latency_ms': '0'}
+
+    @pytest.fixture
+    def storage(self, patch):
+        return patch('h.streamer.streamer.storage')
+
+    @pytest.fixture
+    def stats(self, patch):
+        return patch('h.streamer.streamer.stats')
+
+
+def make_queue(items):
+    queue = Queue()
+    for item in items:
+        queue.put(item)
+    queue.put(StopIteration)
+    return queue
+
+
 @pytest.fixture
 def session():
     return mock.Mock(spec_set=['close', 'commit', 'execute', 'rollback'])
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+import mock
 import pytest
 
+from h.streamer import deflate
 from h.streamer import views
 from h.streamer import streamer
+from h.streamer import websocket
 
 
 def test_websocket_view_adds_auth_state_to_environ(pyramid_config, pyramid_request):
@@ -36,6 +39,109 @@ def test_websocket_view_adds_work_queue_to_environ(pyramid_request):
     assert env['h.ws.streamer_work_queue'] == streamer.WORK_QUEUE
 
 
+def test_websocket_view_adds_send_queue_defaults_to_environ(pyramid_request):
+    pyramid_request.get_response = lambda _: None
+
+    views.websocket_view(pyramid_request)
+    env = pyramid_request.environ
+
+    assert env['h.ws.send_queue_size'] == websocket.DEFAULT_SEND_QUEUE_SIZE
+    assert env['h.ws.send_queue_overflow'] == websocket.DEFAULT_OVERFLOW_POLICY
+
+
+def test_websocket_view_adds_send_queue_settings_to_environ(pyramid_request):
+    pyramid_request.registry.settings.update({
+        'h.streamer.send_queue_size': '10',
+        'h.streamer.send_queue_overflow': 'disconnect',
+    })
+    pyramid_request.get_response = lambda _: None
+
+    views.websocket_view(pyramid_request)
+    env = pyramid_request.environ
+
+    assert env['h.ws.send_queue_size'] == 10
+    assert env['h.ws.send_queue_overflow'] == 'disconnect'
+
+
+def test_websocket_view_does_not_negotiate_deflate_by_default(pyramid_request):
+    pyramid_request.environ['HTTP_SEC_WEBSOCKET_EXTENSIONS'] = 'permessage-deflate'
+    pyramid_request.get_response = lambda _: None
+
+    views.websocket_view(pyramid_request)
+    env = pyramid_request.environ
+
+    assert env['h.ws.deflate'] is None
+
+
+def test_websocket_view_adds_negotiated_deflate_to_environ(pyramid_request, permessage_deflate):
+    pyramid_request.environ['HTTP_SEC_WEBSOCKET_EXTENSIONS'] = 'permessage-deflate'
+    pyramid_request.get_response = lambda _: None
+
+    views.websocket_view(pyramid_request)
+    env = pyramid_request.environ
+
+    assert env['h.ws.deflate'].response == ('permessage-deflate; '
+                                            'server_no_context_takeover; '
+                                            'client_no_context_takeover')
+
+
+def test_websocket_view_accepts_negotiated_deflate_in_handshake(pyramid_request, permessage_deflate, patch):
+    def fake_app(environ, start_response):
+        start_response('101 Switching Protocols', [('Upgrade', 'websocket')])
+        return []
+    patch('h.streamer.views.WebSocketWSGIApplication', return_value=fake_app)
+    start_response = mock.Mock()
+    pyramid_request.environ['HTTP_SEC_WEBSOCKET_EXTENSIONS'] = 'permessage-deflate'
+    pyramid_request.get_response = lambda app: app(pyramid_request.environ, start_response)
+
+    views.websocket_view(pyramid_request)
+
+    start_response.assert_called_once_with('101 Switching Protocols', [
+        ('Upgrade', 'websocket'),
+        ('Sec-WebSocket-Extensions', 'permessage-deflate; '
+                                     'server_no_context_takeover; '
+                                     'client_no_context_takeover'),
+    ], None)
+
+
+def test_websocket_view_does_not_accept_deflate_unless_the_handshake_succeeds(pyramid_request, permessage_deflate, patch):
+    def fake_app(environ, start_response):
+        start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+        return []
+    patch('h.streamer.views.WebSocketWSGIApplication', return_value=fake_app)
+    start_response = mock.Mock()
+    pyramid_request.environ['HTTP_SEC_WEBSOCKET_EXTENSIONS'] = 'permessage-deflate'
+    pyramid_request.get_response = lambda app: app(pyramid_request.environ, start_response)
+
+    views.websocket_view(pyramid_request)
+
+    start_response.assert_called_once_with('400 Bad Request', [
+        ('Content-Type', 'text/plain'),
+    ], None)
+
+
+def test_websocket_view_does_not_accept_deflate_unless_offered(pyramid_request, permessage_deflate, patch):
+    def fake_app(environ, start_response):
+        start_response('101 Switching Protocols', [('Upgrade', 'websocket')])
+        return []
+    patch('h.streamer.views.WebSocketWSGIApplication', return_value=fake_app)
+    start_response = mock.Mock()
+    pyramid_request.get_response = lambda app: app(pyramid_request.environ, start_response)
+
+    views.websocket_view(pyramid_request)
+
+    start_response.assert_called_once_with('101 Switching Protocols', [
+        ('Upgrade', 'websocket'),
+    ])
+
+
+@pytest.fixture
+def permessage_deflate():
+    with mock.patch.object(websocket.WebSocket, 'permessage_deflate',
+                           deflate.PerMessageDeflate()) as permessage_deflate:
+        yield permessage_deflate
+
+
 @pytest.fixture
 def pyramid_request(pyramid_request):
     return pyramid_request
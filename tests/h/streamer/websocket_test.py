@@ -2,13 +2,18 @@
 
 from __future__ import unicode_literals
 from collections import namedtuple
+import socket
 
+import gevent
 import mock
 import pytest
+from gevent.event import Event
 from gevent.queue import Queue
 from jsonschema import ValidationError
 from pyramid import security
+from ws4py.messaging import PingControlMessage
 
+from h.streamer import deflate
 from h.streamer import websocket
 
 
@@ -66,6 +71,38 @@ class TestMessage(object):
         return mock.Mock(spec_set=['send_json'])
 
 
+class TestPreparedMessage(object):
+    def test_frame_is_unmasked_text_frame_containing_json(self):
+        message = websocket.PreparedMessage({'foo': 'bar'})
+
+        frame = message.frame
+
+        # FIN bit set, text opcode, unmasked, 14 byte payload
+        assert frame[:2] == b'\x81\x0e'
+        assert frame[2:] == b'{"foo": "bar"}'
+
+    def test_frame_is_only_built_once(self, patch):
+        text_message = patch('h.streamer.websocket.TextMessage')
+        message = websocket.PreparedMessage({'foo': 'bar'})
+
+        assert message.frame is message.frame
+        text_message.assert_called_once_with('{"foo": "bar"}')
+
+    def test_deflated_frame_is_shared_by_sockets_with_same_parameters(self):
+        message = websocket.PreparedMessage({'foo': 'bar'})
+
+        frame = message.deflated_frame(deflate.Deflate(6, None, False, False))
+
+        assert message.deflated_frame(deflate.Deflate(6, None, False, True)) is frame
+        assert message.deflated_frame(deflate.Deflate(6, 10, False, False)) is not frame
+
+    def test_deflated_frame_is_not_shared_with_context_takeover(self):
+        message = websocket.PreparedMessage({'foo': 'bar'})
+        params = deflate.Deflate(6, None, True, False)
+
+        assert message.deflated_frame(params) is not message.deflated_frame(params)
+
+
 class TestWebSocket(object):
     def test_stores_instance_list(self, fake_environ):
         clients = [
@@ -89,6 +126,20 @@ class TestWebSocket(object):
         # A second closure (however unusual) should not raise
         client1.closed(1000)
 
+    def test_adds_self_to_index(self, fake_environ):
+        client = websocket.WebSocket(mock.sentinel.sock, environ=fake_environ)
+
+        assert client in websocket.WebSocket.index
+
+    def test_removes_self_from_index_when_closed(self, fake_environ):
+        client = websocket.WebSocket(mock.sentinel.sock, environ=fake_environ)
+        websocket.WebSocket.index.subscribe(client, {'http://example.com'})
+
+        client.closed(1000)
+
+        assert client not in websocket.WebSocket.index
+        assert websocket.WebSocket.index.sockets_for_uri('http://example.com') == []
+
     def test_enqueues_incoming_messages(self, client, queue):
         """Valid messages are pushed onto the queue."""
         message = FakeMessage('{"foo":"bar"}')
@@ -134,31 +185,304 @@ class TestWebSocket(object):
 
     def test_socket_sets_auth_data_from_environ(self, client):
         assert client.authenticated_userid == 'janet'
-        assert client.effective_principals == [
+        assert client.effective_principals == (
             security.Everyone,
             security.Authenticated,
             'group:__world__',
-        ]
+        )
+
+    def test_sockets_share_equal_effective_principals(self, fake_environ):
+        client1 = websocket.WebSocket(mock.sentinel.sock1, environ=fake_environ)
+        other_environ = fake_environ.copy()
+        other_environ['h.ws.effective_principals'] = list(fake_environ['h.ws.effective_principals'])
+        client2 = websocket.WebSocket(mock.sentinel.sock2, environ=other_environ)
+
+        assert client1.effective_principals is client2.effective_principals
+
+    def test_releases_effective_principals_when_closed(self, fake_environ):
+        fake_environ['h.ws.effective_principals'] = [security.Everyone, 'acct:closing@example.com']
+        client = websocket.WebSocket(mock.sentinel.sock, environ=fake_environ)
+
+        client.closed(1000)
+        # A second closure (however unusual) should not release them again
+        client.closed(1000)
+
+        assert client.effective_principals not in websocket.WebSocket.principals
+
+    def test_does_not_keep_environ(self, client):
+        assert client.environ is None
 
     def test_socket_sets_registry_from_environ(self, client):
         assert client.registry == mock.sentinel.registry
 
-    def test_socket_send_json(self, client, fake_socket_send):
+    def test_socket_send_json(self, client, fake_socket_write):
         payload = {'foo': 'bar'}
 
         client.send_json(payload)
+        gevent.sleep(0)
+
+        fake_socket_write.assert_called_once_with(
+            client, websocket.PreparedMessage(payload).frame)
+
+    def test_socket_send_prepared_writes_frame(self, client, fake_socket_write):
+        message = websocket.PreparedMessage({'foo': 'bar'})
+
+        client.send_prepared(message)
+        gevent.sleep(0)
+
+        fake_socket_write.assert_called_once_with(client, message.frame)
+
+    def test_socket_send_prepared_writes_deflated_frame_if_negotiated(self, fake_environ, fake_socket_write):
+        fake_environ['h.ws.deflate'] = deflate.Deflate(6, None, False, False)
+        client = websocket.WebSocket(mock.Mock(spec_set=['sendall']), environ=fake_environ)
+        message = websocket.PreparedMessage({'foo': 'bar'})
+
+        client.send_prepared(message)
+        gevent.sleep(0)
+
+        fake_socket_write.assert_called_once_with(
+            client, message.deflated_frame(fake_environ['h.ws.deflate']))
+
+    def test_socket_parses_compressed_messages_if_deflate_negotiated(self, fake_environ):
+        fake_environ['h.ws.deflate'] = deflate.Deflate(6, None, False, False)
+
+        client = websocket.WebSocket(mock.Mock(spec_set=['sendall']), environ=fake_environ)
+
+        assert isinstance(client.stream, deflate.DeflateStream)
 
-        fake_socket_send.assert_called_once_with(client, '{"foo": "bar"}')
+    def test_socket_send_prepared_writes_frames_in_order(self, client, fake_socket_write):
+        messages = [websocket.PreparedMessage({'n': n}) for n in range(3)]
+
+        for message in messages:
+            client.send_prepared(message)
+        gevent.sleep(0)
+
+        assert fake_socket_write.call_args_list == [
+            mock.call(client, m.frame) for m in messages]
+        assert client.send_queue_length == 0
+
+    def test_socket_send_prepared_skips_when_terminated(self,
+                                                        client,
+                                                        fake_socket_write,
+                                                        fake_socket_terminated):
+        fake_socket_terminated.return_value = True
+
+        client.send_prepared(websocket.PreparedMessage({'foo': 'bar'}))
+        gevent.sleep(0)
+
+        assert not fake_socket_write.called
 
     def test_socket_send_json_skips_when_terminated(self,
                                                     client,
-                                                    fake_socket_send,
+                                                    fake_socket_write,
                                                     fake_socket_terminated):
         fake_socket_terminated.return_value = True
 
         client.send_json({'foo': 'bar'})
+        gevent.sleep(0)
+
+        assert not fake_socket_write.called
+
+    def test_socket_send_prepared_clears_queue_when_write_fails(self, client, fake_socket_write):
+        fake_socket_write.side_effect = socket.error('Broken pipe')
+
+        client.send_prepared(websocket.PreparedMessage({'n': 1}))
+        client.send_prepared(websocket.PreparedMessage({'n': 2}))
+        gevent.sleep(0)
+
+        assert fake_socket_write.call_count == 1
+        assert client.send_queue_length == 0
+
+    def test_send_queue_length_and_lag(self, client, patch):
+        # Stop the queue being drained.
+        patch('h.streamer.websocket.WebSocket._ensure_writer')
+        time = patch('h.streamer.websocket.time')
+        time.time.return_value = 100.0
+
+        client.send_prepared(websocket.PreparedMessage({'n': 1}))
+        client.send_prepared(websocket.PreparedMessage({'n': 2}))
+        time.time.return_value = 102.5
+
+        assert client.send_queue_length == 2
+        assert client.send_lag == 2.5
+
+    def test_send_lag_is_zero_when_queue_empty(self, client):
+        assert client.send_lag == 0
+
+    def test_closed_clears_send_queue(self, client, fake_socket_write):
+        client.send_prepared(websocket.PreparedMessage({'n': 1}))
+
+        client.closed(1000)
+
+        assert client.send_queue_length == 0
+
+    def test_raises_for_unknown_overflow_policy(self, fake_environ):
+        fake_environ['h.ws.send_queue_overflow'] = 'explode'
+
+        with pytest.raises(ValueError):
+            websocket.WebSocket(mock.sentinel.sock, environ=fake_environ)
+
+    def test_drop_oldest_drops_oldest_queued_message(self, fake_environ, fake_socket_write):
+        client = self.slow_client(fake_environ, 'drop_oldest')
+        messages = [websocket.PreparedMessage({'n': n}) for n in range(3)]
+
+        for message in messages:
+            client.send_prepared(message)
+        gevent.sleep(0)
+
+        assert client.dropped_messages == 1
+        assert fake_socket_write.call_args_list == [
+            mock.call(client, m.frame) for m in messages[1:]]
+
+    def test_coalesce_merges_annotation_notifications(self, fake_environ, fake_socket_write):
+        client = self.slow_client(fake_environ, 'coalesce')
+
+        for n in range(3):
+            client.send_prepared(self.notification(n))
+        gevent.sleep(0)
+
+        assert client.dropped_messages == 0
+        frames = [c[0][1] for c in fake_socket_write.call_args_list]
+        assert frames == [
+            self.notification(0, 1).frame,
+            self.notification(2).frame,
+        ]
+
+    def test_coalesce_does_not_merge_notifications_for_different_actions(
+            self, fake_environ, fake_socket_write):
+        client = self.slow_client(fake_environ, 'coalesce')
+
+        client.send_prepared(self.notification(0, action='create'))
+        client.send_prepared(self.notification(1, action='delete'))
+        client.send_prepared(self.notification(2, action='create'))
+        gevent.sleep(0)
+
+        assert client.dropped_messages == 1
+        assert fake_socket_write.call_count == 2
+
+    def test_coalesce_drops_oldest_when_nothing_can_be_merged(self,
+                                                              fake_environ,
+                                                              fake_socket_write):
+        client = self.slow_client(fake_environ, 'coalesce')
+        messages = [websocket.PreparedMessage({'n': n}) for n in range(3)]
+
+        for message in messages:
+            client.send_prepared(message)
+        gevent.sleep(0)
+
+        assert client.dropped_messages == 1
+        assert fake_socket_write.call_args_list == [
+            mock.call(client, m.frame) for m in messages[1:]]
+
+    def test_disconnect_drops_connection(self,
+                                         fake_environ,
+                                         fake_close_connection,
+                                         fake_socket_write):
+        client = self.slow_client(fake_environ, 'disconnect')
+
+        for n in range(3):
+            client.send_prepared(websocket.PreparedMessage({'n': n}))
+        client.send_prepared(websocket.PreparedMessage({'n': 4}))
+        gevent.sleep(0)
+
+        assert not fake_socket_write.called
+        assert client.dropped_messages == 2
+        assert client.send_queue_length == 0
+        assert client.server_terminated
+        fake_close_connection.assert_called_once_with(client)
+
+    def test_disconnect_kills_a_blocked_writer(self,
+                                               fake_environ,
+                                               fake_close_connection,
+                                               fake_socket_write):
+        client = self.slow_client(fake_environ, 'disconnect')
+        # The client has stopped reading, so writing to it blocks forever.
+        fake_socket_write.side_effect = lambda *args: Event().wait()
+
+        client.send_prepared(websocket.PreparedMessage({'n': 0}))
+        gevent.sleep(0)
+        writer = client._writer
+        for n in range(1, 4):
+            client.send_prepared(websocket.PreparedMessage({'n': n}))
+        gevent.sleep(0)
+
+        assert writer.dead
+        assert client._writer is None
+        fake_close_connection.assert_called_once_with(client)
+
+    def test_coalesce_keeps_the_latest_event_id(self, fake_environ, fake_socket_write):
+        client = self.slow_client(fake_environ, 'coalesce')
+        notifications = [self.notification(n) for n in range(3)]
+        for n, notification in enumerate(notifications):
+            notification.payload['event_id'] = 100 + n
+
+        for notification in notifications:
+            client.send_prepared(notification)
+        gevent.sleep(0)
+
+        written = fake_socket_write.call_args_list[0][0][1]
+        assert b'"event_id": 101' in written
+
+    def test_runs_own_heartbeat_by_default(self, client):
+        assert client.heartbeat_freq == 30.0
+
+    def test_joins_heartbeat_wheel_if_enabled(self, fake_environ, heartbeat_wheel):
+        client = websocket.WebSocket(mock.sentinel.sock, environ=fake_environ)
+
+        assert client.heartbeat_freq is None
+        heartbeat_wheel.add.assert_called_once_with(client)
+
+    def test_leaves_heartbeat_wheel_when_closed(self, fake_environ, heartbeat_wheel):
+        client = websocket.WebSocket(mock.sentinel.sock, environ=fake_environ)
+
+        client.closed(1000)
+
+        heartbeat_wheel.remove.assert_called_once_with(client)
+
+    def test_received_message_updates_last_seen(self, client, patch):
+        time = patch('h.streamer.websocket.time')
+        time.time.return_value = 1234.0
+
+        client.received_message(FakeMessage('{"foo":"bar"}'))
+
+        assert client.last_seen == 1234.0
+
+    def test_ponged_updates_last_seen(self, client, patch):
+        time = patch('h.streamer.websocket.time')
+        time.time.return_value = 1234.0
+
+        client.ponged(mock.sentinel.pong)
+
+        assert client.last_seen == 1234.0
+
+    def test_send_ping_writes_ping_frame(self, client, fake_socket_write):
+        client.send_ping()
+        gevent.sleep(0)
+
+        frame = fake_socket_write.call_args[0][1]
+        assert frame == PingControlMessage(data='ping').single(mask=False)
 
-        assert not fake_socket_send.called
+    def test_send_ping_does_not_compress_ping_frame(self, fake_environ, fake_socket_write):
+        fake_environ['h.ws.deflate'] = deflate.Deflate(6, None, False, False)
+        client = websocket.WebSocket(mock.Mock(spec_set=['sendall']), environ=fake_environ)
+
+        client.send_ping()
+        gevent.sleep(0)
+
+        frame = fake_socket_write.call_args[0][1]
+        assert frame == PingControlMessage(data='ping').single(mask=False)
+
+    def slow_client(self, environ, policy):
+        environ['h.ws.send_queue_size'] = 2
+        environ['h.ws.send_queue_overflow'] = policy
+        return websocket.WebSocket(mock.sentinel.sock, environ=environ)
+
+    def notification(self, *ids, **kwargs):
+        return websocket.PreparedMessage({
+            'type': 'annotation-notification',
+            'options': {'action': kwargs.get('action', 'create')},
+            'payload': [{'id': id_} for id_ in ids],
+        })
 
     @pytest.fixture
     def client(self, fake_environ):
@@ -180,13 +504,23 @@ class TestWebSocket(object):
             'h.ws.streamer_work_queue': queue,
         }
 
+    @pytest.fixture
+    def heartbeat_wheel(self):
+        wheel = mock.Mock(spec_set=['add', 'remove'])
+        with mock.patch.object(websocket.WebSocket, 'heartbeat', wheel):
+            yield wheel
+
     @pytest.fixture
     def fake_socket_close(self, patch):
         return patch('h.streamer.websocket.WebSocket.close')
 
     @pytest.fixture
-    def fake_socket_send(self, patch):
-        return patch('h.streamer.websocket.WebSocket.send')
+    def fake_close_connection(self, patch):
+        return patch('h.streamer.websocket.WebSocket.close_connection')
+
+    @pytest.fixture
+    def fake_socket_write(self, patch):
+        return patch('h.streamer.websocket.WebSocket._write')
 
     @pytest.fixture
     def fake_socket_terminated(self, patch):
@@ -292,6 +626,39 @@ class TestHandleFilterMessage(object):
 
         assert socket.filter is not None
 
+    def test_indexes_socket_by_filter_uris(self, socket):
+        message = websocket.Message(socket=socket, payload={
+            'filter': {
+                'actions': {},
+                'match_policy': 'include_any',
+                'clauses': [{
+                    'field': '/uri',
+                    'operator': 'one_of',
+                    'value': ['http://example.com', 'http://example.org'],
+                }],
+            }
+        })
+
+        websocket.handle_filter_message(message)
+
+        index = websocket.WebSocket.index
+        assert index.sockets_for_uri('http://example.com') == [socket]
+        assert index.sockets_for_uri('http://example.org') == [socket]
+        assert index.sockets_for_uri('http://example.net') == []
+
+    def test_indexes_socket_with_unrestricted_filter_for_all_uris(self, socket):
+        message = websocket.Message(socket=socket, payload={
+            'filter': {
+                'actions': {},
+                'match_policy': 'include_any',
+                'clauses': [],
+            }
+        })
+
+        websocket.handle_filter_message(message)
+
+        assert socket in websocket.WebSocket.index.sockets_for_uri('http://example.net')
+
     @mock.patch('h.streamer.websocket.storage.expand_uri')
     def test_expands_uris_in_uri_filter_with_session(self, expand_uri, socket):
         expand_uri.return_value = ['http://example.com',
@@ -304,7 +671,7 @@ class TestHandleFilterMessage(object):
                 'match_policy': 'include_all',
                 'clauses': [{
                     'field': '/uri',
-                    'operator': 'equals',
+                    'operator': 'one_of',
                     'value': 'http://example.com',
                 }],
             }
@@ -312,12 +679,26 @@ class TestHandleFilterMessage(object):
 
         websocket.handle_filter_message(message, session=session)
 
-        uri_filter = socket.filter.filter['clauses'][0]
-        uri_values = uri_filter['value']
-        assert len(uri_values) == 3
-        assert 'http://example.com' in uri_values
-        assert 'http://example.com/alter' in uri_values
-        assert 'http://example.com/print' in uri_values
+        assert socket.filter.uris() == {'http://example.com',
+                                        'http://example.com/alter',
+                                        'http://example.com/print'}
+
+    def test_shares_filter_between_sockets_with_identical_filters(self, socket):
+        other_socket = mock.Mock(filter=None)
+        for s in [socket, other_socket]:
+            websocket.handle_filter_message(websocket.Message(socket=s, payload={
+                'filter': {
+                    'actions': {},
+                    'match_policy': 'include_any',
+                    'clauses': [{
+                        'field': '/uri',
+                        'operator': 'one_of',
+                        'value': ['http://example.com'],
+                    }],
+                }
+            }))
+
+        assert socket.filter is other_socket.filter
 
     @mock.patch('h.streamer.websocket.storage.expand_uri')
     def test_expands_uris_using_passed_session(self, expand_uri, socket):
@@ -364,13 +745,125 @@ class TestHandleFilterMessage(object):
         mock_reply.assert_called_once_with(matchers.MappingContaining('error'),
                                            ok=False)
 
+    def test_uncompilable_filter_error(self, matchers, socket):
+        message = websocket.Message(socket=socket, payload={
+            'type': 'filter',
+            'filter': {
+                'actions': {},
+                'match_policy': 'include_all',
+                'clauses': [{
+                    'field': '/uri',
+                    'operator': 'wibble',
+                    'value': 'http://example.com',
+                }],
+            },
+        })
+
+        with mock.patch.object(websocket.Message, 'reply') as mock_reply:
+            websocket.handle_filter_message(message)
+
+        mock_reply.assert_called_once_with(matchers.MappingContaining('error'),
+                                           ok=False)
+        assert socket.filter is None
+
     @pytest.fixture
     def socket(self):
         socket = mock.Mock()
+        socket.authenticated_userid = None
         socket.filter = None
         return socket
 
 
+class TestHandleResumeMessage(object):
+    def test_sends_missed_notifications_then_replies(self, mock_reply, replay_buffer, socket):
+        message = websocket.Message(socket=socket, payload={
+            'type': 'resume',
+            'last_event_id': 1000,
+        })
+        hidden = mock.Mock(spec_set=['notification_for'])
+        hidden.notification_for.return_value = None
+        visible = mock.Mock(spec_set=['notification_for'])
+        replay_buffer.since.return_value = (True, [hidden, visible])
+
+        websocket.handle_resume_message(message)
+
+        replay_buffer.since.assert_called_once_with(1000)
+        hidden.notification_for.assert_called_once_with(socket)
+        socket.send_prepared.assert_called_once_with(
+            visible.notification_for.return_value)
+        mock_reply.assert_called_once_with({'type': 'resume', 'complete': True})
+
+    def test_replies_incomplete_if_events_missing(self, mock_reply, replay_buffer, socket):
+        message = websocket.Message(socket=socket, payload={
+            'type': 'resume',
+            'last_event_id': 1000,
+        })
+        replay_buffer.since.return_value = (False, [])
+
+        websocket.handle_resume_message(message)
+
+        assert not socket.send_prepared.called
+        mock_reply.assert_called_once_with({'type': 'resume', 'complete': False})
+
+    def test_replies_incomplete_if_replay_disabled(self, mock_reply, socket):
+        message = websocket.Message(socket=socket, payload={
+            'type': 'resume',
+            'last_event_id': 1000,
+        })
+
+        websocket.handle_resume_message(message)
+
+        mock_reply.assert_called_once_with({'type': 'resume', 'complete': False})
+
+    @pytest.mark.parametrize('payload', [
+        {'type': 'resume'},
+        {'type': 'resume', 'last_event_id': '1000'},
+        {'type': 'resume', 'last_event_id': True},
+        {'type': 'resume', 'last_event_id': 10.5},
+    ])
+    def test_error_if_last_event_id_missing_or_invalid(self,
+                                                       matchers,
+                                                       mock_reply,
+                                                       payload,
+                                                       replay_buffer,
+                                                       socket):
+        message = websocket.Message(socket=socket, payload=payload)
+
+        websocket.handle_resume_message(message)
+
+        mock_reply.assert_called_once_with(matchers.MappingContaining('error'),
+                                           ok=False)
+        assert not replay_buffer.since.called
+
+    def test_error_if_no_filter_set(self, matchers, mock_reply, replay_buffer, socket):
+        socket.filter = None
+        message = websocket.Message(socket=socket, payload={
+            'type': 'resume',
+            'last_event_id': 1000,
+        })
+
+        websocket.handle_resume_message(message)
+
+        mock_reply.assert_called_once_with(matchers.MappingContaining('error'),
+                                           ok=False)
+        assert not replay_buffer.since.called
+
+    @pytest.fixture
+    def mock_reply(self):
+        with mock.patch.object(websocket.Message, 'reply') as mock_reply:
+            yield mock_reply
+
+    @pytest.fixture
+    def replay_buffer(self):
+        replay_buffer = mock.Mock(spec_set=['since'])
+        with mock.patch.object(websocket.WebSocket, 'replay_buffer', replay_buffer):
+            yield replay_buffer
+
+    @pytest.fixture
+    def socket(self):
+        return mock.Mock(spec_set=['filter', 'send_prepared'])
+
+
 class TestHandlePingMessage(object):
     def test_pong(self):
         message = websocket.Message(socket=mock.sentinel.socket, payload={
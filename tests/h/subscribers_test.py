@@ -4,8 +4,10 @@ from __future__ import unicode_literals
 import mock
 import pytest
 
+from h import realtime
 from h import subscribers
-from h.events import AnnotationEvent
+from h.events import AnnotationEvent, DocumentMergedEvent
+from h.interfaces import IGroupService
 
 
 class FakeMailer(object):
@@ -84,6 +86,71 @@ class TestPublishAnnotationEvent:
             'src_client_id': 'client_id'
         })
 
+    def test_it_does_not_embed_a_snapshot_by_default(self, event):
+        subscribers.publish_annotation_event(event)
+
+        payload = event.request.realtime.publish_annotation.call_args[0][0]
+        assert 'snapshot' not in payload
+
+    def test_it_embeds_a_snapshot_of_the_annotation(self,
+                                                    annotation,
+                                                    event,
+                                                    nipsa_service,
+                                                    presenters,
+                                                    snapshots_enabled):
+        subscribers.publish_annotation_event(event)
+
+        payload = event.request.realtime.publish_annotation.call_args[0][0]
+        assert payload['snapshot'] == {
+            'version': realtime.ANNOTATION_SNAPSHOT_VERSION,
+            'annotation': presenters.AnnotationJSONPresenter.return_value.asdict.return_value,
+            'userid': annotation.userid,
+            'groupid': annotation.groupid,
+            'shared': annotation.shared,
+            'target_uri': annotation.target_uri,
+            'nipsa': nipsa_service.is_flagged.return_value,
+        }
+        nipsa_service.is_flagged.assert_called_once_with(annotation.userid)
+
+    def test_it_omits_the_snapshot_if_the_annotation_is_missing(self,
+                                                                event,
+                                                                fetch_annotation,
+                                                                snapshots_enabled):
+        fetch_annotation.return_value = None
+
+        subscribers.publish_annotation_event(event)
+
+        payload = event.request.realtime.publish_annotation.call_args[0][0]
+        assert 'snapshot' not in payload
+
+    @pytest.fixture
+    def annotation(self, factories):
+        return factories.Annotation()
+
+    @pytest.fixture
+    def fetch_annotation(self, annotation, patch):
+        fetch_annotation = patch('h.subscribers.storage.fetch_annotation')
+        fetch_annotation.return_value = annotation
+        return fetch_annotation
+
+    @pytest.fixture
+    def presenters(self, patch):
+        return patch('h.subscribers.presenters')
+
+    @pytest.fixture
+    def nipsa_service(self, pyramid_config):
+        service = mock.Mock(spec_set=['is_flagged'])
+        service.is_flagged.return_value = False
+        pyramid_config.register_service(service, name='nipsa')
+        return service
+
+    @pytest.fixture
+    def snapshots_enabled(self, pyramid_config, pyramid_request, fetch_annotation):
+        pyramid_request.registry.settings['h.realtime.annotation_snapshots'] = 'true'
+        pyramid_request.tm = mock.MagicMock()
+        pyramid_config.register_service(mock.sentinel.group_service, iface=IGroupService)
+        pyramid_config.register_service(mock.sentinel.links_service, name='links')
+
     @pytest.fixture
     def event(self, pyramid_request):
         pyramid_request.realtime = mock.Mock()
@@ -139,3 +206,27 @@ class TestSendReplyNotifications(object):
     def pyramid_request(self, pyramid_request):
         pyramid_request.tm = mock.MagicMock()
         return pyramid_request
+
+
+class TestUpdateAnnotationDocumentCount(object):
+    def test_it_queues_a_recount_of_the_annotations_document(self, annotation_counts, pyramid_request):
+        event = AnnotationEvent(pyramid_request, 'test-annotation-id', 'create')
+
+        subscribers.update_annotation_document_count(event)
+
+        annotation_counts.update_annotation_document_count.delay.assert_called_once_with(
+            'test-annotation-id')
+
+
+class TestUpdateMergedDocumentCount(object):
+    def test_it_queues_a_recount_of_the_merged_document(self, annotation_counts, pyramid_request):
+        event = DocumentMergedEvent(pyramid_request, 42)
+
+        subscribers.update_merged_document_count(event)
+
+        annotation_counts.update_document_annotation_counts.delay.assert_called_once_with([42])
+
+
+@pytest.fixture
+def annotation_counts(patch):
+    return patch('h.subscribers.annotation_counts')
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import mock
+import pytest
+
+from h.tasks import annotation_counts
+
+
+@pytest.mark.usefixtures('celery')
+class TestUpdateAnnotationDocumentCount(object):
+    def test_it_recounts_the_annotations_document(self, factories, count_service):
+        annotation = factories.Annotation()
+
+        annotation_counts.update_annotation_document_count(annotation.id)
+
+        count_service.update.assert_called_once_with([annotation.document_id])
+
+    def test_it_does_nothing_if_the_annotation_is_missing(self, count_service):
+        annotation_counts.update_annotation_document_count('missing-annotation-id')
+
+        assert not count_service.update.called
+
+
+@pytest.mark.usefixtures('celery')
+class TestUpdateDocumentAnnotationCounts(object):
+    def test_it_recounts_the_documents(self, count_service):
+        annotation_counts.update_document_annotation_counts([1, 2])
+
+        count_service.update.assert_called_once_with([1, 2])
+
+
+@pytest.mark.usefixtures('celery')
+class TestReconcileDocumentAnnotationCounts(object):
+    def test_it_recounts_every_document(self, count_service):
+        annotation_counts.reconcile_document_annotation_counts()
+
+        count_service.update_all.assert_called_once_with()
+
+    def test_it_commits_each_window(self, count_service, pyramid_request):
+        windows_done = []
+        commits = []
+        pyramid_request.tm.commit.side_effect = lambda: commits.append(len(windows_done))
+
+        def update_all():
+            for window in ([1, 2], [3]):
+                windows_done.append(window)
+                yield window
+        count_service.update_all.side_effect = update_all
+
+        annotation_counts.reconcile_document_annotation_counts()
+
+        assert commits == [1, 2]
+
+
+@pytest.fixture
+def celery(patch, pyramid_request):
+    cel = patch('h.tasks.annotation_counts.celery')
+    cel.request = pyramid_request
+    return cel
+
+
+@pytest.fixture
+def pyramid_request(pyramid_request):
+    pyramid_request.tm = mock.Mock(spec_set=['commit'])
+    return pyramid_request
+
+
+@pytest.fixture
+def count_service(pyramid_config):
+    svc = mock.Mock(spec_set=['update', 'update_all'])
+    svc.update_all.return_value = iter([])
+    pyramid_config.register_service(svc, name='document_annotation_count')
+    return svc
@@ -5,6 +5,8 @@ from __future__ import unicode_literals
 import mock
 import pytest
 
+from h import realtime as realtime_
+from h.search import result_cache as result_cache_
 from h.tasks import indexer
 
 
@@ -67,6 +69,32 @@ class TestAddAnnotation(object):
                               celery.request,
                               target_index='hypothesis-xyz123')
 
+    def test_it_invalidates_cached_search_results_once_indexed(self, factories, index, realtime,
+                                                               result_cache):
+        annotation = factories.Annotation()
+        called_after = []
+        realtime.publish_search_invalidation.side_effect = (
+            lambda payload: called_after.append(index.called))
+
+        indexer.add_annotation(annotation.id)
+
+        assert called_after == [True]
+        uris = realtime.publish_search_invalidation.call_args[0][0]['uris']
+        assert annotation.target_uri_normalized in uris
+        for document_uri in annotation.document.document_uris:
+            assert document_uri.uri_normalized in uris
+
+    def test_it_does_not_invalidate_search_results_if_the_cache_is_disabled(self, fetch_annotation,
+                                                                            annotation,
+                                                                            result_cache,
+                                                                            realtime):
+        result_cache.enabled = False
+        fetch_annotation.return_value = annotation
+
+        indexer.add_annotation('test-annotation-id')
+
+        assert not realtime.publish_search_invalidation.called
+
     def test_it_indexes_thread_root(self, fetch_annotation, reply, delay):
         fetch_annotation.return_value = reply
 
@@ -106,6 +134,19 @@ class TestDeleteAnnotation(object):
 
         delete.assert_any_call(celery.request.es, id_)
 
+    def test_it_invalidates_cached_search_results_once_deleted(self, factories, delete, realtime,
+                                                               result_cache):
+        annotation = factories.Annotation(deleted=True)
+        called_after = []
+        realtime.publish_search_invalidation.side_effect = (
+            lambda payload: called_after.append(delete.called))
+
+        indexer.delete_annotation(annotation.id)
+
+        assert called_after == [True]
+        uris = realtime.publish_search_invalidation.call_args[0][0]['uris']
+        assert annotation.target_uri_normalized in uris
+
     def test_during_reindex_deletes_from_current_index(self, delete, celery, settings_service):
         settings_service.put('reindex.new_index', 'hypothesis-xyz123')
 
@@ -128,6 +169,58 @@ class TestDeleteAnnotation(object):
         return patch('h.tasks.indexer.delete')
 
 
+@pytest.mark.usefixtures('celery', 'settings_service')
+class TestSearchResultInvalidation(object):
+    """
+    The indexer and the caches of search results are in different processes.
+
+    These tests give the worker and a web process a cache each, and connect
+    them through an in-memory broker rather than mocking either cache.
+    """
+
+    @pytest.mark.parametrize('task,task_function', [
+        (indexer.add_annotation, 'h.tasks.indexer.index'),
+        (indexer.delete_annotation, 'h.tasks.indexer.delete'),
+    ])
+    def test_it_invalidates_the_results_cached_by_web_processes(self, factories, patch, worker_cache,
+                                                                web_cache, web_listener, task,
+                                                                task_function):
+        patch(task_function)
+        annotation = factories.Annotation()
+        other_annotation = factories.Annotation()
+        web_cache.set('search', mock.sentinel.result, [annotation.target_uri_normalized])
+        web_cache.set('other_search', mock.sentinel.other_result,
+                      [other_annotation.target_uri_normalized])
+
+        with web_listener.consumer().Consumer() as (connection, _, _):
+            task(annotation.id)
+            connection.drain_events(timeout=1)
+
+        assert web_cache.get('search') is None
+        assert web_cache.get('other_search') == mock.sentinel.other_result
+        # The worker itself never caches any results.
+        assert len(worker_cache) == 0
+
+    @pytest.fixture
+    def settings(self):
+        return {'broker_url': 'memory://'}
+
+    @pytest.fixture
+    def worker_cache(self, pyramid_request, settings):
+        pyramid_request.realtime = realtime_.Publisher(settings)
+        cache = result_cache_.ResultCache(ttl=60)
+        with mock.patch('h.tasks.indexer.result_cache.cache', cache):
+            yield cache
+
+    @pytest.fixture
+    def web_cache(self):
+        return result_cache_.ResultCache(ttl=60)
+
+    @pytest.fixture
+    def web_listener(self, web_cache, settings):
+        return result_cache_.Listener(web_cache, settings)
+
+
 @pytest.mark.usefixtures('celery')
 class TestReindexUserAnnotations(object):
     def test_it_creates_batch_indexer(self, batch_indexer, annotation_ids, celery):
@@ -162,6 +255,25 @@ class TestReindexUserAnnotations(object):
         }
 
 
+@pytest.mark.usefixtures('celery')
+class TestReindexDocumentAnnotations(object):
+    def test_it_reindexes_documents_annotations(self, batch_indexer, factories):
+        # N.B. The annotation factory finds each annotation's document by its
+        # target URI, so annotations of the same document must share one.
+        annotations = factories.Annotation.create_batch(3, target_uri='http://example.com/')
+        expected = [a.id for a in annotations]
+        factories.Annotation(target_uri='http://example.org/')
+
+        indexer.reindex_document_annotations(annotations[0].document.id)
+
+        args, _ = batch_indexer.return_value.index.call_args
+        assert sorted(args[0]) == sorted(expected)
+
+    @pytest.fixture
+    def batch_indexer(self, patch):
+        return patch('h.tasks.indexer.BatchIndexer')
+
+
 @pytest.fixture
 def celery(patch, pyramid_request):
     cel = patch('h.tasks.indexer.celery')
@@ -175,6 +287,19 @@ def pyramid_request(pyramid_request):
     return pyramid_request
 
 
+@pytest.fixture
+def realtime(pyramid_request):
+    pyramid_request.realtime = mock.Mock(spec_set=['publish_search_invalidation'])
+    return pyramid_request.realtime
+
+
+@pytest.fixture
+def result_cache():
+    cache = mock.Mock(spec_set=['enabled'], enabled=True)
+    with mock.patch('h.tasks.indexer.result_cache.cache', cache):
+        yield cache
+
+
 @pytest.fixture
 def settings_service(pyramid_config):
     service = FakeSettingsService()
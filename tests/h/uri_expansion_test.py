@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import mock
+import pytest
+
+from h import uri_expansion
+
+
+class TestExpansionCache(object):
+    def test_get_returns_none_for_uncached_uri(self, cache):
+        assert cache.get('http://example.com/') is None
+
+    def test_get_returns_cached_expansion(self, cache):
+        cache.set('http://example.com/', ['http://example.com/', 'http://example.org/'])
+
+        assert cache.get('http://example.com/') == ['http://example.com/',
+                                                    'http://example.org/']
+
+    def test_get_returns_a_copy_of_the_expansion(self, cache):
+        cache.set('http://example.com/', ['http://example.com/'])
+
+        cache.get('http://example.com/').append('http://example.org/')
+
+        assert cache.get('http://example.com/') == ['http://example.com/']
+
+    def test_get_returns_none_once_the_expansion_expires(self, cache, clock):
+        cache.set('http://example.com/', ['http://example.com/'])
+
+        clock.return_value += 60
+
+        assert cache.get('http://example.com/') is None
+        assert len(cache) == 0
+
+    def test_set_drops_the_least_recently_used_expansion(self, cache):
+        cache.size = 2
+        cache.set('http://a.com/', ['http://a.com/'])
+        cache.set('http://b.com/', ['http://b.com/'])
+        cache.get('http://a.com/')
+
+        cache.set('http://c.com/', ['http://c.com/'])
+
+        assert cache.get('http://a.com/') is not None
+        assert cache.get('http://b.com/') is None
+        assert cache.get('http://c.com/') is not None
+
+    def test_invalidate_forgets_expansions_of_equivalent_uris(self, cache):
+        cache.set('http://example.com/', ['http://example.com/'])
+        cache.set('https://example.com', ['https://example.com'])
+        cache.set('http://example.org/', ['http://example.org/'])
+
+        cache.invalidate(['http://example.com'])
+
+        assert cache.get('http://example.com/') is None
+        assert cache.get('https://example.com') is None
+        assert cache.get('http://example.org/') is not None
+
+    def test_nothing_is_cached_if_ttl_is_zero(self, cache):
+        cache.ttl = 0
+
+        cache.set('http://example.com/', ['http://example.com/'])
+
+        assert cache.get('http://example.com/') is None
+        assert len(cache) == 0
+
+    def test_get_reports_hits_and_misses(self, cache):
+        cache.stats = mock.Mock(spec_set=['incr'])
+
+        cache.get('http://example.com/')
+        cache.set('http://example.com/', ['http://example.com/'])
+        cache.get('http://example.com/')
+
+        assert cache.stats.incr.call_args_list == [
+            mock.call('uri_expansion.cache.miss'),
+            mock.call('uri_expansion.cache.hit'),
+        ]
+
+    @pytest.fixture
+    def clock(self):
+        return mock.Mock(return_value=1000.0)
+
+    @pytest.fixture
+    def cache(self, clock):
+        return uri_expansion.ExpansionCache(ttl=30, clock=clock)
+
+
+class TestIncludeMe(object):
+    def test_configures_the_cache(self, pyramid_config):
+        pyramid_config.registry.settings.update({
+            'h.uri_expansion.cache_ttl': 30,
+            'h.uri_expansion.cache_size': 100,
+        })
+
+        try:
+            uri_expansion.includeme(pyramid_config)
+
+            assert uri_expansion.cache.ttl == 30
+            assert uri_expansion.cache.size == 100
+        finally:
+            uri_expansion.cache.ttl = 0
+            uri_expansion.cache.clear()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytest
+
+from h.util import cursor
+
+
+class TestCursor(object):
+    @pytest.mark.parametrize('values', [
+        [1514764800000, 'AVxaJAJ-zNMXJuTaNnTl'],
+        ['acct:bob@example.com', 'id'],
+        [1.5],
+    ])
+    def test_decode_returns_encoded_values(self, values):
+        assert cursor.decode(cursor.encode(values)) == values
+
+    def test_encode_returns_url_safe_string(self):
+        encoded = cursor.encode(['???>>>', 'id'])
+
+        assert all(c.isalnum() or c in '-_' for c in encoded)
+
+    @pytest.mark.parametrize('value', [
+        '',
+        'not a cursor',
+        'e30',  # {}
+        'W10',  # []
+        '☃',
+    ])
+    def test_decode_raises_for_invalid_cursors(self, value):
+        with pytest.raises(ValueError):
+            cursor.decode(value)
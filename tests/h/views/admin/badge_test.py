@@ -62,6 +62,30 @@ class TestBadgeAddRemove(object):
 
         assert not models.Blocklist.is_blocked(pyramid_request.db, 'blocked2')
 
+    @pytest.mark.parametrize('view,params', [
+        (badge_add, {'add': 'test_uri'}),
+        (badge_remove, {'remove': 'blocked1'}),
+    ])
+    def test_it_reloads_the_blocklist_matcher_after_commit(self, pyramid_request, matcher,
+                                                           view, params):
+        pyramid_request.params = params
+
+        view(pyramid_request)
+
+        assert not matcher.invalidate.called
+        hook = pyramid_request.tm.get.return_value.addAfterCommitHook.call_args[0][0]
+        hook(True)
+        matcher.invalidate.assert_called_once_with()
+
+    @pytest.fixture
+    def matcher(self, patch):
+        return patch('h.views.admin.badge.blocklist.matcher')
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request):
+        pyramid_request.tm = mock.Mock()
+        return pyramid_request
+
     def test_remove_redirects_to_index(self, pyramid_request):
         pyramid_request.params = {'remove': 'blocked1'}
 
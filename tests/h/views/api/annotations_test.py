@@ -27,6 +27,7 @@ class TestIndex(object):
         pyramid_config.add_route('api.annotations', '/dummy/annotations')
         pyramid_config.add_route('api.annotation', '/dummy/annotations/:id')
         pyramid_config.add_route('api.links', '/dummy/links')
+        pyramid_config.add_route('api.export', '/dummy/export')
 
         result = views.index(testing.DummyResource(), pyramid_request)
 
@@ -46,6 +47,8 @@ class TestIndex(object):
             host + '/dummy/annotations/:id')
         assert links['search']['method'] == 'GET'
         assert links['search']['url'] == host + '/dummy/search'
+        assert links['export']['method'] == 'GET'
+        assert links['export']['url'] == host + '/dummy/export'
 
 
 class TestLinks(object):
@@ -82,13 +85,17 @@ class TestSearch(object):
 
     def test_it_searches(self, pyramid_request, search_lib):
         pyramid_request.stats = mock.Mock()
+        search_lib.REPLIES_MAX_DEFAULT = 200
 
         views.search(pyramid_request)
 
         search = search_lib.Search.return_value
         search_lib.Search.assert_called_with(pyramid_request,
                                              separate_replies=False,
-                                             stats=pyramid_request.stats)
+                                             stats=pyramid_request.stats,
+                                             all_replies=False,
+                                             replies_max=200,
+                                             replies_cursor=None)
 
         expected_params = MultiDict([
             ('sort', 'updated'),
@@ -114,26 +121,64 @@ class TestSearch(object):
 
         assert views.search(pyramid_request) == expected
 
-    def test_it_presents_replies(self, pyramid_request, search_run, presentation_service):
+    def test_it_presents_annotations_and_replies_together(self, pyramid_request, search_run, presentation_service):
         pyramid_request.params = NestedMultiDict(MultiDict({'_separate_replies': '1'}))
         search_run.return_value = SearchResult(1, ['row-1'], ['reply-1', 'reply-2'], {})
+        presentation_service.present_all.return_value = []
 
         views.search(pyramid_request)
 
-        presentation_service.present_all.assert_called_with(['reply-1', 'reply-2'])
+        presentation_service.present_all.assert_called_once_with(['row-1', 'reply-1', 'reply-2'])
 
     def test_it_returns_replies(self, pyramid_request, search_run, presentation_service):
         pyramid_request.params = NestedMultiDict(MultiDict({'_separate_replies': '1'}))
         search_run.return_value = SearchResult(1, ['row-1'], ['reply-1', 'reply-2'], {})
+        presentation_service.present_all.return_value = [
+            {'id': 'row-1'}, {'id': 'reply-1'}, {'id': 'reply-2'},
+        ]
 
         expected = {
             'total': 1,
-            'rows': presentation_service.present_all(['row-1']),
-            'replies': presentation_service.present_all(['reply-1', 'reply-2'])
+            'rows': [{'id': 'row-1'}],
+            'replies': [{'id': 'reply-1'}, {'id': 'reply-2'}],
         }
 
         assert views.search(pyramid_request) == expected
 
+    def test_it_searches_for_all_replies(self, pyramid_request, search_lib, presentation_service):
+        pyramid_request.params = NestedMultiDict(MultiDict({
+            '_separate_replies': '1',
+            '_all_replies': '1',
+            '_replies_cursor': 'WzEsImlkIl0',
+        }))
+        # Settings from the config file are strings.
+        pyramid_request.registry.settings['h.search.replies_max'] = '1000'
+        presentation_service.present_all.return_value = []
+
+        views.search(pyramid_request)
+
+        _, kwargs = search_lib.Search.call_args
+        assert kwargs['all_replies'] is True
+        assert kwargs['replies_max'] == 1000
+        assert kwargs['replies_cursor'] == 'WzEsImlkIl0'
+
+    def test_it_returns_replies_cursor(self, pyramid_request, search_run, presentation_service):
+        pyramid_request.params = NestedMultiDict(MultiDict({'_separate_replies': '1',
+                                                            '_all_replies': '1'}))
+        search_run.return_value = SearchResult(1, ['row-1'], ['reply-1'], {}, 'cursor')
+        presentation_service.present_all.return_value = [{'id': 'row-1'}, {'id': 'reply-1'}]
+
+        assert views.search(pyramid_request)['replies_cursor'] == 'cursor'
+
+    @pytest.mark.parametrize('separate_replies', ['0', '1'])
+    def test_it_returns_next_cursor(self, pyramid_request, search_run, presentation_service,
+                                    separate_replies):
+        pyramid_request.params = NestedMultiDict(MultiDict({'_separate_replies': separate_replies}))
+        search_run.return_value = SearchResult(1, ['row-1'], [], {}, next_cursor='cursor')
+        presentation_service.present_all.return_value = [{'id': 'row-1'}]
+
+        assert views.search(pyramid_request)['next_cursor'] == 'cursor'
+
     @pytest.fixture
     def search_lib(self, patch):
         return patch('h.views.api.annotations.search_lib')
@@ -147,6 +192,98 @@ class TestSearch(object):
         return patch('h.views.api.annotations.storage')
 
 
+class TestExport(object):
+    def test_it_exports_annotations_matching_the_query(self, pyramid_request, export_service):
+        pyramid_request.params = NestedMultiDict(MultiDict({'group': 'abc123'}))
+
+        views.export(pyramid_request)
+
+        params = export_service.export.call_args[0][0]
+        assert params['group'] == 'abc123'
+
+    def test_it_raises_if_the_query_is_invalid(self, pyramid_request, export_service):
+        pyramid_request.params = NestedMultiDict(MultiDict({'group': 'abc123', 'sort': 'bogus'}))
+
+        with pytest.raises(ValidationError):
+            views.export(pyramid_request)
+
+    @pytest.mark.parametrize('params', [
+        {},
+        {'uri': 'http://example.com'},
+        {'group': ''},
+    ])
+    def test_it_raises_unless_limited_to_a_group_or_user(self, pyramid_request, export_service,
+                                                         params):
+        pyramid_request.params = NestedMultiDict(MultiDict(params))
+
+        with pytest.raises(ValidationError):
+            views.export(pyramid_request)
+
+        assert not export_service.export.called
+
+    def test_it_exports_a_users_annotations(self, pyramid_request, export_service):
+        pyramid_request.params = NestedMultiDict(MultiDict({'user': 'acct:bob@example.com'}))
+
+        views.export(pyramid_request)
+
+        assert export_service.export.called
+
+    @pytest.mark.parametrize('params', [
+        [('group', '__world__')],
+        [('group', 'abc123'), ('group', '__world__')],
+        [('group', '__world__'), ('user', '')],
+    ])
+    def test_it_raises_for_the_public_group_unless_limited_to_a_user(self, pyramid_request,
+                                                                     export_service, params):
+        pyramid_request.params = NestedMultiDict(MultiDict(params))
+
+        with pytest.raises(ValidationError):
+            views.export(pyramid_request)
+
+        assert not export_service.export.called
+
+    def test_it_exports_a_users_annotations_in_the_public_group(self, pyramid_request,
+                                                                export_service):
+        pyramid_request.params = NestedMultiDict(MultiDict({'group': '__world__',
+                                                            'user': 'acct:bob@example.com'}))
+
+        views.export(pyramid_request)
+
+        params = export_service.export.call_args[0][0]
+        assert params['group'] == '__world__'
+        assert params['user'] == 'acct:bob@example.com'
+
+    def test_it_streams_ndjson(self, pyramid_request, export_service):
+        export_service.export.return_value = iter(['{"id": "a"}\n', '{"id": "b"}\n'])
+
+        response = views.export(pyramid_request)
+
+        assert response.content_type == 'application/x-ndjson'
+        assert list(response.app_iter) == [b'{"id": "a"}\n', b'{"id": "b"}\n']
+
+    def test_it_closes_the_session_when_done(self, pyramid_request, export_service):
+        export_service.export.return_value = iter([])
+
+        list(views.export(pyramid_request).app_iter)
+
+        pyramid_request.tm.abort.assert_called_once_with()
+        pyramid_request.db.close.assert_called_once_with()
+
+    @pytest.fixture
+    def export_service(self, pyramid_config):
+        svc = mock.Mock(spec_set=['export'])
+        svc.export.return_value = iter([])
+        pyramid_config.register_service(svc, name='annotation_export')
+        return svc
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request):
+        pyramid_request.params = NestedMultiDict(MultiDict({'group': 'abc123'}))
+        pyramid_request.tm = mock.Mock(spec_set=['abort'])
+        pyramid_request.db = mock.Mock(spec_set=['close'])
+        return pyramid_request
+
+
 @pytest.mark.usefixtures('AnnotationEvent',
                          'create_schema',
                          'links_service',
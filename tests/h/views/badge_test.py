@@ -8,7 +8,7 @@ import mock
 from pyramid import httpexceptions
 from webob.multidict import MultiDict
 
-from h.views.badge import badge
+from h.views.badge import BATCH_MAX_URIS, badge, badge_batch
 
 
 badge_fixtures = pytest.mark.usefixtures('models', 'search_lib')
@@ -61,6 +61,167 @@ def test_badge_raises_if_no_uri():
         badge(mock.Mock(params={}))
 
 
+@pytest.mark.usefixtures('models', 'search_lib')
+class TestBadgeWithStoredCounts(object):
+    def test_it_returns_the_stored_count(self, pyramid_request, count_service, search_run):
+        count_service.count.return_value = 7
+
+        result = badge(pyramid_request)
+
+        count_service.count.assert_called_once_with('http://example.com')
+        assert not search_run.called
+        assert result == {'total': 7}
+
+    def test_it_returns_0_without_checking_the_blocklist_if_never_annotated(self, models,
+                                                                            pyramid_request,
+                                                                            count_service):
+        count_service.count.return_value = 0
+
+        result = badge(pyramid_request)
+
+        models.Blocklist.is_blocked.assert_not_called()
+        assert result == {'total': 0}
+
+    def test_it_returns_0_if_blocked(self, models, pyramid_request, count_service):
+        count_service.count.return_value = 7
+        models.Blocklist.is_blocked.return_value = True
+
+        result = badge(pyramid_request)
+
+        models.Blocklist.is_blocked.assert_called_once_with(pyramid_request.db, 'http://example.com')
+        assert result == {'total': 0}
+
+    def test_it_searches_if_the_uri_has_not_been_counted(self, pyramid_request, count_service,
+                                                         search_run):
+        count_service.count.return_value = None
+        search_run.return_value = mock.Mock(total=29)
+
+        result = badge(pyramid_request)
+
+        search_run.assert_called_once_with(MultiDict({'uri': 'http://example.com', 'limit': 0}))
+        assert result == {'total': 29}
+
+    @pytest.fixture
+    def count_service(self, pyramid_config):
+        svc = mock.Mock(spec_set=['count'])
+        pyramid_config.register_service(svc, name='document_annotation_count')
+        return svc
+
+    @pytest.fixture
+    def models(self, models):
+        models.Blocklist.is_blocked.return_value = False
+        return models
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request):
+        pyramid_request.feature.flags['badge_counts'] = True
+        pyramid_request.params['uri'] = 'http://example.com'
+        return pyramid_request
+
+
+@pytest.mark.usefixtures('models', 'search_lib')
+class TestBadgeBatch(object):
+    def test_it_returns_the_stored_count_of_each_uri(self, pyramid_request, count_service):
+        count_service.counts.return_value = {'http://a.com': 3, 'http://b.com': 0}
+        self.add_uris(pyramid_request, 'http://a.com', 'http://b.com')
+
+        result = badge_batch(pyramid_request)
+
+        assert result == {'http://a.com': 3, 'http://b.com': 0}
+
+    def test_it_deduplicates_the_uris(self, pyramid_request, count_service):
+        count_service.counts.return_value = {'http://a.com': 3}
+        self.add_uris(pyramid_request, 'http://a.com', 'http://a.com')
+
+        badge_batch(pyramid_request)
+
+        count_service.counts.assert_called_once_with(['http://a.com'])
+
+    def test_it_returns_0_for_blocked_uris(self, models, pyramid_request, count_service):
+        count_service.counts.return_value = {'http://a.com': 3, 'http://b.com': 0,
+                                             'http://blocked.com': 5}
+        models.Blocklist.blocked_uris.return_value = set(['http://blocked.com'])
+        self.add_uris(pyramid_request, 'http://a.com', 'http://b.com', 'http://blocked.com')
+
+        result = badge_batch(pyramid_request)
+
+        models.Blocklist.blocked_uris.assert_called_once_with(pyramid_request.db,
+                                                              ['http://a.com', 'http://blocked.com'])
+        assert result['http://blocked.com'] == 0
+
+    def test_it_counts_uncounted_uris_with_one_multi_search(self, models, pyramid_request,
+                                                            count_service, run_totals):
+        count_service.counts.return_value = {'http://a.com': 3, 'http://b.com': None,
+                                             'http://c.com': None, 'http://blocked.com': None}
+        models.Blocklist.blocked_uris.return_value = set(['http://blocked.com'])
+        run_totals.return_value = [29, 7]
+        self.add_uris(pyramid_request, 'http://a.com', 'http://b.com', 'http://c.com',
+                      'http://blocked.com')
+
+        result = badge_batch(pyramid_request)
+
+        run_totals.assert_called_once_with([MultiDict({'uri': 'http://b.com', 'limit': 0}),
+                                            MultiDict({'uri': 'http://c.com', 'limit': 0})])
+        assert result == {'http://a.com': 3, 'http://b.com': 29, 'http://c.com': 7,
+                          'http://blocked.com': 0}
+
+    def test_it_does_not_search_if_every_uri_has_been_counted(self, pyramid_request,
+                                                              count_service, run_totals):
+        count_service.counts.return_value = {'http://a.com': 3}
+        self.add_uris(pyramid_request, 'http://a.com')
+
+        badge_batch(pyramid_request)
+
+        assert not run_totals.called
+
+    def test_it_is_not_found_unless_counts_are_enabled(self, pyramid_request, count_service):
+        pyramid_request.feature.flags['badge_counts'] = False
+        self.add_uris(pyramid_request, 'http://a.com')
+
+        with pytest.raises(httpexceptions.HTTPNotFound):
+            badge_batch(pyramid_request)
+
+        assert not count_service.counts.called
+
+    def test_it_raises_if_no_uris(self, pyramid_request):
+        self.add_uris(pyramid_request)
+
+        with pytest.raises(httpexceptions.HTTPBadRequest):
+            badge_batch(pyramid_request)
+
+    def test_it_raises_if_too_many_uris(self, pyramid_request, count_service):
+        self.add_uris(pyramid_request, *['http://example.com/{}'.format(i)
+                                         for i in range(BATCH_MAX_URIS + 1)])
+
+        with pytest.raises(httpexceptions.HTTPBadRequest):
+            badge_batch(pyramid_request)
+
+        assert not count_service.counts.called
+
+    def add_uris(self, pyramid_request, *uris):
+        pyramid_request.params = MultiDict([('uri', uri) for uri in uris])
+
+    @pytest.fixture
+    def run_totals(self, search_lib):
+        return search_lib.Search.return_value.run_totals
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request):
+        pyramid_request.feature.flags['badge_counts'] = True
+        return pyramid_request
+
+    @pytest.fixture
+    def count_service(self, pyramid_config):
+        svc = mock.Mock(spec_set=['counts'])
+        pyramid_config.register_service(svc, name='document_annotation_count')
+        return svc
+
+    @pytest.fixture
+    def models(self, models):
+        models.Blocklist.blocked_uris.return_value = set()
+        return models
+
+
 @pytest.fixture
 def models(patch):
     return patch('h.views.badge.models')
@@ -87,4 +248,5 @@ def mark_uri_as_annotated(factories, pyramid_request):
 @pytest.fixture
 def pyramid_request(pyramid_request):
     pyramid_request.stats = mock.Mock()
+    pyramid_request.feature.flags['badge_counts'] = False
     return pyramid_request